@@ -1,5 +1,4 @@
 # main.py
-import os
 import tkinter as tk
 import webbrowser
 from threading import Thread
@@ -14,6 +13,16 @@ import web_server
 import network_services
 import system_utils
 import media_manager
+import transcode_cache
+import pretranscode
+import subtitle_cache
+import trickplay
+import thumbnail_store
+import device_profiles
+import library_gc
+import upnp_handler
+import object_ids
+import search_index
 from settings_gui import SettingsWindow
 # === THE FIX: Import the new file watcher module ===
 import file_watcher
@@ -26,13 +35,19 @@ def initial_setup():
     """Performs all necessary startup tasks."""
     print("--- GoldMedia Python Server Starting ---")
     
-    os.makedirs(config.THUMBNAIL_DIR, exist_ok=True)
-
     config.settings.update(config.load_settings())
     config.load_playback_cache()
     config.load_media_info_cache()
+    search_index.rebuild()
+    object_ids.load()
     
     media_manager.find_ffmpeg_and_ffprobe()
+    transcode_cache.init_cache()
+    pretranscode.init_cache()
+    subtitle_cache.init_cache()
+    trickplay.init_cache()
+    thumbnail_store.init_store()
+    media_manager.migrate_legacy_thumbnails()
     system_utils.setup_custom_icon()
 
 def start_background_services():
@@ -44,10 +59,22 @@ def start_background_services():
     thumbnail_thread = Thread(target=media_manager.thumbnail_worker, daemon=True)
     thumbnail_thread.start()
 
-    # === THE FIX: Perform an initial full scan, then start the real-time watcher ===
+    media_manager.load_job_journal()
+    Thread(target=media_manager.job_journal_worker, daemon=True).start()
+
+    pretranscode_thread = Thread(target=pretranscode.pretranscode_worker, daemon=True)
+    pretranscode_thread.start()
+
+    trickplay_thread = Thread(target=trickplay.trickplay_worker, daemon=True)
+    trickplay_thread.start()
+
+    gc_thread = Thread(target=library_gc.gc_worker, daemon=True)
+    gc_thread.start()
+
+    # Scan the library (after a clean shutdown only folders that changed), then start the real-time watcher.
     # The periodic scanner is no longer needed.
     print("Performing initial library scan...")
-    initial_scan_thread = Thread(target=media_manager.scan_all_media_folders, daemon=True)
+    initial_scan_thread = Thread(target=media_manager.startup_scan, daemon=True)
     initial_scan_thread.start()
     file_watcher.start_watching()
 
@@ -66,17 +93,66 @@ def start_background_services():
     time.sleep(2)
     network_services.trigger_ssdp_refresh()
 
+# Settings that change what clients see when browsing (DIDL-Lite, web UI listings).
+LIBRARY_SETTINGS = {"media_folders", "transcode_formats", "enable_transcoding", "enable_pretranscode", "generate_thumbnails"}
+
 def on_settings_saved():
-    """Callback function for when settings are saved in the GUI."""
-    print("Settings changed. Reloading and notifying network...")
+    """
+    Callback function for when settings are saved in the GUI. Only the subsystems whose
+    settings changed are reapplied, so saving costs nothing on a large library.
+    """
+    old_settings = dict(config.settings)
     config.settings.clear()
     config.settings.update(config.load_settings())
-    system_utils.setup_custom_icon()
-    network_services.trigger_ssdp_refresh()
-    
-    # === THE FIX: Restart the watcher and trigger a new scan for new folders ===
-    file_watcher.restart_watching()
-    Thread(target=media_manager.scan_all_media_folders, daemon=True).start()
+    changed = {key for key in set(old_settings) | set(config.settings) if old_settings.get(key) != config.settings.get(key)}
+    if not changed:
+        print("Settings saved, nothing changed.")
+        return
+    print(f"Settings changed: {', '.join(sorted(changed))}")
+
+    if "server_icon_path" in changed:
+        system_utils.setup_custom_icon()
+    if "transcode_cache_size_mb" in changed:
+        transcode_cache.init_cache()
+    if "prepared_cache_size_mb" in changed:
+        pretranscode.init_cache()
+    if "subtitle_cache_size_mb" in changed:
+        subtitle_cache.init_cache()
+    if "trickplay_cache_size_mb" in changed:
+        trickplay.init_cache()
+    if changed & {"transcode_formats", "enable_transcoding"}:
+        device_profiles.clear_client_cache()
+    if changed & LIBRARY_SETTINGS:
+        config.bump_library_generation()
+    if "cache_mode" in changed:
+        config.bump_playback_generation()
+    if changed & {"server_name", "server_icon_path"}:
+        # The device description changed; nothing about the library did.
+        network_services.trigger_ssdp_refresh()
+    if "enable_upnp" in changed and config.settings.get("enable_upnp"):
+        Thread(target=network_services.setup_upnp, daemon=True).start()
+    if "server_port" in changed:
+        print("The new server port takes effect after a restart.")
+
+    # Thumbnails were off until now: queue them for the whole library.
+    rescan_all = "generate_thumbnails" in changed and config.settings.get("generate_thumbnails")
+    if changed & {"media_folders", "polled_folders"}:
+        old_folders, new_folders = old_settings.get("media_folders", []), config.settings.get("media_folders", [])
+        added = [folder for folder in new_folders if folder not in old_folders]
+        removed = [folder for folder in old_folders if folder not in new_folders]
+        file_watcher.sync_watched_roots()
+        # Folder names are indexed relative to the media folder a file is in.
+        Thread(target=search_index.rebuild, daemon=True).start()
+        if removed:
+            # Object IDs resolve without a path check, so IDs of removed folders must go right away.
+            object_ids.forget_outside(new_folders)
+            Thread(target=media_manager.purge_media_folders, args=(removed,), daemon=True).start()
+        if added and not rescan_all:
+            Thread(target=media_manager.scan_all_media_folders, args=(added,), daemon=True).start()
+        if added or removed:
+            upnp_handler.trigger_upnp_refresh()
+    if rescan_all:
+        Thread(target=media_manager.scan_all_media_folders, daemon=True).start()
 
 # --- System Tray Menu Functions ---
 def open_web_ui(icon, item):
@@ -92,6 +168,7 @@ def quit_app(icon, item):
     """Handles application shutdown."""
     print("Shutdown initiated...")
     file_watcher.stop_watching()
+    media_manager.write_clean_shutdown_marker()
     icon.stop()
     for ip in network_services.get_all_local_ips():
         if ip != '127.0.0.1':
@@ -10,12 +10,28 @@ DEFAULT_SETTINGS = {
     "server_name": "GoldMedia Python Server", "server_port": 9005, "media_folders": ["C:\\Users\\Public\\Videos"],
     "start_on_startup": False, "generate_thumbnails": True, "thumbnail_timestamp": 4, "enable_upnp": True,
     "server_icon_path": "assets/tray_icon.png", "cache_mode": "Global",
-    "enable_transcoding": False, "transcode_formats": ".mkv,.avi,.webm,.mov"
+    "enable_transcoding": False, "transcode_formats": ".mkv,.avi,.webm,.mov",
+    "transcode_cache_size_mb": 10240,
+    "enable_pretranscode": False, "pretranscode_popular_plays": 2, "prepared_cache_size_mb": 51200,
+    "subtitle_cache_size_mb": 256, "enable_trickplay": True, "trickplay_cache_size_mb": 1024,
+    "file_stable_seconds": 10,
+    "polled_folders": [], "poll_interval_seconds": 30, "poll_io_budget": 2000,
+    "gc_interval_hours": 24, "gc_checks_per_second": 200
 }
 SETTINGS_FILE = "settings.json"
 PLAYBACK_CACHE_FILE = "playback_cache.json"
 MEDIA_INFO_CACHE_FILE = "media_info_cache.json"
-THUMBNAIL_DIR = os.path.join('static', '.thumbnails')
+DEVICE_PROFILES_FILE = "device_profiles.json"
+THUMBNAIL_DIR = os.path.join('static', '.thumbnails')  # Legacy loose files, migrated into the thumbnail store
+THUMBNAIL_PACK_FILE = os.path.join('cache', 'thumbnails.pack')
+THUMBNAIL_INDEX_FILE = os.path.join('cache', 'thumbnails.idx')
+TRANSCODE_CACHE_DIR = os.path.join('cache', 'transcode')
+PREPARED_DIR = os.path.join('cache', 'prepared')
+SUBTITLE_CACHE_DIR = os.path.join('cache', 'subtitles')
+TRICKPLAY_CACHE_DIR = os.path.join('cache', 'trickplay')
+JOB_QUEUE_FILE = os.path.join('cache', 'jobs.json')
+CLEAN_SHUTDOWN_FILE = os.path.join('cache', 'clean_shutdown.json')
+OBJECT_ID_FILE = os.path.join('cache', 'object_ids.log')
 CUSTOM_ICON_FILENAME = "custom_icon.png"
 SERVER_UUID = hashlib.md5(socket.gethostname().encode()).hexdigest()
 
@@ -34,6 +50,18 @@ system_update_id = 1
 # Format: { 'sid': {'callback': 'url', 'expiry': timestamp} }
 subscriptions = {}
 
+# Number of media streams currently being sent, so background jobs can yield to playback.
+stream_state_lock = Lock()
+active_streams = 0
+# HLS players fetch short segments, so playback counts as active for a while after the last request.
+last_segment_request_time = 0
+
+# Change counters used to build ETags and to memoize responses. library_generation changes whenever
+# listings or metadata may have changed; playback_generation whenever resume positions changed.
+generation_lock = Lock()
+library_generation = 0
+playback_generation = 0
+
 
 # --- Functions ---
 # (The rest of the file remains unchanged)
@@ -100,4 +128,14 @@ def save_media_info_cache():
             with open(MEDIA_INFO_CACHE_FILE, 'w') as f:
                 json.dump(media_info_cache, f, indent=2)
         except Exception as e:
-            print(f"Error saving media info cache: {e}")
\ No newline at end of file
+            print(f"Error saving media info cache: {e}")
+
+def bump_library_generation():
+    global library_generation
+    with generation_lock:
+        library_generation += 1
+
+def bump_playback_generation():
+    global playback_generation
+    with generation_lock:
+        playback_generation += 1
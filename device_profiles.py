@@ -0,0 +1,156 @@
+# device_profiles.py
+import os
+import re
+import json
+from threading import Lock
+
+import config
+
+# Delivery methods, cheapest first.
+DIRECT, PREPARED, REMUX, TRANSCODE = 'direct', 'prepared', 'remux', 'transcode'
+
+# Built-in renderer profiles, checked in order; the first whose pattern matches the
+# User-Agent or X-AV-Client-Info header wins. A codec/limit of None means "anything".
+# 'remux_container' is the container the device accepts for stream-copied content.
+DEVICE_PROFILES = [
+    {
+        'name': 'VLC / Kodi',
+        'match': [r'VLC/', r'LibVLC', r'Kodi', r'XBMC'],
+        'containers': ['mp4', 'mkv', 'avi', 'mov', 'webm', 'mpegts'],
+        'video_codecs': None, 'audio_codecs': None,
+        'max_width': None, 'max_height': None, 'max_bitrate': None,
+        'remux_container': 'mpegts',
+    },
+    {
+        'name': 'Web Browser',
+        'match': [r'Mozilla/5\.0.*(Chrome|Firefox|Safari|Edg)/'],
+        'containers': ['mp4', 'webm', 'mov'],
+        'video_codecs': ['h264', 'vp8', 'vp9', 'av1'], 'audio_codecs': ['aac', 'mp3', 'opus', 'vorbis', 'flac'],
+        'max_width': None, 'max_height': None, 'max_bitrate': None,
+        'remux_container': None,
+    },
+    {
+        'name': 'Samsung TV',
+        'match': [r'SEC_HHP_', r'Samsung', r'SamsungWiselinkPro'],
+        'containers': ['mp4', 'mkv', 'avi', 'mpegts'],
+        'video_codecs': ['h264', 'mpeg4', 'mpeg2video', 'hevc'], 'audio_codecs': ['aac', 'ac3', 'mp3', 'eac3'],
+        'max_width': 1920, 'max_height': 1080, 'max_bitrate': 40000000,
+        'remux_container': 'mpegts',
+    },
+    {
+        'name': 'LG TV',
+        'match': [r'LGE_DLNA_SDK', r'LG-', r'webOS'],
+        'containers': ['mp4', 'mkv', 'avi', 'mpegts'],
+        'video_codecs': ['h264', 'hevc', 'mpeg4', 'mpeg2video'], 'audio_codecs': ['aac', 'ac3', 'eac3', 'mp3'],
+        'max_width': 3840, 'max_height': 2160, 'max_bitrate': 60000000,
+        'remux_container': 'mpegts',
+    },
+    {
+        'name': 'Sony Bravia',
+        'match': [r'BRAVIA', r'SonyDTV', r'KDL-'],
+        'containers': ['mp4', 'mpegts'],
+        'video_codecs': ['h264', 'mpeg2video'], 'audio_codecs': ['aac', 'ac3', 'mp3'],
+        'max_width': 1920, 'max_height': 1080, 'max_bitrate': 25000000,
+        'remux_container': 'mpegts',
+    },
+    {
+        'name': 'Xbox / PlayStation',
+        'match': [r'Xbox', r'PLAYSTATION', r'PS4', r'PS5'],
+        'containers': ['mp4', 'mkv', 'avi', 'mpegts'],
+        'video_codecs': ['h264', 'hevc', 'mpeg4', 'mpeg2video'], 'audio_codecs': ['aac', 'ac3', 'mp3'],
+        'max_width': 3840, 'max_height': 2160, 'max_bitrate': None,
+        'remux_container': 'mpegts',
+    },
+]
+
+_client_profile_cache = {}
+_client_profile_lock = Lock()
+_custom_profiles = None
+
+def _load_custom_profiles():
+    """Loads user-defined profiles from device_profiles.json; they are checked before the built-in ones."""
+    global _custom_profiles
+    _custom_profiles = []
+    if os.path.exists(config.DEVICE_PROFILES_FILE):
+        try:
+            with open(config.DEVICE_PROFILES_FILE, 'r') as f:
+                _custom_profiles = json.load(f)
+            print(f"Loaded {len(_custom_profiles)} custom device profiles.")
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Warning: Could not read {config.DEVICE_PROFILES_FILE}: {e}")
+
+def register_profile(profile):
+    """Adds a profile ahead of the built-in ones and forgets cached client matches."""
+    DEVICE_PROFILES.insert(0, profile)
+    clear_client_cache()
+
+def clear_client_cache():
+    with _client_profile_lock:
+        _client_profile_cache.clear()
+
+def get_default_profile():
+    """The fallback profile mirrors the global settings: everything not in transcode_formats plays directly."""
+    transcode_formats = [f.strip().lstrip('.') for f in config.settings.get("transcode_formats", "").split(',') if f.strip()]
+    containers = [c for c in ('mp4', 'mkv', 'avi', 'mov', 'webm') if c not in transcode_formats] + ['mpegts']
+    return {
+        'name': 'Generic DLNA', 'match': [], 'containers': containers,
+        'video_codecs': None, 'audio_codecs': None,
+        'max_width': None, 'max_height': None, 'max_bitrate': None,
+        'remux_container': None,
+    }
+
+def get_client_profile(request):
+    """Returns the profile for the requesting client, cached per client IP and identifying headers."""
+    user_agent = request.headers.get('User-Agent', '')
+    av_client_info = request.headers.get('X-AV-Client-Info', '')
+    cache_key = (request.remote_addr, user_agent, av_client_info)
+    with _client_profile_lock:
+        profile = _client_profile_cache.get(cache_key)
+    if profile:
+        return profile
+
+    if _custom_profiles is None:
+        _load_custom_profiles()
+    profile = None
+    for candidate in _custom_profiles + DEVICE_PROFILES:
+        if any(re.search(pattern, user_agent) or re.search(pattern, av_client_info) for pattern in candidate.get('match', [])):
+            profile = candidate
+            break
+    if profile is None:
+        profile = get_default_profile()
+    print(f"Device profile for {request.remote_addr}: {profile['name']}")
+    with _client_profile_lock:
+        _client_profile_cache[cache_key] = profile
+    return profile
+
+def container_of(video_path):
+    ext = os.path.splitext(video_path)[1].lower().lstrip('.')
+    return {'m4v': 'mp4', 'ts': 'mpegts', 'm2ts': 'mpegts'}.get(ext, ext)
+
+def _streams_supported(profile, media_info):
+    """Checks codecs and limits against probed info. Anything not probed yet is assumed to be fine."""
+    video_codec, audio_codec = media_info.get('video_codec'), media_info.get('audio_codec')
+    if video_codec and profile.get('video_codecs') is not None and video_codec not in profile['video_codecs']: return False
+    if audio_codec and profile.get('audio_codecs') is not None and audio_codec not in profile['audio_codecs']: return False
+    width, height, bitrate = media_info.get('width', 0), media_info.get('height', 0), media_info.get('bitrate', 0)
+    if profile.get('max_width') and width > profile['max_width']: return False
+    if profile.get('max_height') and height > profile['max_height']: return False
+    if profile.get('max_bitrate') and bitrate > profile['max_bitrate']: return False
+    return True
+
+def choose_delivery(profile, video_path, media_info, prepared_available=False):
+    """
+    Picks the cheapest way to deliver a file to a client: direct, then a prepared copy,
+    then a stream-copy remux, then a full transcode. Falls back to direct when
+    transcoding is disabled in the settings.
+    """
+    streams_ok = _streams_supported(profile, media_info)
+    if streams_ok and container_of(video_path) in profile['containers']:
+        return DIRECT
+    if not config.settings.get("enable_transcoding", False):
+        return DIRECT
+    if prepared_available and 'mp4' in profile['containers'] and (profile.get('video_codecs') is None or 'h264' in profile['video_codecs']):
+        return PREPARED
+    if streams_ok and profile.get('remux_container'):
+        return REMUX
+    return TRANSCODE
@@ -0,0 +1,212 @@
+# disk_cache.py
+import os
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+
+# Every cache created in this process, so a renamed file's entries can be moved in all of them.
+_all_caches = weakref.WeakSet()
+
+def rename_prefix_everywhere(old_prefix, new_prefix):
+    """Calls rename_prefix on every disk cache."""
+    for cache in list(_all_caches):
+        cache.rename_prefix(old_prefix, new_prefix)
+
+def discard_prefix_everywhere(prefix):
+    """Calls discard_prefix on every disk cache."""
+    for cache in list(_all_caches):
+        cache.discard_prefix(prefix)
+
+def discard_orphans_everywhere(is_live):
+    """Calls discard_orphans on every disk cache. Returns (entries removed, bytes freed)."""
+    removed = freed = 0
+    for cache in list(_all_caches):
+        count, size = cache.discard_orphans(is_live)
+        removed += count
+        freed += size
+    return removed, freed
+
+class KeyedLocks:
+    """
+    One lock per cache entry (or per file version) being produced, so concurrent requests for
+    it wait for the first one instead of writing the same temporary file. A key's lock is
+    counted while held or waited for and only dropped when the last thread leaves, so a thread
+    arriving meanwhile queues on the same lock rather than creating a second one.
+    """
+
+    def __init__(self):
+        self.guard = Lock()
+        self.locks = {}  # key -> [lock, threads holding or waiting for it]
+
+    @contextmanager
+    def hold(self, key):
+        with self.guard:
+            entry = self.locks.setdefault(key, [Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.locks[key]
+
+class DiskLRUCache:
+    """
+    A directory of cache files bounded by total size. Entries are addressed by a
+    relative name (e.g. 'abc123/mpegts_00012.ts') and evicted least-recently-used first.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.entries = OrderedDict()  # name -> size in bytes, oldest first
+        self.total_bytes = 0
+        self._load()
+        _all_caches.add(self)
+
+    def _load(self):
+        """Rebuilds the index from the files on disk, oldest access first."""
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                full_path = os.path.join(root, name)
+                if name.endswith('.tmp'):
+                    # Left behind by an interrupted write; never valid.
+                    try: os.remove(full_path)
+                    except OSError: pass
+                    continue
+                try:
+                    st = os.stat(full_path)
+                except OSError:
+                    continue
+                rel_name = os.path.relpath(full_path, self.directory).replace(os.sep, '/')
+                found.append((max(st.st_atime, st.st_mtime), rel_name, st.st_size))
+        found.sort()
+        with self.lock:
+            for _, rel_name, size in found:
+                self.entries[rel_name] = size
+                self.total_bytes += size
+        print(f"Disk cache '{self.directory}': {len(found)} entries, {self.total_bytes // (1024 * 1024)} MB.")
+
+    def path_for(self, name):
+        """Returns the absolute on-disk path for an entry name (the entry may not exist yet)."""
+        return os.path.join(self.directory, *name.split('/'))
+
+    def temp_path_for(self, name):
+        """Returns a temporary path to write an entry to before calling add(), creating its folder."""
+        path = self.path_for(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path + '.tmp'
+
+    def get(self, name):
+        """Returns the path of a cached entry and marks it as recently used, or None."""
+        with self.lock:
+            if name not in self.entries:
+                return None
+            self.entries.move_to_end(name)
+        path = self.path_for(name)
+        if not os.path.exists(path):
+            self.discard(name)
+            return None
+        return path
+
+    def contains(self, name):
+        with self.lock:
+            return name in self.entries
+
+    def add(self, name, temp_path=None):
+        """
+        Registers a finished entry. If temp_path is given it is atomically moved into
+        place first. Evicts old entries if the cache is over its size limit.
+        """
+        path = self.path_for(name)
+        if temp_path:
+            os.replace(temp_path, path)
+        size = os.path.getsize(path)
+        with self.lock:
+            self.total_bytes -= self.entries.pop(name, 0)
+            self.entries[name] = size
+            self.total_bytes += size
+        self.evict()
+        return path
+
+    def discard(self, name):
+        """Forgets an entry and deletes its file, returning the number of bytes freed."""
+        with self.lock:
+            size = self.entries.pop(name, None)
+            if size is None:
+                return 0
+            self.total_bytes -= size
+        self._remove_file(name)
+        return size
+
+    def discard_prefix(self, prefix):
+        """Discards every entry whose name starts with prefix (e.g. all segments of one file)."""
+        with self.lock:
+            names = [name for name in self.entries if name.startswith(prefix)]
+        return sum(self.discard(name) for name in names)
+
+    def discard_orphans(self, is_live):
+        """Discards every entry for which is_live(name) is false. Returns (entries removed, bytes freed)."""
+        with self.lock:
+            names = [name for name in self.entries if not is_live(name)]
+        return len(names), sum(self.discard(name) for name in names)
+
+    def rename_prefix(self, old_prefix, new_prefix):
+        """
+        Moves every entry whose name starts with old_prefix to the same name under new_prefix
+        (e.g. when the file it was derived from was renamed). Returns the number of entries moved.
+        """
+        with self.lock:
+            names = [name for name in self.entries if name.startswith(old_prefix)]
+        moved = 0
+        for name in names:
+            new_name = new_prefix + name[len(old_prefix):]
+            old_path, new_path = self.path_for(name), self.path_for(new_name)
+            try:
+                os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                os.replace(old_path, new_path)
+            except OSError as e:
+                print(f"Disk cache: could not move '{old_path}': {e}")
+                continue
+            with self.lock:
+                size = self.entries.pop(name, None)
+                if size is None:
+                    continue
+                self.total_bytes -= self.entries.pop(new_name, 0)
+                self.entries[new_name] = size
+            moved += 1
+            try:
+                os.rmdir(os.path.dirname(old_path))  # Only succeeds once the per-file folder is empty
+            except OSError:
+                pass
+        return moved
+
+    def evict(self):
+        """Removes least-recently-used entries until the cache fits in max_bytes."""
+        while True:
+            with self.lock:
+                if self.total_bytes <= self.max_bytes or not self.entries:
+                    return
+                name, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+            self._remove_file(name)
+
+    def _remove_file(self, name):
+        path = self.path_for(name)
+        try:
+            os.remove(path)
+        except OSError as e:
+            # On Windows a file still being streamed cannot be deleted; it is simply dropped from the index.
+            if os.path.exists(path):
+                print(f"Disk cache: could not remove '{path}': {e}")
+            return
+        try:
+            os.rmdir(os.path.dirname(path))  # Only succeeds once the per-file folder is empty
+        except OSError:
+            pass
@@ -0,0 +1,52 @@
+# events.py
+import json
+import queue
+from threading import Lock
+
+# Each connected web UI holds one waitress worker thread, so the number of streams is capped.
+MAX_SUBSCRIBERS = 16
+KEEPALIVE_SECONDS = 15
+
+_subscribers = set()
+_subscribers_lock = Lock()
+
+def subscribe():
+    """Registers a new listener and returns its event queue, or None if too many are connected."""
+    with _subscribers_lock:
+        if len(_subscribers) >= MAX_SUBSCRIBERS:
+            return None
+        listener = queue.Queue(maxsize=256)
+        _subscribers.add(listener)
+    return listener
+
+def unsubscribe(listener):
+    with _subscribers_lock:
+        _subscribers.discard(listener)
+
+def publish(event_type, data=None):
+    """
+    Sends an event to every connected web UI. Never blocks: a listener that
+    has fallen behind simply misses the event.
+    """
+    with _subscribers_lock:
+        listeners = list(_subscribers)
+    if not listeners:
+        return
+    message = f"event: {event_type}\ndata: {json.dumps(data or {})}\n\n"
+    for listener in listeners:
+        try:
+            listener.put_nowait(message)
+        except queue.Full:
+            pass
+
+def stream(listener):
+    """Generator producing the Server-Sent Events body for one listener until the client disconnects."""
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                yield listener.get(timeout=KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+    finally:
+        unsubscribe(listener)
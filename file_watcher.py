@@ -1,21 +1,319 @@
 # file_watcher.py
 import os
-from threading import Thread
+import time
+from collections import deque
+from threading import Thread, Condition
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
 import config
+import events
 import media_manager
+import pretranscode
 import upnp_handler # <-- New import
 
 observer = None
 
+# Watcher events are collected and applied in batches: a batch is applied once no new event
+# has arrived for DEBOUNCE_SECONDS, or MAX_BATCH_DELAY after its first event at the latest.
+DEBOUNCE_SECONDS = 2.0
+MAX_BATCH_DELAY = 10.0
+
+CREATED, MODIFIED, DELETED, MOVED = 'created', 'modified', 'deleted', 'moved'
+
+def _new_batch():
+    return {
+        'changes': {},          # video path -> CREATED / MODIFIED / DELETED / MOVED
+        'moves': {},            # video path (MOVED) -> the path it had before the batch
+        'moved_changed': set(), # MOVED video paths whose content changed after the move
+        'dir_moves': [],        # (old folder, new folder), in event order
+        'new_dirs': set(),      # folders that appeared (e.g. moved in from outside the media folders)
+        'deleted_dirs': set(),  # folders that disappeared
+        'subtitle_dirs': set(),
+        'closed': set(),        # video paths whose writer closed them
+    }
+
+_batch_cond = Condition()
+_pending = _new_batch()
+_pending_empty = True
+_first_event_at = _last_event_at = 0.0
+_batch_thread = None
+
+# New and changed files are held here until they are complete: either the writer closed them,
+# or their size and mtime have not moved for the file_stable_seconds setting.
+STABILITY_CHECK_SECONDS = 1.0
+_settling = {}                 # video path -> {'change', 'signature', 'since', 'closed'}; batch thread only
+
+def _notify_library_changed(*paths):
+    """Tells UPnP subscribers and connected web UIs that the listed files' folders changed."""
+    upnp_handler.trigger_upnp_refresh()
+    events.publish('library', {'folders': sorted({os.path.dirname(p) for p in paths})})
+
+def _merge_change(previous, change):
+    """
+    Folds a new event into the pending state of a path. Returns None when the events
+    cancel out (a file created and deleted again within one batch).
+    """
+    if previous is None:
+        return change
+    if change == DELETED:
+        return None if previous == CREATED else DELETED
+    if previous == CREATED:
+        return CREATED
+    # A file deleted and created again, or modified, was replaced in place.
+    return MODIFIED
+
+def _touch_batch():
+    """Marks the pending batch as changed and returns it. Must be called with _batch_cond held."""
+    global _first_event_at, _last_event_at, _pending_empty
+    now = time.monotonic()
+    if _pending_empty:
+        _first_event_at = now
+        _pending_empty = False
+    _last_event_at = now
+    _batch_cond.notify()
+    return _pending
+
+def _record_change(video_path, change):
+    with _batch_cond:
+        batch = _touch_batch()
+        changes = batch['changes']
+        previous = changes.get(video_path)
+        if previous == MOVED:
+            # A renamed file keeps its move; if it is deleted too, the original path's data goes.
+            # Written or replaced after the move, it is moved and then checked like a modified file.
+            if change == DELETED:
+                del changes[video_path]
+                changes.setdefault(batch['moves'].pop(video_path), DELETED)
+                batch['moved_changed'].discard(video_path)
+            else:
+                batch['moved_changed'].add(video_path)
+            return
+        merged = _merge_change(previous, change)
+        if merged:
+            changes[video_path] = merged
+        else:
+            changes.pop(video_path, None)
+
+def _record_move(src_path, dest_path):
+    with _batch_cond:
+        batch = _touch_batch()
+        changes, moves = batch['changes'], batch['moves']
+        previous = changes.pop(src_path, None)
+        origin = moves.pop(src_path, src_path)
+        content_changed = src_path in batch['moved_changed'] or previous == MODIFIED
+        batch['moved_changed'].discard(src_path)
+        if previous == CREATED:
+            # Created and renamed within one batch: nothing is cached under the old name.
+            changes[dest_path] = CREATED
+        else:
+            changes[dest_path] = MOVED
+            moves[dest_path] = origin
+            if content_changed:
+                batch['moved_changed'].add(dest_path)
+
+def _record_dir_event(kind, path, dest_path=None):
+    with _batch_cond:
+        batch = _touch_batch()
+        if kind == MOVED:
+            batch['dir_moves'].append((path, dest_path))
+        elif kind == CREATED:
+            batch['new_dirs'].add(path)
+        else:
+            batch['deleted_dirs'].add(path)
+
+def _record_closed(video_path):
+    with _batch_cond:
+        _touch_batch()['closed'].add(video_path)
+
+def _record_subtitle_change(subtitle_path):
+    with _batch_cond:
+        _touch_batch()['subtitle_dirs'].add(os.path.dirname(subtitle_path))
+
+def _take_batch(timeout=None):
+    """
+    Blocks until a batch is due (or timeout passes with no events), then returns it and
+    starts a new one.
+    """
+    global _pending, _pending_empty
+    with _batch_cond:
+        if _pending_empty:
+            _batch_cond.wait(timeout)
+        if not _pending_empty:
+            while True:
+                due = min(_last_event_at + DEBOUNCE_SECONDS, _first_event_at + MAX_BATCH_DELAY)
+                remaining = due - time.monotonic()
+                if remaining <= 0:
+                    break
+                _batch_cond.wait(remaining)
+        batch, _pending, _pending_empty = _pending, _new_batch(), True
+    return batch
+
+def _hold_until_stable(video_path, change):
+    entry = _settling.get(video_path)
+    if entry:
+        entry['change'] = _merge_change(entry['change'], change)
+    else:
+        _settling[video_path] = {'change': change, 'signature': None, 'since': time.monotonic(), 'closed': False}
+        media_manager.set_file_settling(video_path, True)
+
+def _forget_settling(video_path):
+    entry = _settling.pop(video_path, None)
+    if entry:
+        media_manager.set_file_settling(video_path, False)
+    return entry
+
+def _release_stable_files():
+    """
+    Returns {path: change} for held files that are now complete and forgets them. A file is
+    complete once it was closed after writing, or its size and mtime stayed the same between
+    two checks and have not changed for file_stable_seconds.
+    """
+    stable_seconds = float(config.settings.get("file_stable_seconds", 10))
+    now, wall_now = time.monotonic(), time.time()
+    ready = {}
+    for video_path, entry in list(_settling.items()):
+        try:
+            st = os.stat(video_path)
+        except OSError:
+            # Gone again before it was complete; its delete event removes it from the caches.
+            _forget_settling(video_path)
+            continue
+        signature = (st.st_size, st.st_mtime_ns)
+        unchanged = signature == entry['signature']
+        if not unchanged:
+            entry['signature'], entry['since'] = signature, now
+        quiet_for = max(wall_now - st.st_mtime, now - entry['since'])
+        if entry['closed'] or (unchanged and quiet_for >= stable_seconds):
+            ready[video_path] = entry['change']
+            _forget_settling(video_path)
+    return ready
+
+def _video_files_under(folder):
+    handler = MediaFolderEventHandler()
+    for root, _, files in os.walk(folder):
+        for name in files:
+            path = os.path.join(root, name)
+            if handler._is_valid_video(path):
+                yield path
+
+def _is_within(path, folder):
+    return path == folder or path.startswith(os.path.join(folder, ''))
+
+def _resolve_dir_moves(dir_moves):
+    """
+    Folds a batch's folder moves into [original folder, current folder] pairs, so a folder
+    renamed twice (A -> B -> C) is re-keyed once from A to C.
+    """
+    resolved = []
+    for old_folder, new_folder in dir_moves:
+        for move in resolved:
+            if move[1] == old_folder:
+                move[1] = new_folder
+                break
+            if _is_within(old_folder, move[1]):
+                # A subfolder of an already moved folder moved on by itself.
+                resolved.append([move[0] + old_folder[len(move[1]):], new_folder])
+                break
+        else:
+            resolved.append([old_folder, new_folder])
+    # Child folder events that simply follow their parent need no walk of their own.
+    return [move for move in resolved
+            if not any(other is not move and _is_within(move[1], other[1])
+                       and move[0] == other[0] + move[1][len(other[1]):] for other in resolved)]
+
+def _collect_moves(batch):
+    """
+    Returns {old path: new path} for every video renamed or moved in the batch. A moved
+    folder is walked once at its new location; its children need no events of their own.
+    """
+    dir_moves = _resolve_dir_moves(batch['dir_moves'])
+    moves = {}
+    for old_folder, new_folder in dir_moves:
+        for new_path in _video_files_under(new_folder):
+            moves[os.path.join(old_folder, os.path.relpath(new_path, new_folder))] = new_path
+    for new_path, old_path in batch['moves'].items():
+        if not os.path.exists(new_path):
+            continue  # Moved on again with its folder; the folder walk covers it.
+        # A file renamed inside a folder that was itself moved in this batch.
+        for old_folder, new_folder in dir_moves:
+            if _is_within(old_path, new_folder):
+                old_path = old_folder + old_path[len(new_folder):]
+                break
+        moves[old_path] = new_path
+    return {old: new for old, new in moves.items() if old != new}
+
+def _apply_batch(batch):
+    """
+    Applies one batch: renamed files and folders are re-keyed in the caches, new and changed
+    files wait in _settling until complete, removed files leave the caches in a single update,
+    and everything released sends one notification.
+    """
+    changes = batch['changes']
+    moves = _collect_moves(batch)
+    for old_path, new_path in moves.items():
+        entry = _forget_settling(old_path)
+        if entry:
+            _hold_until_stable(new_path, entry['change'])
+    media_manager.move_files_in_cache(moves)
+    for new_path in batch['moved_changed'] & set(moves.values()):
+        _hold_until_stable(new_path, MODIFIED)
+
+    deleted = {p for p, change in changes.items() if change == DELETED}
+    for folder in batch['deleted_dirs']:
+        deleted.update(media_manager.cached_paths_under(folder))
+    deleted = sorted(deleted - set(moves))
+    for video_path in deleted:
+        _forget_settling(video_path)
+
+    for video_path, change in changes.items():
+        if change in (CREATED, MODIFIED):
+            _hold_until_stable(video_path, change)
+    for folder in batch['new_dirs']:
+        for video_path in _video_files_under(folder):
+            _hold_until_stable(video_path, CREATED)
+    for video_path in batch['closed']:
+        if video_path in _settling:
+            _settling[video_path]['closed'] = True
+
+    ready = _release_stable_files()
+    created = [p for p, change in ready.items() if change == CREATED]
+    # Modify events also fire for attribute changes; only files whose size or mtime moved are reprocessed.
+    modified = [p for p, change in ready.items() if change == MODIFIED and media_manager.get_cached_metadata(p) is None]
+
+    media_manager.remove_files_from_cache(deleted + modified, keep_progress=modified)
+    for video_path in created + modified:
+        media_manager.get_video_metadata(video_path)
+        media_manager.generate_thumbnail(video_path)
+        pretranscode.queue_file(video_path)
+    for directory in batch['subtitle_dirs']:
+        media_manager.refresh_sidecar_subtitles(directory)
+
+    if deleted or created or modified or moves:
+        print(f"Watcher: {len(created)} new, {len(modified)} changed, {len(moves)} moved, {len(deleted)} removed files.")
+        _notify_library_changed(*deleted, *created, *modified, *moves, *moves.values())
+
+def _batch_worker():
+    while True:
+        # While files are still being written, wake up regularly to check on them.
+        batch = _take_batch(STABILITY_CHECK_SECONDS if _settling else None)
+        try:
+            _apply_batch(batch)
+        except Exception as e:
+            print(f"Watcher: failed to apply changes: {e}")
+
+def _start_batch_thread():
+    global _batch_thread
+    if _batch_thread is None:
+        _batch_thread = Thread(target=_batch_worker, daemon=True)
+        _batch_thread.start()
+
 class MediaFolderEventHandler(FileSystemEventHandler):
-    """Handles file system events for media folders."""
+    """Collects file system events for media folders into the pending batch."""
     
     def __init__(self):
         super().__init__()
-        self.valid_extensions = ('.mp4', '.mkv', '.avi', '.mov', '.webm')
+        self.valid_extensions = media_manager.VIDEO_EXTENSIONS
 
     def _is_valid_video(self, path):
         if os.path.isdir(path) or not path.lower().endswith(self.valid_extensions):
@@ -24,45 +322,186 @@ class MediaFolderEventHandler(FileSystemEventHandler):
             return False
         return True
 
+    def _is_subtitle(self, path):
+        return path.lower().endswith(('.srt', '.vtt')) and not os.path.basename(path).startswith('.')
+
+    def _record(self, path, change):
+        if self._is_subtitle(path):
+            _record_subtitle_change(path)
+        elif self._is_valid_video(path):
+            _record_change(path, change)
+
     def on_created(self, event):
-        if self._is_valid_video(event.src_path):
-            print(f"Watcher: New file detected: {os.path.basename(event.src_path)}")
-            media_manager.get_video_metadata(event.src_path)
-            media_manager.generate_thumbnail(event.src_path)
-            # === THE FIX: Trigger the UPnP refresh ===
-            upnp_handler.trigger_upnp_refresh()
+        if event.is_directory:
+            _record_dir_event(CREATED, event.src_path)
+        else:
+            self._record(event.src_path, CREATED)
+
+    def on_modified(self, event):
+        if not event.is_directory and self._is_valid_video(event.src_path):
+            _record_change(event.src_path, MODIFIED)
+
+    def on_closed(self, event):
+        # Only reported where the platform supports it (inotify close-after-write on Linux).
+        if not event.is_directory and self._is_valid_video(event.src_path):
+            _record_closed(event.src_path)
 
     def on_deleted(self, event):
-        if self._is_valid_video(event.src_path):
-            media_manager.remove_file_from_cache(event.src_path)
-            # === THE FIX: Trigger the UPnP refresh ===
-            upnp_handler.trigger_upnp_refresh()
+        if event.is_directory:
+            _record_dir_event(DELETED, event.src_path)
+        else:
+            self._record(event.src_path, DELETED)
 
     def on_moved(self, event):
-        if self._is_valid_video(event.src_path):
-            media_manager.remove_file_from_cache(event.src_path)
-        
-        if self._is_valid_video(event.dest_path):
-            print(f"Watcher: File moved/renamed to: {os.path.basename(event.dest_path)}")
-            media_manager.get_video_metadata(event.dest_path)
-            media_manager.generate_thumbnail(event.dest_path)
-        
-        # === THE FIX: Trigger the UPnP refresh (only once for a move) ===
-        upnp_handler.trigger_upnp_refresh()
+        if event.is_directory:
+            _record_dir_event(MOVED, event.src_path, event.dest_path)
+        elif self._is_valid_video(event.dest_path) and self._is_valid_video(event.src_path):
+            _record_move(event.src_path, event.dest_path)
+        else:
+            # Renamed to or from a non-video name (e.g. a finished 'movie.mkv.part' download).
+            self._record(event.src_path, DELETED)
+            self._record(event.dest_path, CREATED)
+
+# --- Polling, for network shares (SMB/NFS) where watchdog receives no events ---
+# Every pass stats each known folder but only lists the ones whose mtime changed (a folder's
+# mtime changes when an entry directly inside it is added, removed or renamed). A pass makes at
+# most poll_io_budget stat/list calls; a larger tree is covered over several passes. Changes
+# found go through the same batch pipeline as watcher events.
+_poll_state = {}       # root -> {folder: {'mtime', 'files': {name: (size, mtime_ns)}, 'subdirs': set of names}}
+_poll_queues = {}      # root -> folders still to check in the current pass
+_poll_ready = set()    # roots whose first (silent) pass is complete, so differences are reported
+_poller_thread = None
+
+def _polled_roots():
+    media_folders = config.settings.get("media_folders", [])
+    return [root for root in config.settings.get("polled_folders", []) if root in media_folders]
+
+def _record_polled_file(path, change):
+    if path.lower().endswith(('.srt', '.vtt')):
+        _record_subtitle_change(path)
+    else:
+        _record_change(path, change)
+
+def _list_folder(folder):
+    files, subdirs = {}, set()
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir():
+                subdirs.add(entry.name)
+            elif entry.name.lower().endswith(media_manager.VIDEO_EXTENSIONS + ('.srt', '.vtt')):
+                st = entry.stat()
+                files[entry.name] = (st.st_size, st.st_mtime_ns)
+    return files, subdirs
+
+def _check_folder(root, folder):
+    """Checks one polled folder, queues its subfolders and records what changed. Returns the I/O calls used."""
+    state, pending = _poll_state.setdefault(root, {}), _poll_queues[root]
+    known = state.get(folder)
+    try:
+        mtime = os.stat(folder).st_mtime_ns
+    except OSError:
+        return 1  # Gone; reported when its parent is listed
+    if known and known['mtime'] == mtime:
+        pending.extend(os.path.join(folder, name) for name in known['subdirs'])
+        return 1
+    try:
+        files, subdirs = _list_folder(folder)
+    except OSError:
+        return 2
+    if folder == root and known and (known['files'] or known['subdirs']) and not files and not subdirs:
+        return 2  # An empty mount point: the share is offline, not emptied
+    state[folder] = {'mtime': mtime, 'files': files, 'subdirs': subdirs}
+    pending.extend(os.path.join(folder, name) for name in subdirs)
+
+    if root in _poll_ready:
+        old_files = known['files'] if known else {}
+        for name, signature in files.items():
+            if name not in old_files:
+                _record_polled_file(os.path.join(folder, name), CREATED)
+            elif old_files[name] != signature:
+                _record_polled_file(os.path.join(folder, name), MODIFIED)
+        for name in old_files.keys() - files.keys():
+            _record_polled_file(os.path.join(folder, name), DELETED)
+        for name in (known['subdirs'] - subdirs) if known else ():
+            gone = os.path.join(folder, name)
+            _record_dir_event(DELETED, gone)
+            for path in [f for f in state if _is_within(f, gone)]:
+                del state[path]
+    return 2
+
+def _poll_pass():
+    """Spends one pass's I/O budget on the polled roots, round-robin."""
+    roots = _polled_roots()
+    for root in set(_poll_state) - set(roots):
+        _poll_state.pop(root, None)
+        _poll_queues.pop(root, None)
+        _poll_ready.discard(root)
+    for root in roots:
+        pending = _poll_queues.setdefault(root, deque())
+        if not pending:
+            pending.append(root)
+    budget = int(config.settings.get("poll_io_budget", 2000))
+    while budget > 0 and any(_poll_queues[root] for root in roots):
+        for root in roots:
+            if _poll_queues[root]:
+                budget -= _check_folder(root, _poll_queues[root].popleft())
+                if not _poll_queues[root] and root not in _poll_ready:
+                    _poll_ready.add(root)
+                    print(f"Poller: Indexed {len(_poll_state.get(root, {}))} folders in '{root}'.")
+
+def _poller_worker():
+    while True:
+        try:
+            _poll_pass()
+        except Exception as e:
+            print(f"Poller: error while checking folders: {e}")
+        time.sleep(float(config.settings.get("poll_interval_seconds", 30)))
+
+def _start_poller_thread():
+    global _poller_thread
+    if _poller_thread is None:
+        _poller_thread = Thread(target=_poller_worker, daemon=True)
+        _poller_thread.start()
 
 # (The rest of the file remains unchanged)
-def start_watching():
+_watches = {}          # media folder -> watchdog watch, for folders monitored by the observer
+
+def sync_watched_roots():
+    """
+    Brings monitoring in line with the settings without a restart: folders that were added are
+    scheduled with the observer, removed folders (and folders switched to polling) are
+    unscheduled, and polled folders are picked up by the poller on its next pass.
+    """
     global observer
-    if observer and observer.is_alive(): return
-    event_handler = MediaFolderEventHandler()
-    observer = Observer()
-    media_folders = config.settings.get("media_folders", [])
-    for path in media_folders:
+    _start_batch_thread()
+    polled_roots = _polled_roots()
+    if polled_roots:
+        _start_poller_thread()
+    watched_roots = [path for path in config.settings.get("media_folders", []) if path not in polled_roots]
+    if observer is None or not observer.is_alive():
+        observer = Observer()
+        observer.start()
+        _watches.clear()
+    for path in list(_watches):
+        if path not in watched_roots:
+            observer.unschedule(_watches.pop(path))
+            print(f"Watcher: Stopped monitoring folder '{path}'.")
+    for path in watched_roots:
+        if path in _watches:
+            continue
         if os.path.exists(path):
-            observer.schedule(event_handler, path, recursive=True)
+            _watches[path] = observer.schedule(MediaFolderEventHandler(), path, recursive=True)
             print(f"Watcher: Monitoring folder '{path}' for changes.")
         else: print(f"Watcher Warning: Folder not found, cannot monitor: '{path}'")
-    if media_folders: observer.start()
+    for path in polled_roots:
+        if path not in _poll_state:
+            print(f"Watcher: Polling folder '{path}' for changes.")
+
+def start_watching():
+    if observer and observer.is_alive(): return
+    sync_watched_roots()
 
 def stop_watching():
     global observer
@@ -71,8 +510,4 @@ def stop_watching():
         observer.join()
         print("Watcher: Monitoring stopped.")
     observer = None
-
-def restart_watching():
-    print("Watcher: Restarting to apply new folder settings...")
-    stop_watching()
-    Thread(target=start_watching, daemon=True).start()
\ No newline at end of file
+    _watches.clear()
@@ -0,0 +1,180 @@
+# library_gc.py
+import os
+import time
+import hashlib
+from threading import Lock
+
+import config
+import disk_cache
+import media_manager
+import thumbnail_store
+
+# The first sweep runs a while after startup, once the initial scan has settled.
+FIRST_SWEEP_DELAY_SECONDS = 10 * 60
+
+_sweep_lock = Lock()
+last_report = None
+
+class _Throttle:
+    """Limits file system checks to gc_checks_per_second, and waits while anything is being streamed."""
+
+    def __init__(self):
+        self.rate = max(1, int(config.settings.get("gc_checks_per_second", 200)))
+        self.count = 0
+
+    def wait(self):
+        self.count += 1
+        if self.count % self.rate == 0:
+            time.sleep(1)
+        while True:
+            with config.stream_state_lock:
+                streaming = config.active_streams > 0 or time.time() - config.last_segment_request_time < 30
+            if not streaming:
+                return
+            time.sleep(5)
+
+def _root_available(root):
+    """An offline network share looks like a missing or empty folder; its files must not be treated as deleted."""
+    try:
+        with os.scandir(root) as entries:
+            return next(entries, None) is not None
+    except OSError:
+        return False
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def _normalize(path):
+    """Cache keys may differ from the configured folders in separators and case (Windows)."""
+    return os.path.normcase(os.path.normpath(path))
+
+def _version_key(metadata):
+    """The file version key (see media_manager.get_file_version_key) recorded for a cache entry."""
+    return hashlib.md5(f"{metadata['path']}|{metadata.get('size')}|{metadata.get('mtime')}".encode()).hexdigest()
+
+def _sweep_catalog(throttle):
+    """
+    Reconciles media_info_cache with the media folders. Missing files become vanished entries
+    (purged once their retention ends), files outside every media folder and entries from older
+    versions without a path are dropped. Returns the number of entries dropped.
+    """
+    folders = config.settings.get("media_folders", [])
+    roots = [os.path.join(_normalize(folder), '') for folder in folders]
+    available = [os.path.join(_normalize(folder), '') for folder in folders if _root_available(folder)]
+    with config.cache_lock:
+        entries = [(path_hash, metadata.get('path'), metadata.get('vanished_at')) for path_hash, metadata in config.media_info_cache.items()]
+    before = len(entries)
+
+    legacy, outside, missing = [], [], []
+    for path_hash, path, vanished_at in entries:
+        if not path:
+            legacy.append(path_hash)
+        elif not any(_normalize(path).startswith(root) for root in roots):
+            outside.append(path)
+        elif not any(_normalize(path).startswith(root) for root in available):
+            continue
+        elif vanished_at:
+            missing.append(path)  # Passed again so an expired entry is purged
+        else:
+            throttle.wait()
+            if not os.path.exists(path):
+                missing.append(path)
+
+    if legacy:
+        with config.cache_lock:
+            for path_hash in legacy:
+                config.media_info_cache.pop(path_hash, None)
+        config.save_media_info_cache()
+    media_manager.purge_files(outside)
+    media_manager.remove_files_from_cache(missing)
+    with config.cache_lock:
+        return before - len(config.media_info_cache)
+
+def _sweep_progress(live_hashes):
+    """Drops resume positions of files that are no longer in the catalog. Returns the number dropped."""
+    dropped = 0
+    with config.cache_lock:
+        for path_hash in [h for h, data in config.playback_cache.items() if 'last_position' in data and h not in live_hashes]:
+            del config.playback_cache[path_hash]
+            dropped += 1
+        # Per IP mode nests positions under each client.
+        for client, data in list(config.playback_cache.items()):
+            if 'last_position' in data:
+                continue
+            for path_hash in [h for h in data if h not in live_hashes]:
+                del data[path_hash]
+                dropped += 1
+            if not data:
+                del config.playback_cache[client]
+    if dropped:
+        config.save_playback_cache()
+    return dropped
+
+def _sweep_thumbnails(live_hashes):
+    """Removes thumbnails of files no longer in the catalog and compacts the store if worthwhile. Returns (removed, bytes reclaimed)."""
+    orphans = [key for key in thumbnail_store.keys() if key[:32] not in live_hashes]
+    for key in orphans:
+        thumbnail_store.remove(key)
+    # Compaction rewrites the pack under the store lock, so it waits for the same share of waste as on startup.
+    reclaimed = thumbnail_store.compact() if thumbnail_store.needs_compaction() else 0
+    return len(orphans), reclaimed
+
+def _sweep_disk_caches(live_keys):
+    """Discards transcoded segments, prepared copies, seek previews and subtitles derived from file versions that are gone."""
+    def is_live(name):
+        if name.endswith('/sidecar.vtt'):
+            return True  # Keyed by the subtitle file, not the video; left to the cache's size limit
+        return name.split('/')[0].split('.')[0] in live_keys
+    return disk_cache.discard_orphans_everywhere(is_live)
+
+def collect_garbage():
+    """
+    Runs one sweep over all caches and returns a report of what was removed and the disk space
+    reclaimed. Only one sweep runs at a time; a concurrent call returns None.
+    """
+    global last_report
+    if not _sweep_lock.acquire(blocking=False):
+        return None
+    try:
+        started = time.time()
+        print("Library GC: sweep started.")
+        json_size_before = _file_size(config.MEDIA_INFO_CACHE_FILE) + _file_size(config.PLAYBACK_CACHE_FILE)
+        throttle = _Throttle()
+
+        metadata_removed = _sweep_catalog(throttle)
+        with config.cache_lock:
+            live_hashes = set(config.media_info_cache)
+            live_keys = {_version_key(m) for m in config.media_info_cache.values() if m.get('path') and not m.get('vanished_at')}
+        progress_removed = _sweep_progress(live_hashes)
+        thumbnails_removed, thumbnail_bytes = _sweep_thumbnails(live_hashes)
+        cache_files_removed, cache_bytes = _sweep_disk_caches(live_keys)
+
+        json_bytes = max(0, json_size_before - _file_size(config.MEDIA_INFO_CACHE_FILE) - _file_size(config.PLAYBACK_CACHE_FILE))
+        last_report = {
+            'finished': time.time(),
+            'seconds': round(time.time() - started, 1),
+            'metadata_entries': metadata_removed,
+            'resume_positions': progress_removed,
+            'thumbnails': thumbnails_removed,
+            'cache_files': cache_files_removed,
+            'bytes_reclaimed': json_bytes + thumbnail_bytes + cache_bytes,
+        }
+        print(f"Library GC: removed {metadata_removed} metadata entries, {progress_removed} resume positions, "
+              f"{thumbnails_removed} thumbnails and {cache_files_removed} cache files; "
+              f"reclaimed {last_report['bytes_reclaimed'] // (1024 * 1024)} MB in {last_report['seconds']} s.")
+        return last_report
+    finally:
+        _sweep_lock.release()
+
+def gc_worker():
+    """Background thread that sweeps the caches every gc_interval_hours."""
+    time.sleep(FIRST_SWEEP_DELAY_SECONDS)
+    while True:
+        try:
+            collect_garbage()
+        except Exception as e:
+            print(f"Library GC: sweep failed: {e}")
+        time.sleep(float(config.settings.get("gc_interval_hours", 24)) * 3600)
@@ -4,18 +4,76 @@ import hashlib
 import re
 import subprocess
 import json
-from threading import Thread
+import base64
+import bisect
+import itertools
+from collections import OrderedDict
+from threading import Lock
 # === THE FIX: Moviepy is removed for performance ===
 # from moviepy.video.io.VideoFileClip import VideoFileClip 
+import io
 import queue
+import tempfile
+import time
+
+from PIL import Image
 
 import config
+import disk_cache
+import events
+import object_ids
+import search_index
+import thumbnail_store
 
 # --- FFmpeg/FFprobe Paths ---
 FFMPEG_PATH, FFPROBE_PATH = None, None
 
-METADATA_QUEUE = queue.Queue()
-THUMBNAIL_QUEUE = queue.Queue()
+# Work queues are ordered by priority, then arrival. Items the web UI is showing right now
+# jump ahead of everything queued by library scans.
+PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND = 0, 1
+METADATA_QUEUE = queue.PriorityQueue()
+THUMBNAIL_QUEUE = queue.PriorityQueue()
+_queue_counter = itertools.count()
+
+# Paths queued and paths being worked on, per queue. Both are written to config.JOB_QUEUE_FILE
+# every JOB_JOURNAL_INTERVAL seconds and on shutdown, and queued again on the next start. A file
+# that is being worked on can be queued again (it may have changed since the job started).
+JOB_JOURNAL_INTERVAL = 5
+_pending_jobs = {METADATA_QUEUE: set(), THUMBNAIL_QUEUE: set()}
+_running_jobs = {METADATA_QUEUE: set(), THUMBNAIL_QUEUE: set()}
+_jobs_lock = Lock()
+_jobs_dirty = False
+
+# Folder mtimes seen by the last library scan. Written with the clean-shutdown marker so the
+# next start only rescans folders that changed. Files changed in place don't touch their folder,
+# so the whole library is still walked at least every FULL_SCAN_INTERVAL seconds.
+FULL_SCAN_INTERVAL = 7 * 24 * 3600
+_folder_mtimes = {}
+_folder_mtimes_lock = Lock()
+_library_scanned = False
+_last_full_scan = 0
+
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov', '.webm')
+
+# Files that are still being copied in; see set_file_settling.
+_settling_paths = set()
+
+# Sorted folder listings for paginated browsing, reused until the folder's mtime changes.
+LISTING_CACHE_SIZE = 32
+_listing_cache = OrderedDict()
+_listing_lock = Lock()
+
+# Content fingerprints hash this many bytes from the start and from the end of a file.
+FINGERPRINT_BLOCK = 64 * 1024
+# Deleted files stay in the caches this long, so the same file turning up elsewhere inherits their data.
+VANISHED_RETENTION_SECONDS = 24 * 3600
+_inherit_lock = Lock()
+
+# DLNA image profiles served as thumbnails: (key suffix, max width, max height).
+# JPEG_SM is also the web UI's grid image; JPEG_TN is for TVs that only want a small icon.
+THUMBNAIL_VARIANTS = {'JPEG_SM': ('', 640, 480), 'JPEG_TN': ('_tn', 160, 160)}
+# Thumbnails of older versions: one full-size file per video, named after its path hash.
+LEGACY_THUMBNAIL_NAME = re.compile(r'^([0-9a-f]{32})(_tn)?\.jpg$')
 
 def find_ffmpeg_and_ffprobe():
     """Finds local or system-wide FFmpeg/FFprobe executables."""
@@ -30,73 +88,308 @@ def find_ffmpeg_and_ffprobe():
     print(f"Using FFmpeg: {FFMPEG_PATH}")
     print(f"Using FFprobe: {FFPROBE_PATH}")
 
+def get_file_version_key(video_path, stat_result=None):
+    """
+    Returns a key identifying this exact version of a file (path, size and mtime),
+    so derived data such as transcoded segments is invalidated when the file changes.
+    """
+    st = stat_result or os.stat(video_path)
+    return hashlib.md5(f"{video_path}|{st.st_size}|{int(st.st_mtime)}".encode()).hexdigest()
+
+def compute_fingerprint(video_path, stat_result=None):
+    """
+    A cheap identity for a file's content: its size plus an MD5 of the first and last
+    FINGERPRINT_BLOCK bytes. Unlike the path-based cache keys it survives renames and moves.
+    """
+    st = stat_result or os.stat(video_path)
+    digest = hashlib.md5()
+    with open(video_path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BLOCK))
+        if st.st_size > FINGERPRINT_BLOCK:
+            f.seek(max(FINGERPRINT_BLOCK, st.st_size - FINGERPRINT_BLOCK))
+            digest.update(f.read(FINGERPRINT_BLOCK))
+    return f"{st.st_size}-{digest.hexdigest()}"
+
+def _inherit_from_vanished(video_path, st):
+    """
+    If an uncached file has the same content fingerprint as a file that was deleted recently
+    (or whose path no longer exists), moves that file's metadata, thumbnails and progress over
+    instead of processing it again. Only files of the same size are fingerprinted.
+    """
+    with config.cache_lock:
+        candidates = [dict(m) for m in config.media_info_cache.values()
+                      if m.get('size') == st.st_size and m.get('fingerprint') and m.get('path') != video_path]
+    candidates = [m for m in candidates if m.get('vanished_at') or not os.path.exists(m['path'])]
+    if not candidates:
+        return False
+    try:
+        fingerprint = compute_fingerprint(video_path, st)
+    except OSError:
+        return False
+    match = next((m for m in candidates if m['fingerprint'] == fingerprint), None)
+    if not match:
+        return False
+    move_files_in_cache({match['path']: video_path})
+    with config.cache_lock:
+        metadata = config.media_info_cache.get(hashlib.md5(video_path.encode()).hexdigest())
+        # A copy to another disk does not always keep the modification time.
+        mtime_changed = metadata is not None and metadata.get('mtime') != int(st.st_mtime)
+        if mtime_changed:
+            metadata['mtime'] = int(st.st_mtime)
+    if mtime_changed:
+        config.save_media_info_cache()
+    print(f"Recognized {os.path.basename(video_path)} as {os.path.basename(match['path'])}; keeping its cached data.")
+    return True
+
+def _is_current(metadata, st):
+    """True if a cache entry was probed from the file version described by the stat result."""
+    return metadata.get('size') == st.st_size and metadata.get('mtime') == int(st.st_mtime)
+
+def _find_sidecar_subtitles(video_path):
+    """Lists external .srt/.vtt files named after the video, e.g. 'Movie.en.srt' next to 'Movie.mkv'."""
+    sidecars = []
+    video_basename = os.path.splitext(os.path.basename(video_path))[0]
+    video_dir = os.path.dirname(video_path)
+    for sub_file in os.listdir(video_dir):
+        if sub_file.lower().startswith(video_basename.lower()) and sub_file.lower().endswith(('.srt', '.vtt')):
+            lang_match = re.search(r'\.([a-zA-Z]{2,3})\.(srt|vtt)$', sub_file, re.IGNORECASE)
+            sidecars.append({'path': os.path.join(video_dir, sub_file), 'lang': lang_match.group(1) if lang_match else 'unknown'})
+    return sidecars
+
+def _metadata_from_probe(probe):
+    """Flattens an ffprobe -show_format -show_streams result into the fields the server uses."""
+    format_info = probe.get('format', {})
+    streams = probe.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video' and not s.get('disposition', {}).get('attached_pic')), {})
+    audio_tracks = _audio_tracks_from_streams(streams)
+    default_audio = next((s for s in streams if s.get('codec_type') == 'audio' and s.get('disposition', {}).get('default')),
+                         next((s for s in streams if s.get('codec_type') == 'audio'), {}))
+    subtitle_tracks = [{
+        'index': stream['index'],
+        'lang': stream.get('tags', {}).get('language', 'eng'),
+        'title': stream.get('tags', {}).get('title', ''),
+        'codec': stream.get('codec_name'),
+    } for stream in streams if stream.get('codec_type') == 'subtitle']
+    # Embedded artwork: an MP4 'covr' / attached picture, or an image attachment in an MKV (preferring one named cover.*).
+    image_attachments = [s for s in streams if s.get('codec_type') == 'attachment' and s.get('tags', {}).get('mimetype', '').startswith('image/')]
+    image_attachments.sort(key=lambda s: not s.get('tags', {}).get('filename', '').lower().startswith('cover'))
+    cover_stream = next((s for s in streams if s.get('disposition', {}).get('attached_pic')), None)
+    cover_art = {'index': cover_stream['index'], 'type': 'attached_pic'} if cover_stream else None
+    if not cover_art and image_attachments:
+        cover_art = {'index': image_attachments[0]['index'], 'type': 'attachment'}
+    return {
+        'duration': float(format_info.get('duration', 0) or 0),
+        'format_name': format_info.get('format_name', ''),
+        'bitrate': int(format_info.get('bit_rate', 0) or 0),
+        'video_codec': video.get('codec_name'),
+        'video_profile': video.get('profile'),
+        'video_level': int(video.get('level', 0) or 0),
+        'width': int(video.get('width', 0) or 0),
+        'height': int(video.get('height', 0) or 0),
+        'frame_rate': video.get('avg_frame_rate'),
+        'audio_codec': default_audio.get('codec_name'),
+        'audio_channels': int(default_audio.get('channels', 0) or 0),
+        'sample_rate': int(default_audio.get('sample_rate', 0) or 0),
+        'audio_tracks': audio_tracks,
+        'subtitle_tracks': subtitle_tracks,
+        'languages': sorted({t['lang'] for t in audio_tracks + subtitle_tracks if t['lang'] != 'unknown'}),
+        'cover_art': cover_art,
+    }
+
 def _run_ffprobe_and_cache(video_path):
-    """The actual blocking ffprobe call. Executed by the metadata_worker."""
+    """
+    The actual blocking ffprobe call. Executed by the metadata_worker.
+    A single probe per file version captures format, streams and sidecar subtitles.
+    """
     path_hash = hashlib.md5(video_path.encode()).hexdigest()
-    with config.cache_lock:
-        if path_hash in config.media_info_cache and config.media_info_cache[path_hash].get('duration', 0) > 0:
+    try:
+        st = os.stat(video_path)
+    except OSError:
+        return
+    with _inherit_lock:
+        with config.cache_lock:
+            cached = config.media_info_cache.get(path_hash)
+        if cached and _is_current(cached, st):
+            return
+        if _inherit_from_vanished(video_path, st):
             return
 
+    version = {'path': video_path, 'size': st.st_size, 'mtime': int(st.st_mtime)}
     try:
-        ffprobe_cmd = [FFPROBE_PATH, '-v', 'error', '-show_format', '-print_format', 'json', video_path]
+        ffprobe_cmd = [FFPROBE_PATH, '-v', 'error', '-show_format', '-show_streams', '-print_format', 'json', video_path]
         result = subprocess.run(ffprobe_cmd, capture_output=True, text=True, check=True)
-        format_info = json.loads(result.stdout).get('format', {})
-        duration_str = format_info.get('duration', "0")
-        
-        metadata = {'duration': float(duration_str)}
+        metadata = _metadata_from_probe(json.loads(result.stdout))
+        metadata['sidecar_subtitles'] = _find_sidecar_subtitles(video_path)
+        metadata['fingerprint'] = compute_fingerprint(video_path, st)
+        metadata.update(version)
         with config.cache_lock:
             config.media_info_cache[path_hash] = metadata
         config.save_media_info_cache()
+        config.bump_library_generation()
+        search_index.add_file(video_path, metadata)
         print(f"BG Metadata cached for: {os.path.basename(video_path)}")
+        events.publish('metadata', {'path': video_path, 'duration': metadata['duration']})
     except Exception as e:
         print(f"Error getting metadata in background for {video_path}: {e}")
+        # Remember the failure for this version so it isn't retried on every browse.
         with config.cache_lock:
-            config.media_info_cache[path_hash] = {'duration': 0}
+            config.media_info_cache[path_hash] = {'duration': 0, 'probe_failed': True, **version}
         config.save_media_info_cache()
+        config.bump_library_generation()
+        search_index.add_file(video_path, version)
+
+def refresh_sidecar_subtitles(directory):
+    """Re-lists sidecar subtitles for cached videos in a folder after a subtitle file appeared or vanished."""
+    with config.cache_lock:
+        entries = [(h, m['path']) for h, m in config.media_info_cache.items() if m.get('path') and os.path.dirname(m['path']) == directory]
+    if not entries:
+        return
+    for path_hash, video_path in entries:
+        try:
+            sidecars = _find_sidecar_subtitles(video_path)
+        except OSError:
+            continue
+        with config.cache_lock:
+            if path_hash in config.media_info_cache:
+                config.media_info_cache[path_hash]['sidecar_subtitles'] = sidecars
+    config.save_media_info_cache()
+
+def _audio_tracks_from_streams(streams):
+    """Summarises the audio streams of an ffprobe result; 'index' is the absolute stream index used with -map 0:<index>."""
+    return [{
+        'index': stream['index'],
+        'lang': stream.get('tags', {}).get('language', 'unknown'),
+        'title': stream.get('tags', {}).get('title', ''),
+        'codec': stream.get('codec_name'),
+        'channels': stream.get('channels', 0),
+        'default': stream.get('disposition', {}).get('default', 0) == 1,
+    } for stream in streams if stream.get('codec_type') == 'audio']
+
+def get_thumbnail_key(path_hash, variant='JPEG_SM'):
+    """Key of a thumbnail in the thumbnail store, served at /thumb/<key>.jpg."""
+    return f"{path_hash}{THUMBNAIL_VARIANTS[variant][0]}"
+
+def has_thumbnail(path_hash):
+    # JPEG_TN is stored last, so its presence means every variant exists (older versions only made one full-size image).
+    return thumbnail_store.has(get_thumbnail_key(path_hash, 'JPEG_TN'))
+
+def _extract_cover_art(video_path, cover_art, output_path):
+    """Copies embedded artwork out of the container without decoding any video. Returns True on success."""
+    if cover_art['type'] == 'attachment':
+        # ffmpeg writes the attachment, then complains that no output file was given; only the dump matters.
+        ffmpeg_cmd = [FFMPEG_PATH, '-hide_banner', '-loglevel', 'quiet', '-y', f"-dump_attachment:{cover_art['index']}", output_path, '-i', video_path]
+    else:
+        ffmpeg_cmd = [FFMPEG_PATH, '-hide_banner', '-loglevel', 'error', '-i', video_path, '-map', f"0:{cover_art['index']}",
+                      '-frames:v', '1', '-c:v', 'png', '-f', 'image2', '-y', output_path]
+    subprocess.run(ffmpeg_cmd, capture_output=True)
+    return os.path.exists(output_path) and os.path.getsize(output_path) > 0
+
+def _extract_keyframe(video_path, timestamp, output_path):
+    """Grabs the keyframe nearest to timestamp. -skip_frame nokey means no other frames are decoded."""
+    ffmpeg_cmd = [
+        FFMPEG_PATH, '-hide_banner', '-loglevel', 'error',
+        '-skip_frame', 'nokey', '-noaccurate_seek', '-ss', str(timestamp), '-i', video_path,
+        '-frames:v', '1', '-q:v', '2', '-f', 'image2', '-y', output_path
+    ]
+    subprocess.run(ffmpeg_cmd, check=True)
+
+def _write_thumbnail_variants(source_path, path_hash):
+    """Downscales a source image into every DLNA thumbnail size."""
+    with Image.open(source_path) as image:
+        image = image.convert('RGB')
+        for variant, (_, max_width, max_height) in THUMBNAIL_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((max_width, max_height))
+            buffer = io.BytesIO()
+            resized.save(buffer, 'JPEG', quality=85)
+            thumbnail_store.put(get_thumbnail_key(path_hash, variant), buffer.getvalue())
+
+def migrate_legacy_thumbnails():
+    """
+    Moves thumbnails from the old one-file-per-video folder into the thumbnail store. A full-size
+    file is downscaled into every variant, so the small one does not have to be generated again.
+    Files that are not named like a thumbnail are left where they are.
+    """
+    if not os.path.isdir(config.THUMBNAIL_DIR):
+        return
+    migrated = 0
+    for entry in os.scandir(config.THUMBNAIL_DIR):
+        match = LEGACY_THUMBNAIL_NAME.match(entry.name)
+        if not match:
+            print(f"Thumbnail store: skipping unrecognized file {entry.path}")
+            continue
+        try:
+            if match.group(2):
+                with open(entry.path, 'rb') as f:
+                    thumbnail_store.put(get_thumbnail_key(match.group(1), 'JPEG_TN'), f.read())
+            else:
+                _write_thumbnail_variants(entry.path, match.group(1))
+            os.remove(entry.path)
+            migrated += 1
+        except (OSError, ValueError) as e:
+            print(f"Thumbnail store: could not migrate {entry.path}: {e}")
+    try:
+        os.rmdir(config.THUMBNAIL_DIR)
+    except OSError:
+        pass
+    if migrated:
+        print(f"Thumbnail store: migrated {migrated} thumbnails from {config.THUMBNAIL_DIR}.")
 
-# === THE FIX: Replaced slow moviepy with a direct, super-fast ffmpeg command ===
 def _create_thumbnail_file(video_path):
-    """The actual blocking thumbnail creation. Executed by the thumbnail_worker."""
+    """
+    The actual blocking thumbnail creation. Executed by the thumbnail_worker.
+    Embedded cover art is used when the file has any, otherwise the keyframe closest to thumbnail_timestamp.
+    """
     path_hash = hashlib.md5(video_path.encode()).hexdigest()
-    thumbnail_path = os.path.join(config.THUMBNAIL_DIR, f"{path_hash}.jpg")
-    if os.path.exists(thumbnail_path):
+    if has_thumbnail(path_hash):
         return
 
+    source_fd, source_path = tempfile.mkstemp(suffix='.img')
+    os.close(source_fd); os.remove(source_path)  # ffmpeg creates it; an empty file would look like extracted cover art
     try:
-        timestamp = config.settings.get("thumbnail_timestamp", 4)
-        
-        # Check cache for duration to avoid generating thumbnail past the end of the video
-        with config.cache_lock:
-            duration = config.media_info_cache.get(path_hash, {}).get('duration', timestamp + 1)
-        
-        if timestamp >= duration:
-            timestamp = duration / 2
-
-        # Using -ss before -i enables fast seeking, making this almost instantaneous.
-        ffmpeg_cmd = [
-            FFMPEG_PATH, 
-            '-ss', str(timestamp),
-            '-i', video_path,
-            '-vframes', '1',
-            '-q:v', '3', # Quality, 2-5 is a good range
-            '-hide_banner', '-loglevel', 'error',
-            '-y', # Overwrite if exists
-            thumbnail_path
-        ]
-        
-        subprocess.run(ffmpeg_cmd, check=True)
-        print(f"BG Thumbnail generated for: {os.path.basename(video_path)}")
+        metadata = probe_now(video_path)
+        if has_thumbnail(path_hash):
+            return  # Inherited from a file with the same content while probing
+        cover_art = metadata.get('cover_art')
+        if cover_art and _extract_cover_art(video_path, cover_art, source_path):
+            origin = "cover art"
+        else:
+            timestamp = config.settings.get("thumbnail_timestamp", 4)
+            # Avoid seeking past the end of short videos
+            duration = metadata.get('duration') or timestamp + 1
+            if timestamp >= duration:
+                timestamp = duration / 2
+            _extract_keyframe(video_path, timestamp, source_path)
+            origin = "keyframe"
+        _write_thumbnail_variants(source_path, path_hash)
+        print(f"BG Thumbnail generated from {origin} for: {os.path.basename(video_path)}")
+        events.publish('thumbnail', {'path': video_path, 'thumb_hash': path_hash})
     except Exception as e:
         print(f"Could not generate thumbnail in background for {video_path}: {e}")
+    finally:
+        if os.path.exists(source_path):
+            try: os.remove(source_path)
+            except OSError: pass
+
+def probe_now(video_path):
+    """Blocking. Probes a file immediately if it isn't cached yet and returns its metadata."""
+    _run_ffprobe_and_cache(video_path)
+    path_hash = hashlib.md5(video_path.encode()).hexdigest()
+    with config.cache_lock:
+        return dict(config.media_info_cache.get(path_hash, {'duration': 0}))
 
 def metadata_worker():
     """Worker thread that processes videos from the METADATA_QUEUE."""
     print("Metadata background worker started.")
     while True:
         try:
-            video_path = METADATA_QUEUE.get()
+            _, _, video_path = METADATA_QUEUE.get()
             if video_path is None: break # Sentinel value to stop
-            _run_ffprobe_and_cache(video_path)
+            _job_started(METADATA_QUEUE, video_path)
+            try:
+                _run_ffprobe_and_cache(video_path)
+            finally:
+                _job_done(METADATA_QUEUE, video_path)
             METADATA_QUEUE.task_done()
         except Exception as e:
             print(f"An error occurred in the metadata worker: {e}")
@@ -106,90 +399,385 @@ def thumbnail_worker():
     print("Thumbnail background worker started.")
     while True:
         try:
-            video_path = THUMBNAIL_QUEUE.get()
+            _, _, video_path = THUMBNAIL_QUEUE.get()
             if video_path is None: break # Sentinel value to stop
-            _create_thumbnail_file(video_path)
+            _job_started(THUMBNAIL_QUEUE, video_path)
+            try:
+                _create_thumbnail_file(video_path)
+            finally:
+                _job_done(THUMBNAIL_QUEUE, video_path)
             THUMBNAIL_QUEUE.task_done()
         except Exception as e:
             print(f"An error occurred in the thumbnail worker: {e}")
 
-def get_video_metadata(video_path):
-    """Non-blocking. Checks cache, if not found, queues for background processing."""
+def _enqueue(work_queue, video_path, interactive=False):
+    global _jobs_dirty
+    with _jobs_lock:
+        # A file already waiting is only queued again to move it to the front.
+        if video_path in _pending_jobs[work_queue] and not interactive:
+            return
+        _pending_jobs[work_queue].add(video_path)
+        _jobs_dirty = True
+    priority = PRIORITY_INTERACTIVE if interactive else PRIORITY_BACKGROUND
+    work_queue.put((priority, next(_queue_counter), video_path))
+
+def _job_started(work_queue, video_path):
+    global _jobs_dirty
+    with _jobs_lock:
+        _pending_jobs[work_queue].discard(video_path)
+        _running_jobs[work_queue].add(video_path)
+        _jobs_dirty = True
+
+def _job_done(work_queue, video_path):
+    global _jobs_dirty
+    with _jobs_lock:
+        _running_jobs[work_queue].discard(video_path)
+        _jobs_dirty = True
+
+def _write_json_atomically(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+def save_job_journal():
+    """Writes the pending metadata and thumbnail jobs to disk if they changed since the last save."""
+    global _jobs_dirty
+    with _jobs_lock:
+        if not _jobs_dirty:
+            return
+        jobs = {name: sorted(_pending_jobs[work_queue] | _running_jobs[work_queue])
+                for name, work_queue in (('metadata', METADATA_QUEUE), ('thumbnail', THUMBNAIL_QUEUE))}
+        _jobs_dirty = False
+    try:
+        _write_json_atomically(config.JOB_QUEUE_FILE, jobs)
+    except OSError as e:
+        print(f"Error saving job queue: {e}")
+
+def load_job_journal():
+    """Queues the jobs that were pending when the server last stopped."""
+    try:
+        with open(config.JOB_QUEUE_FILE, 'r') as f:
+            jobs = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return
+    for video_path in jobs.get('metadata', []):
+        _enqueue(METADATA_QUEUE, video_path)
+    for video_path in jobs.get('thumbnail', []):
+        _enqueue(THUMBNAIL_QUEUE, video_path)
+    print(f"Resumed {len(jobs.get('metadata', []))} metadata and {len(jobs.get('thumbnail', []))} thumbnail jobs.")
+
+def job_journal_worker():
+    """Background thread that keeps the job journal up to date."""
+    while True:
+        time.sleep(JOB_JOURNAL_INTERVAL)
+        save_job_journal()
+
+def set_file_settling(video_path, settling):
+    """Marks a file as still being written (by the file watcher); such files are not probed or thumbnailed yet."""
+    if settling:
+        _settling_paths.add(video_path)
+    else:
+        _settling_paths.discard(video_path)
+
+def get_cached_metadata(video_path, stat_result=None):
+    """Returns the cached probe data if it matches the file's current size and mtime, else None. Never queues work."""
     path_hash = hashlib.md5(video_path.encode()).hexdigest()
-    
     with config.cache_lock:
         metadata = config.media_info_cache.get(path_hash)
-    
-    if metadata and metadata.get('duration', 0) > 0:
+    try:
+        st = stat_result or os.stat(video_path)
+    except OSError:
+        return None
+    return metadata if metadata and _is_current(metadata, st) else None
+
+def get_video_metadata(video_path, stat_result=None, interactive=False):
+    """
+    Non-blocking. Returns the cached probe data if it matches the file's current size and
+    mtime, otherwise queues the file for background probing. Pass a stat result (e.g. from
+    os.scandir) to avoid an extra stat call.
+    """
+    metadata = get_cached_metadata(video_path, stat_result)
+    if metadata:
         return metadata
-    else:
-        METADATA_QUEUE.put(video_path)
-        return {'duration': 0}
+    if video_path not in _settling_paths and os.path.exists(video_path):
+        _enqueue(METADATA_QUEUE, video_path, interactive)
+    return {'duration': 0}
 
-def generate_thumbnail(video_path):
+def generate_thumbnail(video_path, interactive=False):
     """Non-blocking. Checks if thumbnail exists, if not, queues for background processing."""
     if not config.settings.get("generate_thumbnails"):
         return
     path_hash = hashlib.md5(video_path.encode()).hexdigest()
-    thumbnail_path = os.path.join(config.THUMBNAIL_DIR, f"{path_hash}.jpg")
-    if not os.path.exists(thumbnail_path):
-        THUMBNAIL_QUEUE.put(video_path)
+    if video_path not in _settling_paths and not has_thumbnail(path_hash):
+        _enqueue(THUMBNAIL_QUEUE, video_path, interactive)
+
+def request_demand(video_paths):
+    """Moves files the user is looking at to the front of the metadata and thumbnail queues."""
+    for video_path in video_paths:
+        get_video_metadata(video_path, interactive=True)
+        generate_thumbnail(video_path, interactive=True)
+
+def _scan_tree(folder, folder_mtimes):
+    """Walks a folder, queuing uncached files and recording every subfolder's mtime. Returns the number of media files."""
+    found_count = 0
+    for root, _, files in os.walk(folder):
+        try:
+            folder_mtimes[root] = os.stat(root).st_mtime_ns
+        except OSError:
+            continue
+        for name in files:
+            if name.lower().endswith(VIDEO_EXTENSIONS):
+                full_path = os.path.join(root, name)
+                # These functions will check the cache and queue if needed
+                get_video_metadata(full_path)
+                generate_thumbnail(full_path)
+                found_count += 1
+    return found_count
 
-def scan_all_media_folders():
+def scan_all_media_folders(media_folders=None):
     """
-    Proactively scans all configured media folders and subdirectories, queuing
-    any uncached files for metadata and thumbnail generation.
+    Proactively scans all configured media folders (or only the given ones) and their
+    subdirectories, queuing any uncached files for metadata and thumbnail generation.
     """
+    global _library_scanned, _last_full_scan
     print("Starting proactive library scan...")
-    media_folders = config.settings.get("media_folders", [])
-    valid_extensions = ('.mp4', '.mkv', '.avi', '.mov', '.webm')
+    full_scan = media_folders is None
+    started_at = time.time()
+    if full_scan:
+        media_folders = config.settings.get("media_folders", [])
     found_count = 0
+    folder_mtimes = {}
     
     for folder in media_folders:
         if os.path.exists(folder):
-            for root, _, files in os.walk(folder):
-                for name in files:
-                    if name.lower().endswith(valid_extensions):
-                        full_path = os.path.join(root, name)
-                        # These functions will check the cache and queue if needed
-                        get_video_metadata(full_path)
-                        generate_thumbnail(full_path)
-                        found_count += 1
+            found_count += _scan_tree(folder, folder_mtimes)
+    with _folder_mtimes_lock:
+        _folder_mtimes.update(folder_mtimes)
+        if full_scan:
+            _library_scanned = True
+            _last_full_scan = started_at
     print(f"Proactive scan complete. Found {found_count} media files.")
 
-# === THE FIX: New function to handle file deletion ===
+def scan_changed_folders(folder_mtimes, last_full_scan):
+    """
+    Startup scan after a clean shutdown: every folder known at shutdown is stat'ed, and only
+    folders whose mtime changed are listed (new subfolders are walked in full). Files changed
+    in place without touching their folder are left to the watcher and to the next full scan,
+    which startup_scan runs once last_full_scan is FULL_SCAN_INTERVAL old.
+    """
+    global _library_scanned, _last_full_scan
+    print("Checking library folders for changes since the last shutdown...")
+    current_mtimes = {}
+    changed_count = found_count = 0
+    for folder, mtime in folder_mtimes.items():
+        try:
+            current_mtimes[folder] = os.stat(folder).st_mtime_ns
+        except OSError:
+            continue  # Deleted while the server was down; the library GC drops its entries
+        if current_mtimes[folder] == mtime:
+            continue
+        changed_count += 1
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        if entry.path not in folder_mtimes:
+                            found_count += _scan_tree(entry.path, current_mtimes)
+                    elif entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                        get_video_metadata(entry.path, entry.stat())
+                        generate_thumbnail(entry.path)
+                        found_count += 1
+        except OSError as e:
+            print(f"Error scanning directory {folder}: {e}")
+    with _folder_mtimes_lock:
+        _folder_mtimes.update(current_mtimes)
+        _library_scanned = True
+        _last_full_scan = last_full_scan
+    print(f"Startup check complete: {changed_count} of {len(folder_mtimes)} folders changed, {found_count} media files in them.")
+
+def startup_scan():
+    """
+    Scans the library on startup. After a clean shutdown with the same media folders only
+    changed folders are rescanned; after a crash, a first start or when the last full walk is
+    FULL_SCAN_INTERVAL old the whole library is walked.
+    """
+    try:
+        with open(config.CLEAN_SHUTDOWN_FILE, 'r') as f:
+            marker = json.load(f)
+        # The marker is only valid for one start; a crash during this run must lead to a full scan.
+        os.remove(config.CLEAN_SHUTDOWN_FILE)
+    except (OSError, json.JSONDecodeError):
+        marker = None
+    last_full_scan = marker.get('last_full_scan', 0) if marker else 0
+    if (marker and marker.get('media_folders') == config.settings.get("media_folders", [])
+            and time.time() - last_full_scan < FULL_SCAN_INTERVAL):
+        scan_changed_folders(marker.get('folders', {}), last_full_scan)
+    else:
+        scan_all_media_folders()
+
+def write_clean_shutdown_marker():
+    """
+    Called on a clean shutdown: saves the pending jobs and, if the library scan had completed,
+    the folder mtimes that let the next start skip the full walk.
+    """
+    save_job_journal()
+    with _folder_mtimes_lock:
+        if not _library_scanned:
+            return
+        marker = {'media_folders': config.settings.get("media_folders", []), 'folders': dict(_folder_mtimes), 'last_full_scan': _last_full_scan}
+    try:
+        _write_json_atomically(config.CLEAN_SHUTDOWN_FILE, marker)
+    except OSError as e:
+        print(f"Error writing shutdown marker: {e}")
+
+def remove_files_from_cache(file_paths, keep_progress=()):
+    """
+    Removes several deleted files from the caches in one pass, saving each cache at most once.
+    Files with a content fingerprint are only marked as vanished and purged after
+    VANISHED_RETENTION_SECONDS, so a move between media folders keeps their data. Paths in
+    keep_progress (files replaced in place) lose their metadata and thumbnails right away but
+    keep their resume position.
+    """
+    keep_progress = set(keep_progress)
+    now = time.time()
+    purge, expired = [], []
+    with config.cache_lock:
+        for file_path in file_paths:
+            metadata = config.media_info_cache.get(hashlib.md5(file_path.encode()).hexdigest())
+            if file_path not in keep_progress and metadata and metadata.get('fingerprint'):
+                metadata.setdefault('vanished_at', now)
+            else:
+                purge.append(file_path)
+        for metadata in config.media_info_cache.values():
+            if metadata.get('vanished_at') and now - metadata['vanished_at'] > VANISHED_RETENTION_SECONDS:
+                expired.append(metadata)
+    search_index.remove_files(file_paths)
+    for metadata in expired:
+        if os.path.exists(metadata['path']):
+            with config.cache_lock:
+                metadata.pop('vanished_at', None)  # Came back under its old name
+            search_index.add_file(metadata['path'], metadata)
+        else:
+            purge.append(metadata['path'])
+    purge_files(purge, keep_progress)
+    if len(purge) < len(file_paths) + len(expired):
+        config.save_media_info_cache()
+    if file_paths:
+        print(f"Removed {len(file_paths)} files from the library.")
+
+def purge_files(file_paths, keep_progress=()):
+    """Drops the metadata, playback progress (unless in keep_progress) and thumbnails of files for good."""
+    if not file_paths:
+        return
+    search_index.remove_files(file_paths)
+    object_ids.forget([file_path for file_path in file_paths if file_path not in keep_progress])
+    path_hashes = {file_path: hashlib.md5(file_path.encode()).hexdigest() for file_path in file_paths}
+    progress_hashes = {h for p, h in path_hashes.items() if p not in keep_progress}
+    media_changed = progress_changed = False
+
+    with config.cache_lock:
+        for path_hash in path_hashes.values():
+            if config.media_info_cache.pop(path_hash, None) is not None:
+                media_changed = True
+        for path_hash in progress_hashes:
+            # Global mode keys progress by file; Per IP mode nests it under each client.
+            if config.playback_cache.pop(path_hash, None) is not None:
+                progress_changed = True
+                continue
+            for data in config.playback_cache.values():
+                if isinstance(data, dict) and data.pop(path_hash, None) is not None:
+                    progress_changed = True
+
+    if media_changed:
+        config.save_media_info_cache()
+    if progress_changed:
+        config.save_playback_cache()
+
+    for path_hash in path_hashes.values():
+        for variant in THUMBNAIL_VARIANTS:
+            thumbnail_store.remove(get_thumbnail_key(path_hash, variant))
+
 def remove_file_from_cache(file_path):
     """Removes a file's metadata, playback progress, and thumbnail from all caches."""
-    print(f"File deleted or moved. Removing from cache: {os.path.basename(file_path)}")
-    path_hash = hashlib.md5(file_path.encode()).hexdigest()
-    
+    remove_files_from_cache([file_path])
+
+def cached_paths_under(folder):
+    """Lists the files below a folder that have cached metadata (used when a folder disappears)."""
+    prefix = os.path.join(folder, '')
     with config.cache_lock:
-        # Remove from media info cache
-        config.media_info_cache.pop(path_hash, None)
-        
-        # Remove from playback cache (both Global and Per IP modes)
-        if path_hash in config.playback_cache:
-            config.playback_cache.pop(path_hash, None) # Global mode
-        else:
-            # Per IP mode
-            ips_to_clean = [ip for ip, data in config.playback_cache.items() if path_hash in data]
-            for ip in ips_to_clean:
-                config.playback_cache[ip].pop(path_hash, None)
-    
-    # Save the updated caches
+        return [m['path'] for m in config.media_info_cache.values() if m.get('path', '').startswith(prefix)]
+
+def purge_media_folders(removed_folders):
+    """Drops the cached data of files in media folders removed from the settings, unless another media folder still contains them."""
+    remaining = [os.path.join(folder, '') for folder in config.settings.get("media_folders", [])]
+    file_paths = {path for folder in removed_folders for path in cached_paths_under(folder)
+                  if not any(path.startswith(prefix) for prefix in remaining)}
+    purge_files(sorted(file_paths))
+    print(f"Purged {len(file_paths)} files of removed media folders from the cache.")
+
+def move_files_in_cache(moves):
+    """
+    Re-keys the metadata, playback progress, thumbnails and cached derived files of renamed
+    or moved files ({old path: new path}) in one pass, so nothing is probed or generated
+    again and resume positions are kept. Each cache is saved at most once.
+    """
+    if not moves:
+        return
+    hash_moves = {}
+    sidecars = {}
+    moved_metadata = {}
+    old_versions = {}  # old path -> (size, mtime) the file was cached with
+    for old_path, new_path in moves.items():
+        hash_moves[hashlib.md5(old_path.encode()).hexdigest()] = (hashlib.md5(new_path.encode()).hexdigest(), new_path)
+        try:
+            sidecars[new_path] = _find_sidecar_subtitles(new_path)
+        except OSError:
+            sidecars[new_path] = []
+
+    with config.cache_lock:
+        for old_hash, (new_hash, new_path) in hash_moves.items():
+            metadata = config.media_info_cache.pop(old_hash, None)
+            if metadata is not None:
+                old_versions[metadata['path']] = (metadata.get('size'), metadata.get('mtime'))
+                metadata = dict(metadata, path=new_path, sidecar_subtitles=sidecars[new_path])
+                metadata.pop('vanished_at', None)
+                config.media_info_cache[new_hash] = metadata
+                moved_metadata[new_path] = metadata
+            # Global mode keys progress by file; Per IP mode nests it under each client.
+            stores = [config.playback_cache] + [data for data in config.playback_cache.values()
+                                                if isinstance(data, dict) and 'last_position' not in data]
+            for store in stores:
+                progress = store.pop(old_hash, None)
+                if progress is not None:
+                    store[new_hash] = progress
     config.save_media_info_cache()
     config.save_playback_cache()
+    search_index.remove_files(list(moves))
+    for new_path, metadata in moved_metadata.items():
+        search_index.add_file(new_path, metadata)
+    object_ids.rename(moves)
+
+    for old_hash, (new_hash, _) in hash_moves.items():
+        for variant in THUMBNAIL_VARIANTS:
+            thumbnail_store.rename(get_thumbnail_key(old_hash, variant), get_thumbnail_key(new_hash, variant))
 
-    # Delete the thumbnail file
-    thumbnail_path = os.path.join(config.THUMBNAIL_DIR, f"{path_hash}.jpg")
-    if os.path.exists(thumbnail_path):
+    # Transcoded segments, prepared copies, seek previews and subtitles are keyed by file version.
+    # They move along with an unchanged file; if the file arrives as a different version (e.g. a
+    # copy that didn't keep its mtime), its old entries can't be reached any more and are dropped.
+    for old_path, new_path in moves.items():
         try:
-            os.remove(thumbnail_path)
-            print(f"Deleted thumbnail for: {os.path.basename(file_path)}")
-        except OSError as e:
-            print(f"Error deleting thumbnail file {thumbnail_path}: {e}")
+            st = os.stat(new_path)
+        except OSError:
+            continue
+        old_version = old_versions.get(old_path)
+        if old_version is None or old_version == (st.st_size, int(st.st_mtime)):
+            disk_cache.rename_prefix_everywhere(get_file_version_key(old_path, st), get_file_version_key(new_path, st))
+        else:
+            size, mtime = old_version
+            disk_cache.discard_prefix_everywhere(hashlib.md5(f"{old_path}|{size}|{mtime}".encode()).hexdigest())
+    print(f"Moved {len(moves)} files in the cache.")
 
-# (The rest of the file: scan_directory, get_full_structure, etc. remains the same)
 def scan_directory(path):
     """Scans a single directory for immediate display, queuing files as needed."""
     items = {'folders': [], 'files': []}
@@ -199,7 +787,7 @@ def scan_directory(path):
                 items['folders'].append({'name': item.name, 'path': item.path})
             elif item.is_file() and item.name.lower().endswith(('.mp4', '.mkv', '.avi', '.mov', '.webm')):
                 generate_thumbnail(item.path)
-                metadata = get_video_metadata(item.path)
+                metadata = get_video_metadata(item.path, item.stat())
                 
                 thumb_hash = hashlib.md5(item.path.encode()).hexdigest()
                 items['files'].append({
@@ -215,6 +803,70 @@ def scan_directory(path):
     items['files'].sort(key=lambda x: x['name'].lower())
     return items
 
+def _list_directory(path):
+    """Returns a folder's subfolders and videos as sorted (kind, lowercase name, name, path) tuples, folders first."""
+    mtime = os.stat(path).st_mtime_ns
+    with _listing_lock:
+        cached = _listing_cache.get(path)
+        if cached and cached[0] == mtime:
+            _listing_cache.move_to_end(path)
+            return cached[1]
+    entries = []
+    for item in os.scandir(path):
+        if item.is_dir():
+            entries.append((0, item.name.lower(), item.name, item.path))
+        elif item.is_file() and item.name.lower().endswith(VIDEO_EXTENSIONS):
+            entries.append((1, item.name.lower(), item.name, item.path))
+    entries.sort()
+    with _listing_lock:
+        _listing_cache[path] = (mtime, entries)
+        _listing_cache.move_to_end(path)
+        while len(_listing_cache) > LISTING_CACHE_SIZE:
+            _listing_cache.popitem(last=False)
+    return entries
+
+def list_video_paths(path):
+    """Paths of all videos directly inside a folder, in display order."""
+    try:
+        return [entry[3] for entry in _list_directory(path) if entry[0] == 1]
+    except OSError:
+        return []
+
+def _encode_cursor(entry):
+    return base64.urlsafe_b64encode(json.dumps(list(entry[:3])).encode()).decode()
+
+def _decode_cursor(cursor):
+    return tuple(json.loads(base64.urlsafe_b64decode(cursor.encode())))
+
+def browse_directory(path, cursor=None, limit=200, fields=None):
+    """
+    One page of a folder listing for the web UI. The cursor is the sort key of the last item
+    of the previous page, so pages stay consistent when files are added or removed in between.
+    Only cached data is returned; nothing is queued (see request_demand).
+    """
+    items = {'folders': [], 'files': [], 'next_cursor': None, 'total': 0}
+    try:
+        entries = _list_directory(path)
+    except OSError as e:
+        print(f"Error scanning directory {path}: {e}")
+        return items
+    start = bisect.bisect_right([entry[:3] for entry in entries], _decode_cursor(cursor)) if cursor else 0
+    page = entries[start:start + limit]
+    for kind, _, name, item_path in page:
+        if kind == 0:
+            items['folders'].append({'name': name, 'path': item_path})
+            continue
+        item = {'name': os.path.splitext(name)[0], 'path': item_path}
+        if not fields or 'thumb_hash' in fields:
+            item['thumb_hash'] = hashlib.md5(item_path.encode()).hexdigest()
+        if not fields or 'duration' in fields:
+            item['duration'] = (get_cached_metadata(item_path) or {}).get('duration', 0)
+        items['files'].append({k: v for k, v in item.items() if not fields or k in fields})
+    if start + limit < len(entries):
+        items['next_cursor'] = _encode_cursor(page[-1])
+    items['total'] = len(entries)
+    return items
+
 def get_full_structure():
     """Builds a nested dictionary of all media folders and their subdirectories."""
     structure = []
@@ -244,46 +896,48 @@ def get_subfolders(path):
     return subfolders
 
 def get_media_tracks(video_path):
-    """Uses ffprobe to get audio and subtitle tracks from a video file."""
+    """
+    Builds the audio and subtitle track lists for the web player from the cached probe data.
+    Never probes: a file that isn't probed yet is queued first in line and comes back with
+    'pending' set; the player asks again when the 'metadata' event for it arrives.
+    """
     from urllib.parse import quote
     tracks = {'audio': [], 'subtitles': []}
-    try:
-        ffprobe_cmd = [FFPROBE_PATH, '-v', 'quiet', '-print_format', 'json', '-show_streams', video_path]
-        result = subprocess.run(ffprobe_cmd, capture_output=True, text=True, check=True)
-        streams = json.loads(result.stdout).get('streams', [])
-        
-        internal_subtitle_index = 0
-        for stream in streams:
-            if stream.get('codec_type') == 'audio':
-                tracks['audio'].append({
-                    'id': stream['index'],
-                    'label': stream.get('tags', {}).get('title', f"Track {stream['index']}"),
-                    'lang': stream.get('tags', {}).get('language', 'unknown')
-                })
-            elif stream.get('codec_type') == 'subtitle':
-                safe_video_path = quote(video_path)
-                tracks['subtitles'].append({
-                    'lang': stream.get('tags', {}).get('language', 'eng'),
-                    'label': f"(Emb) {stream.get('tags', {}).get('title', 'Track {}'.format(stream['index']))}",
-                    'path': f"/subtitle/embedded/{safe_video_path}/{internal_subtitle_index}"
-                })
-                internal_subtitle_index += 1
-
-        video_basename = os.path.splitext(os.path.basename(video_path))[0]
-        video_dir = os.path.dirname(video_path)
-        for sub_file in os.listdir(video_dir):
-            if sub_file.lower().startswith(video_basename.lower()) and sub_file.lower().endswith(('.srt', '.vtt')):
-                lang_match = re.search(r'\.([a-zA-Z]{2,3})\.(srt|vtt)$', sub_file, re.IGNORECASE)
-                lang = lang_match.group(1) if lang_match else 'unknown'
-                tracks['subtitles'].append({
-                    'lang': lang,
-                    'label': f"(Ext) {lang}",
-                    'path': os.path.join(video_dir, sub_file)
-                })
-    except Exception as e:
-        print(f"Track Scan Error for {video_path}: {e}")
+    metadata = get_cached_metadata(video_path)
+    if metadata is None:
+        get_video_metadata(video_path, interactive=True)
+        tracks['pending'] = True
+        return tracks
+
+    for track in metadata.get('audio_tracks', []):
+        tracks['audio'].append({
+            'id': track['index'],
+            'label': track.get('title') or f"Track {track['index']}",
+            'lang': track.get('lang', 'unknown'),
+            'default': track.get('default', False)
+        })
+    safe_video_path = quote(video_path)
+    for internal_subtitle_index, track in enumerate(metadata.get('subtitle_tracks', [])):
+        tracks['subtitles'].append({
+            'lang': track.get('lang', 'eng'),
+            'label': f"(Emb) {track.get('title') or 'Track {}'.format(track['index'])}",
+            'path': f"/subtitle/embedded/{safe_video_path}/{internal_subtitle_index}"
+        })
+    for sidecar in metadata.get('sidecar_subtitles', []):
+        tracks['subtitles'].append({
+            'lang': sidecar['lang'],
+            'label': f"(Ext) {sidecar['lang']}",
+            'path': sidecar['path']
+        })
     return tracks
 
+def needs_transcoding(video_path):
+    """True if transcoding is enabled and the file's extension is in the configured transcode list."""
+    if not config.settings.get("enable_transcoding", False):
+        return False
+    transcode_formats = [f.strip() for f in config.settings.get("transcode_formats", "").split(',') if f.strip()]
+    return os.path.splitext(video_path)[1].lower() in transcode_formats
+
 def is_safe_path(path):
     """Security check to ensure file access is within allowed media folders."""
     abs_path = os.path.abspath(path)
@@ -0,0 +1,112 @@
+# object_ids.py
+import os
+import json
+from threading import Lock
+
+import config
+
+# Short UPnP object IDs. Every folder and video handed to a renderer gets a number instead of
+# its base64-encoded path, and the number is looked up in a dict both ways. Only paths from
+# listings of the media folders are ever given an ID, and IDs outside the media folders are
+# dropped on load and when a folder is removed, so an ID that resolves needs no further
+# checks. Renderers keep IDs for bookmarks and "recently played" lists, so the assignments are
+# appended to a log ([id, path] per line, path null for a removal) and replayed on startup.
+ROOT_ID = '0'
+
+# Rewrite the log on startup once it holds this many times more records than live IDs.
+COMPACT_RECORD_RATIO = 2
+
+_lock = Lock()
+_ids = {}          # path -> object id
+_paths = {}        # object id -> path
+_next_id = 1
+_log_file = None
+
+def load():
+    """Replays the ID log and opens it for appending, compacting it first if worthwhile."""
+    global _next_id, _log_file
+    os.makedirs(os.path.dirname(config.OBJECT_ID_FILE), exist_ok=True)
+    records = 0
+    with _lock:
+        _ids.clear()
+        _paths.clear()
+        if os.path.exists(config.OBJECT_ID_FILE):
+            with open(config.OBJECT_ID_FILE, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        object_id, path = json.loads(line)
+                    except ValueError:
+                        continue  # A torn record at the end (crash mid-write)
+                    records += 1
+                    _next_id = max(_next_id, int(object_id) + 1)
+                    old_path = _paths.pop(object_id, None)
+                    if old_path is not None:
+                        _ids.pop(old_path, None)
+                    if path is not None:
+                        _ids[path] = object_id
+                        _paths[object_id] = path
+        if records > COMPACT_RECORD_RATIO * len(_ids) + 1000:
+            tmp_path = config.OBJECT_ID_FILE + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps([object_id, path]) + '\n' for object_id, path in _paths.items())
+            os.replace(tmp_path, config.OBJECT_ID_FILE)
+        # Line buffered: each assignment reaches the file before the ID is sent to a client.
+        _log_file = open(config.OBJECT_ID_FILE, 'a', encoding='utf-8', buffering=1)
+    # The media folders may have changed while the server was not running.
+    dropped = forget_outside(config.settings.get("media_folders", []))
+    print(f"Object IDs: {len(_ids)} assigned" + (f", {dropped} outside the media folders dropped." if dropped else "."))
+
+def _append(object_id, path):
+    if _log_file is not None:
+        _log_file.write(json.dumps([object_id, path]) + '\n')
+
+def id_for(path):
+    """The object ID of a folder or video in the media folders, assigning one on first use."""
+    object_id = _ids.get(path)
+    if object_id is not None:
+        return object_id
+    global _next_id
+    with _lock:
+        object_id = _ids.get(path)
+        if object_id is None:
+            object_id = str(_next_id)
+            _next_id += 1
+            _ids[path] = object_id
+            _paths[object_id] = path
+            _append(object_id, path)
+    return object_id
+
+def path_for(object_id):
+    """The path an ID was assigned to, or None."""
+    return _paths.get(object_id)
+
+def rename(moves):
+    """Keeps the IDs of renamed or moved files ({old path: new path}), so bookmarks on renderers still work."""
+    with _lock:
+        for old_path, new_path in moves.items():
+            object_id = _ids.pop(old_path, None)
+            if object_id is None:
+                continue
+            replaced = _ids.get(new_path)
+            if replaced is not None:
+                _paths.pop(replaced, None)
+                _append(replaced, None)
+            _ids[new_path] = object_id
+            _paths[object_id] = new_path
+            _append(object_id, new_path)
+
+def forget(paths):
+    with _lock:
+        for path in paths:
+            object_id = _ids.pop(path, None)
+            if object_id is not None:
+                _paths.pop(object_id, None)
+                _append(object_id, None)
+
+def forget_outside(media_folders):
+    """Drops the IDs of everything outside the given media folders (after folders were removed in the settings)."""
+    roots = [os.path.join(folder, '') for folder in media_folders]
+    with _lock:
+        outside = [path for path in _ids if path not in media_folders and not any(path.startswith(root) for root in roots)]
+    forget(outside)
+    return len(outside)
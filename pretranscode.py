@@ -0,0 +1,135 @@
+# pretranscode.py
+import os
+import queue
+import subprocess
+from collections import OrderedDict
+from threading import Lock
+
+import config
+import media_manager
+import system_utils
+from disk_cache import DiskLRUCache
+
+# Codecs that can be copied into an MP4 container as-is.
+MP4_VIDEO_CODECS = ('h264',)
+MP4_AUDIO_CODECS = ('aac', 'mp3')
+
+PRETRANSCODE_QUEUE = queue.Queue()
+
+# Play counts are kept for this many recently played files; older counts are forgotten.
+MAX_PLAY_COUNTS = 1000
+
+_cache = None
+_queued_keys = set()
+_play_counts = OrderedDict()
+_state_lock = Lock()
+
+def init_cache():
+    """Creates the prepared-file cache using the configured size limit."""
+    global _cache
+    max_bytes = int(config.settings.get("prepared_cache_size_mb", 51200)) * 1024 * 1024
+    if _cache is not None:
+        _cache.max_bytes = max_bytes
+        _cache.evict()
+        return
+    _cache = DiskLRUCache(config.PREPARED_DIR, max_bytes)
+
+def _prepared_name(file_key):
+    return f"{file_key}.mp4"
+
+def get_prepared_path(video_path):
+    """Returns the path of a finished device-compatible copy of video_path, or None."""
+    if _cache is None:
+        return None
+    try:
+        return _cache.get(_prepared_name(media_manager.get_file_version_key(video_path)))
+    except OSError:
+        return None
+
+def queue_file(video_path):
+    """Queues a file for background preparation if the feature is enabled and it isn't prepared or queued."""
+    if not config.settings.get("enable_pretranscode") or _cache is None:
+        return
+    if not media_manager.needs_transcoding(video_path):
+        return
+    try:
+        file_key = media_manager.get_file_version_key(video_path)
+    except OSError:
+        return
+    with _state_lock:
+        if file_key in _queued_keys or _cache.contains(_prepared_name(file_key)):
+            return
+        _queued_keys.add(file_key)
+    PRETRANSCODE_QUEUE.put((video_path, file_key))
+
+def record_play(video_path):
+    """Counts an on-the-fly transcode; files played often enough are queued for preparation."""
+    threshold = int(config.settings.get("pretranscode_popular_plays", 2))
+    with _state_lock:
+        count = _play_counts.pop(video_path, 0) + 1
+        if count < threshold:
+            _play_counts[video_path] = count
+            while len(_play_counts) > MAX_PLAY_COUNTS:
+                _play_counts.popitem(last=False)
+    if count >= threshold:
+        queue_file(video_path)
+
+def _build_ffmpeg_cmd(video_path, output_path):
+    """Remuxes when the streams are already MP4-compatible, otherwise transcodes only what is needed."""
+    metadata = media_manager.probe_now(video_path)
+    video_codec, audio_codec = metadata.get('video_codec'), metadata.get('audio_codec')
+    video_args = ['-c:v', 'copy'] if video_codec in MP4_VIDEO_CODECS else ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '22', '-pix_fmt', 'yuv420p']
+    audio_args = ['-c:a', 'copy'] if audio_codec in MP4_AUDIO_CODECS else ['-c:a', 'aac', '-b:a', '192k', '-ac', '2']
+    mode = "remux" if video_args[1] == 'copy' and audio_args[1] == 'copy' else "transcode"
+    cmd = [
+        media_manager.FFMPEG_PATH, '-hide_banner', '-loglevel', 'error',
+        '-i', video_path, '-map', '0:v:0', '-map', '0:a:0?',
+        *video_args, *audio_args,
+        '-movflags', '+faststart', '-f', 'mp4', '-y', output_path
+    ]
+    return cmd, mode
+
+def _prepare_file(video_path, queued_key):
+    """
+    Produces the device-compatible MP4 for one file. Executed by the pretranscode_worker.
+    The key the file was queued under is released however this ends, so the file can be
+    queued again; if the file changed in the meantime its current version is prepared.
+    """
+    temp_path = None
+    try:
+        if not os.path.exists(video_path):
+            return
+        name = _prepared_name(media_manager.get_file_version_key(video_path))
+        if _cache.contains(name):
+            return
+        temp_path = _cache.temp_path_for(name)
+        ffmpeg_cmd, mode = _build_ffmpeg_cmd(video_path, temp_path)
+        print(f"Pre-transcode: starting {mode} of {os.path.basename(video_path)}")
+        process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        system_utils.set_low_priority(process.pid)
+        return_code = system_utils.run_paused_while_streaming(process, "Pre-transcode")
+        if return_code != 0:
+            raise RuntimeError(f"ffmpeg exited with code {return_code}")
+        _cache.add(name, temp_path)
+        config.bump_library_generation()  # Browse results now offer the prepared copy
+        print(f"Pre-transcode: ready for {os.path.basename(video_path)}")
+    except Exception as e:
+        print(f"Pre-transcode failed for {video_path}: {e}")
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            try: os.remove(temp_path)
+            except OSError: pass
+        with _state_lock:
+            _queued_keys.discard(queued_key)
+
+def pretranscode_worker():
+    """Worker thread that processes videos from the PRETRANSCODE_QUEUE, one at a time."""
+    print("Pre-transcode background worker started.")
+    while True:
+        try:
+            item = PRETRANSCODE_QUEUE.get()
+            if item is None: break # Sentinel value to stop
+            _prepare_file(*item)
+            PRETRANSCODE_QUEUE.task_done()
+        except Exception as e:
+            print(f"An error occurred in the pre-transcode worker: {e}")
@@ -0,0 +1,184 @@
+# search_index.py
+import os
+import re
+import bisect
+import heapq
+import itertools
+from threading import Lock
+
+import config
+
+# An in-memory inverted index over the library: video titles, the names of the folders they
+# are in and a few probed properties (languages, codecs, resolution). Every query word matches
+# as a prefix, and a result has to match all of them. The index is built from media_info_cache
+# at startup and kept current by media_manager whenever an entry is added, moved or removed.
+VIDEO, FOLDER = 'video', 'folder'
+
+_lock = Lock()
+_docs = {}             # doc id -> (not a folder, lowercase name, path, kind, name); sorts in display order
+_doc_ids = {}          # path -> doc id
+_doc_tokens = {}       # doc id -> tokens it is listed under
+_postings = {}         # token -> set of doc ids
+_vocabulary = []       # every token, sorted, for prefix lookups
+_folder_refs = {}      # folder path -> number of indexed videos below it
+_file_folders = {}     # video path -> the folders it was counted in
+_next_id = itertools.count(1)
+_bulk_loading = False  # rebuild() sorts the vocabulary once at the end
+
+_TOKEN_RE = re.compile(r'[^\W_]+')
+
+def tokenize(text):
+    return set(_TOKEN_RE.findall(text.lower()))
+
+def _resolution_tokens(height):
+    if height >= 2160: return {'2160p', '4k', 'uhd', 'hd'}
+    if height >= 1080: return {'1080p', 'hd'}
+    if height >= 720: return {'720p', 'hd'}
+    return {'sd'} if height else set()
+
+def _metadata_tokens(metadata):
+    tokens = set(metadata.get('languages', []))
+    for field in ('video_codec', 'audio_codec'):
+        if metadata.get(field):
+            tokens.add(metadata[field].lower())
+    tokens |= _resolution_tokens(metadata.get('height', 0))
+    return tokens
+
+def _media_roots():
+    return [os.path.join(root, '') for root in config.settings.get("media_folders", [])]
+
+def _folders_of(path, roots):
+    """The folders between the media folder containing a file and the file, innermost first."""
+    root = max((r for r in roots if path.startswith(r)), key=len, default=None)
+    if root is None:
+        return []
+    folders = []
+    folder = os.path.dirname(path)
+    while folder.startswith(root) and os.path.join(folder, '') != root:
+        folders.append(folder)
+        folder = os.path.dirname(folder)
+    return folders
+
+def _add_doc(kind, name, path, tokens):
+    doc_id = next(_next_id)
+    _docs[doc_id] = (kind != FOLDER, name.lower(), path, kind, name)
+    _doc_ids[path] = doc_id
+    _doc_tokens[doc_id] = tokens
+    for token in tokens:
+        postings = _postings.get(token)
+        if postings is None:
+            postings = _postings[token] = set()
+            if not _bulk_loading:
+                bisect.insort(_vocabulary, token)
+        postings.add(doc_id)
+
+def _remove_doc(path):
+    doc_id = _doc_ids.pop(path, None)
+    if doc_id is None:
+        return None
+    for token in _doc_tokens.pop(doc_id):
+        postings = _postings[token]
+        postings.discard(doc_id)
+        if not postings:
+            del _postings[token]
+            del _vocabulary[bisect.bisect_left(_vocabulary, token)]
+    return _docs.pop(doc_id)
+
+def _add_file(path, metadata, folders):
+    if path in _doc_ids or metadata.get('vanished_at'):
+        return
+    name = os.path.splitext(os.path.basename(path))[0]
+    tokens = tokenize(name) | _metadata_tokens(metadata)
+    for folder in folders:
+        _folder_refs[folder] = _folder_refs.get(folder, 0) + 1
+        doc_id = _doc_ids.get(folder)
+        if doc_id is None:
+            _add_doc(FOLDER, os.path.basename(folder), folder, tokenize(os.path.basename(folder)))
+            doc_id = _doc_ids[folder]
+        tokens |= _doc_tokens[doc_id]
+    _file_folders[path] = folders
+    _add_doc(VIDEO, name, path, tokens)
+
+def _remove_file(path):
+    if _remove_doc(path) is None:
+        return
+    for folder in _file_folders.pop(path, []):
+        refs = _folder_refs.get(folder, 0) - 1
+        if refs > 0:
+            _folder_refs[folder] = refs
+        else:
+            _folder_refs.pop(folder, None)
+            _remove_doc(folder)
+
+def rebuild():
+    """Indexes every file in media_info_cache from scratch (at startup and when the media folders change)."""
+    global _next_id, _bulk_loading
+    with _lock:
+        # Snapshot under _lock, so an add_file for a file probed meanwhile is applied after the
+        # rebuild instead of being wiped by it. Nothing takes the two locks in the other order.
+        with config.cache_lock:
+            entries = [(m['path'], m) for m in config.media_info_cache.values() if m.get('path')]
+        for structure in (_docs, _doc_ids, _doc_tokens, _postings, _folder_refs, _file_folders):
+            structure.clear()
+        _vocabulary.clear()
+        _next_id = itertools.count(1)
+        _bulk_loading = True
+        roots, folders_by_dir = _media_roots(), {}
+        try:
+            for path, metadata in entries:
+                directory = os.path.dirname(path)
+                if directory not in folders_by_dir:
+                    folders_by_dir[directory] = _folders_of(path, roots)
+                _add_file(path, metadata, folders_by_dir[directory])
+        finally:
+            _bulk_loading = False
+            _vocabulary.extend(sorted(_postings))
+        counts = len(_doc_ids) - len(_folder_refs), len(_folder_refs), len(_vocabulary)
+    print(f"Search index: {counts[0]} videos, {counts[1]} folders, {counts[2]} words.")
+
+def add_file(path, metadata):
+    """Indexes a file (again, if its metadata changed)."""
+    with _lock:
+        _remove_file(path)
+        _add_file(path, metadata, _folders_of(path, _media_roots()))
+
+def remove_files(paths):
+    with _lock:
+        for path in paths:
+            _remove_file(path)
+
+def _matching_ids(term):
+    """Ids of the docs with a word starting with term."""
+    ids = set()
+    i = bisect.bisect_left(_vocabulary, term)
+    while i < len(_vocabulary) and _vocabulary[i].startswith(term):
+        ids |= _postings[_vocabulary[i]]
+        i += 1
+    return ids
+
+def search(query, within=None, kind=None, offset=0, limit=100):
+    """
+    Returns (total matches, one page of {'kind', 'name', 'path'} dicts), folders first, then
+    by name. within limits results to a folder's subtree, kind to VIDEO or FOLDER.
+    """
+    terms = sorted(tokenize(query), key=len, reverse=True)
+    prefix = os.path.join(within, '') if within else None
+    with _lock:
+        if not terms:
+            ids = set(_docs)
+        else:
+            ids = None
+            # The longest words usually match the fewest docs, so the intersection shrinks fast.
+            for term in terms:
+                matches = _matching_ids(term)
+                ids = matches if ids is None else ids & matches
+                if not ids:
+                    break
+        docs = [_docs[doc_id] for doc_id in ids]
+    if kind:
+        docs = [doc for doc in docs if doc[3] == kind]
+    if prefix:
+        docs = [doc for doc in docs if doc[2].startswith(prefix)]
+    # Only the requested page is ordered, not every match of a broad query.
+    page = heapq.nsmallest(offset + limit, docs)[offset:]
+    return len(docs), [{'kind': k, 'name': name, 'path': path} for _, _, path, k, name in page]
@@ -8,6 +8,9 @@ from PIL import Image, ImageTk
 
 import config # Use the config module for constants
 
+# Marks polled media folders in the folder list.
+POLLING_SUFFIX = "  [polling]"
+
 class SettingsWindow:
     def __init__(self, parent, on_save_callback=None):
         self.parent = parent
@@ -68,13 +71,20 @@ class SettingsWindow:
         
         self.folder_listbox = tk.Listbox(folder_frame, height=5)
         self.folder_listbox.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E))
+        # Folders on network shares are polled instead of watched; they are marked in the list.
+        self.polled_folders = set(self.settings.get("polled_folders", []))
         for folder in self.settings.get("media_folders", []):
-            self.folder_listbox.insert(tk.END, folder)
+            self.folder_listbox.insert(tk.END, self._folder_label(folder))
         
         folder_button_frame = ttk.Frame(folder_frame)
         folder_button_frame.grid(row=1, column=0, columnspan=2, sticky=tk.W, pady=(5,0))
         ttk.Button(folder_button_frame, text="Add Folder", command=self.add_folder).pack(side=tk.LEFT, padx=(0, 5))
         ttk.Button(folder_button_frame, text="Remove Selected", command=self.remove_folder).pack(side=tk.LEFT)
+        ttk.Button(folder_button_frame, text="Toggle Polling (Network Share)", command=self.toggle_polling).pack(side=tk.LEFT, padx=(5, 0))
+
+        ttk.Label(folder_frame, text="Wait for copied files to settle (seconds):").grid(row=2, column=0, sticky=tk.W, pady=(5,0))
+        self.file_stable_seconds_var = tk.StringVar(value=self.settings.get("file_stable_seconds", 10))
+        ttk.Entry(folder_frame, textvariable=self.file_stable_seconds_var, width=10).grid(row=2, column=1, sticky=tk.W, pady=(5,0))
         
         # --- Thumbnail Section ---
         thumb_frame = ttk.LabelFrame(main_frame, text="Thumbnails", padding="10")
@@ -87,6 +97,9 @@ class SettingsWindow:
         ttk.Label(thumb_frame, text="Timestamp (seconds):").grid(row=1, column=0, sticky=tk.W, pady=2)
         self.thumbnail_timestamp_var = tk.StringVar(value=self.settings.get("thumbnail_timestamp"))
         ttk.Entry(thumb_frame, textvariable=self.thumbnail_timestamp_var, width=10).grid(row=1, column=1, sticky=tk.W)
+
+        self.enable_trickplay_var = tk.BooleanVar(value=self.settings.get("enable_trickplay", True))
+        ttk.Checkbutton(thumb_frame, text="Generate seek previews when a video is first played", variable=self.enable_trickplay_var).grid(row=2, column=0, columnspan=2, sticky=tk.W)
         
         # --- Cache Section (Clarified) ---
         cache_frame = ttk.LabelFrame(main_frame, text="Playback Cache (Web UI Only)", padding="10")
@@ -109,6 +122,17 @@ class SettingsWindow:
         ttk.Label(transcode_frame, text="Transcode formats (comma-separated):").grid(row=1, column=0, sticky=tk.W, pady=2)
         self.transcode_formats_var = tk.StringVar(value=self.settings.get("transcode_formats", ".mkv,.avi,.webm,.mov"))
         ttk.Entry(transcode_frame, textvariable=self.transcode_formats_var, width=40).grid(row=1, column=1, sticky=tk.EW)
+
+        ttk.Label(transcode_frame, text="Transcode cache size (MB, 0 = off):").grid(row=2, column=0, sticky=tk.W, pady=2)
+        self.transcode_cache_size_var = tk.StringVar(value=self.settings.get("transcode_cache_size_mb", 10240))
+        ttk.Entry(transcode_frame, textvariable=self.transcode_cache_size_var, width=10).grid(row=2, column=1, sticky=tk.W)
+
+        self.enable_pretranscode_var = tk.BooleanVar(value=self.settings.get("enable_pretranscode", False))
+        ttk.Checkbutton(transcode_frame, text="Prepare compatible copies of new and popular files in the background", variable=self.enable_pretranscode_var).grid(row=3, column=0, columnspan=2, sticky=tk.W)
+
+        ttk.Label(transcode_frame, text="Prepared files size limit (MB):").grid(row=4, column=0, sticky=tk.W, pady=2)
+        self.prepared_cache_size_var = tk.StringVar(value=self.settings.get("prepared_cache_size_mb", 51200))
+        ttk.Entry(transcode_frame, textvariable=self.prepared_cache_size_var, width=10).grid(row=4, column=1, sticky=tk.W)
         
         # --- General Options Section ---
         options_frame = ttk.LabelFrame(main_frame, text="Options", padding="10")
@@ -162,14 +186,31 @@ class SettingsWindow:
         for i in reversed(self.folder_listbox.curselection()):
             self.folder_listbox.delete(i)
 
+    def _folder_label(self, folder):
+        return folder + POLLING_SUFFIX if folder in self.polled_folders else folder
+
+    def _folder_path(self, label):
+        return label[:-len(POLLING_SUFFIX)] if label.endswith(POLLING_SUFFIX) else label
+
+    def toggle_polling(self):
+        for i in self.folder_listbox.curselection():
+            folder = self._folder_path(self.folder_listbox.get(i))
+            self.polled_folders ^= {folder}
+            self.folder_listbox.delete(i)
+            self.folder_listbox.insert(i, self._folder_label(folder))
+
     def save_and_close(self):
-        new_settings = {}
+        # Start from the loaded settings so options without a GUI field are preserved
+        new_settings = dict(self.settings)
         new_settings["server_name"] = self.server_name_var.get()
         new_settings["server_port"] = int(self.server_port_var.get())
-        new_settings["media_folders"] = list(self.folder_listbox.get(0, tk.END))
+        new_settings["media_folders"] = [self._folder_path(label) for label in self.folder_listbox.get(0, tk.END)]
+        new_settings["polled_folders"] = [f for f in new_settings["media_folders"] if f in self.polled_folders]
+        new_settings["file_stable_seconds"] = int(self.file_stable_seconds_var.get())
         new_settings["start_on_startup"] = self.start_on_startup_var.get()
         new_settings["generate_thumbnails"] = self.generate_thumbnails_var.get()
         new_settings["thumbnail_timestamp"] = int(self.thumbnail_timestamp_var.get())
+        new_settings["enable_trickplay"] = self.enable_trickplay_var.get()
         new_settings["enable_upnp"] = self.enable_upnp_var.get()
         new_settings["server_icon_path"] = self.server_icon_path_var.get()
         new_settings["cache_mode"] = self.cache_mode_var.get()
@@ -177,6 +218,9 @@ class SettingsWindow:
         # === THE FIX: Save transcoding settings ===
         new_settings["enable_transcoding"] = self.enable_transcoding_var.get()
         new_settings["transcode_formats"] = self.transcode_formats_var.get()
+        new_settings["transcode_cache_size_mb"] = int(self.transcode_cache_size_var.get())
+        new_settings["enable_pretranscode"] = self.enable_pretranscode_var.get()
+        new_settings["prepared_cache_size_mb"] = int(self.prepared_cache_size_var.get())
         
         with open(config.SETTINGS_FILE, 'w') as f:
             json.dump(new_settings, f, indent=4)
@@ -184,5 +228,5 @@ class SettingsWindow:
         if self.on_save_callback:
             self.on_save_callback()
             
-        messagebox.showinfo("Settings Saved", "Settings have been saved. Your library will now be refreshed.")
+        messagebox.showinfo("Settings Saved", "Settings have been saved and applied.")
         self.win.destroy()
\ No newline at end of file
@@ -21,6 +21,7 @@ document.addEventListener('DOMContentLoaded', () => {
   const progressBarFilled    = document.getElementById('progress-bar-filled');
   const progressBarHover     = document.getElementById('progress-bar-hover');
   const progressBarTooltip   = document.getElementById('progress-bar-tooltip');
+  const trickplayPreview     = document.getElementById('trickplay-preview');
 
   const volumeSlider = document.getElementById('volume-slider');
   const volumeIcon   = document.getElementById('volume-icon');
@@ -33,6 +34,7 @@ document.addEventListener('DOMContentLoaded', () => {
   const closeSettingsBtn  = document.getElementById('close-settings-button');
   const fullscreenBtn     = document.getElementById('fullscreen-btn');
   const refreshNavBtn     = document.getElementById('refresh-nav-btn');
+  const searchInput       = document.getElementById('search-input');
 
   const subtitleStyler = document.getElementById('subtitle-styler');
 
@@ -53,6 +55,17 @@ document.addEventListener('DOMContentLoaded', () => {
   let controlsTimeout;
   let firstSubtitleEnabled = false;
   let originalCues = [];
+  let currentPath = null;
+  let currentAudio = null;    // stream index of a non-default audio track, or null
+  let defaultAudio = null;
+  let knownDuration = NaN;    // duration reported by the server (remuxed streams don't carry one)
+  let tracksPending = false;  // the current file's tracks aren't known until it has been probed
+  let trickplayCues = [];     // [{start, end, url, x, y, w, h}] for the seek preview
+  let trickplayPending = false; // previews of the current file are being generated; a 'trickplay' event says when
+  let streamOffset = 0;       // remuxed and transcoded MP4 streams restart at 0 from wherever they were requested
+
+  // Containers browsers can usually play straight from /stream/; everything else goes through HLS
+  const NATIVE_EXTENSIONS = ['mp4', 'm4v', 'webm', 'mov'];
 
   // ============================================================
   // Helpers
@@ -135,99 +148,322 @@ document.addEventListener('DOMContentLoaded', () => {
       while (parentLi) { parentLi.classList.add('active-branch'); parentLi = parentLi.parentElement.closest('li'); }
     }
   }
-  async function loadContent(path) {
+  // ============================================================
+  // Media grid (paged + virtualized)
+  // ============================================================
+  // Folders are fetched a page at a time and only the rows around the viewport are in the DOM.
+  // Thumbnails load as their tiles scroll into view, and only those tiles are reported to the
+  // server as interactive demand, so it works on what the user is looking at first.
+  const scrollPanel = document.getElementById('content-panel');
+  const PAGE_SIZE = 200, GRID_GAP = 25, MIN_CARD_WIDTH = 220, OVERSCAN_ROWS = 2;
+  let gridItems = [];         // loaded tiles: { type: 'back' | 'folder' | 'video', name, path, thumbHash }
+  let gridTotal = 0;          // tiles in the whole folder, including ones not fetched yet
+  let gridCursor = null, gridPath = '', gridRequestId = 0, gridLoading = false;
+  let gridColumns = 1, rowHeight = 0, renderedRange = '';
+  let searchQuery = '';       // while set, the grid shows search results instead of a folder
+  const readyThumbs = new Set();
+  const progressByPath = new Map();   // path -> { position, duration } for "continue watching" bars
+  const pendingDemand = new Set();
+  let demandTimer = null;
+
+  const gridWindow = document.createElement('div');
+  gridWindow.className = 'media-grid media-grid-window';
+  contentPanel.appendChild(gridWindow);
+
+  const thumbObserver = window.IntersectionObserver
+    ? new IntersectionObserver(onTilesVisible, { root: scrollPanel, rootMargin: '200px 0px' })
+    : null;
+
+  async function loadContent(path, { keepScroll = false } = {}) {
+    const normalizedPath = path ? path.replace(/\\/g, '/') : '';
+    const requestId = ++gridRequestId;
+    searchQuery = '';
+    if (searchInput) searchInput.value = '';
     try {
-      const normalizedPath = path ? path.replace(/\\/g, '/') : '';
-      const url = normalizedPath ? `/api/browse/${encodeURIComponent(normalizedPath)}` : '/api/browse/';
-      const res = await fetch(url);
-      if (!res.ok) throw new Error(`HTTP ${res.status}`);
-      const data = await res.json();
+      const data = await fetchPage(normalizedPath, null, requestId);
+      if (!data) return;
 
-      let html = '';
+      gridPath = normalizedPath;
+      gridItems = [];
       const isAtRoot = !normalizedPath || data.folders.some(f => f.path.replace(/\\/g, '/') === normalizedPath);
-
       if (!isAtRoot) {
         let parentPath = normalizedPath.substring(0, normalizedPath.lastIndexOf('/'));
         if (!parentPath.includes('/')) parentPath = '';
-        html += `<div class="media-card folder go-back" data-path="${parentPath}">
-                  <div class="card-icon">↩️</div><h3>Go Back</h3>
-                </div>`;
+        gridItems.push({ type: 'back', name: 'Go Back', path: parentPath });
       }
-      data.folders.forEach(folder => {
-        html += `<div class="media-card folder" data-path="${folder.path.replace(/\\/g, '/')}">
-                  <div class="card-icon">📁</div><div class="card-content"><h3>${folder.name}</h3></div>
-                </div>`;
-      });
-      data.files.forEach(file => {
-        html += `<div class="media-card video" data-path="${file.path.replace(/\\/g, '/')}">
-                  <div class="card-thumbnail" data-thumb-hash="${file.thumb_hash}"></div>
-                  <div class="card-content"><h3>${file.name}</h3></div>
-                </div>`;
-      });
-
-      contentPanel.innerHTML = html;
-      contentPanel.querySelectorAll('.card-thumbnail').forEach(loadThumbnail);
+      gridTotal = gridItems.length + (data.total ?? data.folders.length + data.files.length);
+      appendPage(data);
 
       currentFolderTitle.textContent = path ? path.split(/[\\/]/).pop() : 'Home';
-
       if (window.history.state?.path !== normalizedPath) {
         history.pushState({ path: normalizedPath }, '', `?path=${encodeURIComponent(normalizedPath) || ''}`);
       }
-
-      bindContentListeners();
+      if (!keepScroll) scrollPanel.scrollTop = 0;
+      renderGrid(true);
     } catch (err) {
       console.error('Failed to load content:', path, err);
     }
   }
+  async function fetchPage(normalizedPath, cursor, requestId) {
+    let base = normalizedPath ? `/api/browse/${encodeURIComponent(normalizedPath)}` : '/api/browse/';
+    const params = new URLSearchParams({ limit: PAGE_SIZE, fields: 'name,path,thumb_hash' });
+    if (searchQuery) {
+      base = '/api/search';
+      params.set('q', searchQuery);
+      if (cursor) params.set('offset', cursor);
+    } else if (cursor) {
+      params.set('cursor', cursor);
+    }
+    const res = await fetch(`${base}?${params}`);
+    if (!res.ok) throw new Error(`HTTP ${res.status}`);
+    const data = await res.json();
+    return requestId === gridRequestId ? data : null;   // a newer folder was opened meanwhile
+  }
+  // Search results use the same grid and paging as folders; clearing the box goes back to the folder.
+  async function loadSearch(query) {
+    const requestId = ++gridRequestId;
+    searchQuery = query;
+    try {
+      const data = await fetchPage('', null, requestId);
+      if (!data) return;
+      gridItems = [];
+      gridTotal = data.total;
+      appendPage(data);
+      currentFolderTitle.textContent = `Search: ${query}`;
+      scrollPanel.scrollTop = 0;
+      renderGrid(true);
+    } catch (err) {
+      console.error('Search failed:', query, err);
+    }
+  }
+  let searchTimer = null;
+  searchInput?.addEventListener('input', () => {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => {
+      const query = searchInput.value.trim();
+      if (query) loadSearch(query);
+      else if (searchQuery) loadContent(gridPath);
+    }, 250);
+  });
+
+  function appendPage(data) {
+    data.folders.forEach(f => gridItems.push({ type: 'folder', name: f.name, path: f.path.replace(/\\/g, '/') }));
+    // Video paths are kept exactly as the server sent them so /api/demand refers to the same files.
+    data.files.forEach(f => gridItems.push({ type: 'video', name: f.name, path: f.path, thumbHash: f.thumb_hash }));
+    gridCursor = data.next_cursor || null;
+    if (!gridCursor) gridTotal = gridItems.length;
+    loadProgressFor(data.files.map(f => f.path));
+  }
+  // One request for the resume positions of a whole page of tiles.
+  async function loadProgressFor(paths) {
+    if (!paths.length) return;
+    try {
+      const res = await fetch('/api/get_progress_batch', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ paths }) });
+      if (!res.ok) return;
+      const { items } = await res.json();
+      Object.entries(items).forEach(([path, info]) => progressByPath.set(path, info));
+      renderGrid(true);
+    } catch (err) {
+      console.warn('Failed to load progress:', err);
+    }
+  }
+  function progressBarHTML(path) {
+    const info = progressByPath.get(path);
+    if (!info || !(info.position > 0) || !(info.duration > 0)) return '';
+    const pct = Math.min(100, (info.position / info.duration) * 100).toFixed(1);
+    return `<div class="card-progress"><div class="card-progress-filled" style="width:${pct}%"></div></div>`;
+  }
+  async function loadNextPage() {
+    if (gridLoading || !gridCursor) return;
+    gridLoading = true;
+    const requestId = gridRequestId;
+    try {
+      const data = await fetchPage(gridPath, gridCursor, requestId);
+      if (data) { appendPage(data); renderGrid(true); }
+    } catch (err) {
+      console.error('Failed to load more items:', err);
+    } finally {
+      gridLoading = false;
+    }
+  }
+
+  function escapeHTML(s) {
+    return String(s).replace(/[&<>"']/g, c => ({ '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' }[c]));
+  }
+  function cardHTML(item) {
+    const path = escapeHTML(item.path);
+    if (item.type === 'back') {
+      return `<div class="media-card folder go-back" data-path="${path}"><div class="card-icon">↩️</div><h3>Go Back</h3></div>`;
+    }
+    if (item.type === 'folder') {
+      return `<div class="media-card folder" data-path="${path}"><div class="card-icon">📁</div><div class="card-content"><h3>${escapeHTML(item.name)}</h3></div></div>`;
+    }
+    const style = readyThumbs.has(item.thumbHash) ? ` style="background-image:url(/thumb/${item.thumbHash}.jpg)"` : '';
+    return `<div class="media-card video" data-path="${path}">
+              <div class="card-thumbnail" data-thumb-hash="${item.thumbHash}"${style}></div>${progressBarHTML(item.path)}
+              <div class="card-content"><h3>${escapeHTML(item.name)}</h3></div>
+            </div>`;
+  }
+  function measureGrid() {
+    const width = contentPanel.clientWidth;
+    gridColumns = Math.max(1, Math.floor((width + GRID_GAP) / (MIN_CARD_WIDTH + GRID_GAP)));
+    const cardWidth = (width - GRID_GAP * (gridColumns - 1)) / gridColumns;
+    const cardHeight = Math.ceil(cardWidth * 0.5625 + 55);   // 16:9 thumbnail + title row
+    rowHeight = cardHeight + GRID_GAP;
+    contentPanel.style.setProperty('--card-height', `${cardHeight}px`);
+    gridWindow.style.gridTemplateColumns = `repeat(${gridColumns}, 1fr)`;
+  }
+  function renderGrid(force = false) {
+    if (force || !rowHeight) measureGrid();
+    const rows = Math.ceil(gridTotal / gridColumns);
+    contentPanel.style.height = rows ? `${rows * rowHeight - GRID_GAP}px` : '0px';
+
+    const viewTop = scrollPanel.getBoundingClientRect().top - contentPanel.getBoundingClientRect().top;
+    const firstRow = Math.max(0, Math.floor(viewTop / rowHeight) - OVERSCAN_ROWS);
+    const lastRow = Math.max(firstRow, Math.ceil((viewTop + scrollPanel.clientHeight) / rowHeight) + OVERSCAN_ROWS);
+    const start = firstRow * gridColumns;
+    const end = Math.min(gridTotal, (lastRow + 1) * gridColumns);
+    if (end > gridItems.length) loadNextPage();
+
+    const range = `${start}:${Math.min(end, gridItems.length)}:${gridItems.length}`;
+    if (!force && range === renderedRange) return;
+    renderedRange = range;
+
+    thumbObserver?.disconnect();
+    gridWindow.style.transform = `translateY(${firstRow * rowHeight}px)`;
+    gridWindow.innerHTML = gridItems.slice(start, end).map(cardHTML).join('');
+    gridWindow.querySelectorAll('.media-card.video').forEach(card => {
+      if (thumbObserver) thumbObserver.observe(card);
+      else onTileVisible(card);
+    });
+  }
+  function onTilesVisible(entries) {
+    entries.forEach(entry => {
+      if (!entry.isIntersecting) return;
+      thumbObserver.unobserve(entry.target);
+      onTileVisible(entry.target);
+    });
+  }
+  function onTileVisible(card) {
+    const thumbDiv = card.querySelector('.card-thumbnail');
+    if (thumbDiv && !readyThumbs.has(thumbDiv.dataset.thumbHash)) {
+      loadThumbnail(thumbDiv);
+      pendingDemand.add(card.dataset.path);
+      clearTimeout(demandTimer);
+      demandTimer = setTimeout(sendDemand, 250);
+    }
+  }
+  function sendDemand() {
+    const paths = [...pendingDemand];
+    pendingDemand.clear();
+    if (!paths.length) return;
+    fetch('/api/demand', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ paths }) })
+      .catch(err => console.warn('Failed to report visible items:', err));
+  }
+  scrollPanel.addEventListener('scroll', () => requestAnimationFrame(() => renderGrid()), { passive: true });
+  window.addEventListener('resize', () => requestAnimationFrame(() => renderGrid(true)));
+
   function loadThumbnail(thumbDiv) {
     const thumbHash = thumbDiv.dataset.thumbHash;
     if (!thumbHash) return;
-    const url = `/static/.thumbnails/${thumbHash}.jpg`;
+    const url = `/thumb/${thumbHash}.jpg`;
     const img = new Image();
     img.src = url;
-    img.onload = () => { thumbDiv.style.backgroundImage = `url(${url})`; };
-    img.onerror = () => pollForThumbnail(thumbDiv, thumbHash);
-  }
-  function pollForThumbnail(thumbDiv, thumbHash) {
-    const pollInterval = 3000, maxPolls = 10;
-    let count = 0;
-    const id = setInterval(async () => {
-      if (count++ >= maxPolls) return clearInterval(id);
-      try {
-        const res = await fetch(`/api/check_thumb/${thumbHash}`);
-        if (res.ok) {
-          const data = await res.json();
-          if (data.status === 'ready') {
-            clearInterval(id);
-            const url = `/static/.thumbnails/${thumbHash}.jpg`;
-            thumbDiv.style.backgroundImage = `url(${url})`;
-          }
-        }
-      } catch {}
-    }, pollInterval);
+    img.onload = () => { readyThumbs.add(thumbHash); thumbDiv.style.backgroundImage = `url(${url})`; delete thumbDiv.dataset.pending; };
+    // Not generated yet: the server announces it with a 'thumbnail' event (see connectEvents).
+    img.onerror = () => { thumbDiv.dataset.pending = '1'; };
   }
 
-  function bindContentListeners() {
-    // Request fullscreen synchronously on user gesture (before awaits)
-    contentPanel.querySelectorAll('.video').forEach(el => {
-      el.addEventListener('click', async () => {
-        const path = el.dataset.path;
-        videoOverlay.classList.remove('hidden');
-        document.body.style.overflow = 'hidden';
-        try { await (videoOverlay.requestFullscreen?.() || Promise.resolve()); } catch(e){}
-
-        await playVideo(path);
-      });
+  // ============================================================
+  // Live updates (Server-Sent Events)
+  // ============================================================
+  let libraryRefreshTimer = null;
+  function connectEvents() {
+    if (!window.EventSource) return;
+    const source = new EventSource('/api/events');
+    let connectedBefore = false;
+    source.addEventListener('open', () => {
+      // Events sent while we were disconnected are lost; re-check what we were waiting for.
+      if (connectedBefore) contentPanel.querySelectorAll('.card-thumbnail[data-pending]').forEach(loadThumbnail);
+      if (connectedBefore && trickplayPending && currentPath) loadTrickplay(currentPath, true);
+      connectedBefore = true;
     });
-    contentPanel.querySelectorAll('.folder').forEach(el => {
-      el.addEventListener('click', () => {
-        const newPath = el.dataset.path;
-        loadContent(newPath);
-        updateNavSelection(newPath);
-      });
+    source.addEventListener('thumbnail', (e) => {
+      const { thumb_hash } = JSON.parse(e.data);
+      const thumbDiv = contentPanel.querySelector(`.card-thumbnail[data-thumb-hash="${thumb_hash}"]`);
+      if (thumbDiv) loadThumbnail(thumbDiv);
+    });
+    source.addEventListener('metadata', (e) => {
+      const { path, duration } = JSON.parse(e.data);
+      if (!currentPath || path.replace(/\\/g, '/') !== currentPath.replace(/\\/g, '/')) return;
+      if (!Number.isFinite(knownDuration) && duration > 0) knownDuration = duration;
+      if (tracksPending) loadTracks(currentPath);
+    });
+    source.addEventListener('trickplay', (e) => {
+      const { path } = JSON.parse(e.data);
+      if (trickplayPending && currentPath && path.replace(/\\/g, '/') === currentPath.replace(/\\/g, '/')) loadTrickplay(currentPath, true);
+    });
+    source.addEventListener('library', (e) => {
+      const { folders = [] } = JSON.parse(e.data);
+      const shown = (new URLSearchParams(window.location.search).get('path') || '').replace(/\\/g, '/');
+      const affectsView = folders.some(f => f.replace(/\\/g, '/') === shown);
+      // Bursts of file changes collapse into one refresh.
+      clearTimeout(libraryRefreshTimer);
+      libraryRefreshTimer = setTimeout(async () => {
+        await initializeNav();
+        updateNavSelection(shown);
+        if (affectsView && !searchQuery) loadContent(shown, { keepScroll: true });
+      }, 1000);
     });
   }
 
+  // One delegated handler for all tiles, since the grid re-renders as it scrolls.
+  contentPanel.addEventListener('click', async (e) => {
+    const card = e.target.closest('.media-card');
+    if (!card) return;
+    const path = card.dataset.path;
+    if (card.classList.contains('video')) {
+      // Request fullscreen synchronously on user gesture (before awaits)
+      videoOverlay.classList.remove('hidden');
+      document.body.style.overflow = 'hidden';
+      try { await (videoOverlay.requestFullscreen?.() || Promise.resolve()); } catch(e){}
+
+      await playVideo(path);
+    } else {
+      loadContent(path);
+      updateNavSelection(path);
+    }
+  });
+
+  // ============================================================
+  // Playback progress reporting
+  // ============================================================
+  // Positions are collected locally and sent in batches; the last batch goes out with
+  // sendBeacon so it survives closing the tab.
+  const PROGRESS_SAMPLE_MS = 10000, PROGRESS_FLUSH_MS = 60000;
+  const pendingProgress = new Map();
+  function sampleProgress() {
+    if (!currentPath) return;
+    const position = playheadTime();
+    if (!(position > 0)) return;
+    pendingProgress.set(currentPath, position);
+    const duration = getDuration();
+    progressByPath.set(currentPath, { position, duration: Number.isFinite(duration) ? duration : 0 });
+  }
+  function flushProgress(useBeacon = false) {
+    if (!pendingProgress.size) return;
+    const body = JSON.stringify({ updates: [...pendingProgress].map(([path, position]) => ({ path, position })) });
+    pendingProgress.clear();
+    if (useBeacon && navigator.sendBeacon) { navigator.sendBeacon('/api/report_progress', body); return; }
+    fetch('/api/report_progress', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body, keepalive: true })
+      .catch(err => console.warn('Failed to report progress:', err));
+  }
+  setInterval(() => { if (!videoPlayer.paused && !videoPlayer.ended) sampleProgress(); }, PROGRESS_SAMPLE_MS);
+  setInterval(() => flushProgress(), PROGRESS_FLUSH_MS);
+  videoPlayer.addEventListener('pause', () => { sampleProgress(); flushProgress(); });
+  window.addEventListener('pagehide', () => { sampleProgress(); flushProgress(true); });
+  document.addEventListener('visibilitychange', () => { if (document.hidden) { sampleProgress(); flushProgress(true); } });
+
   // ============================================================
   // Player
   // ============================================================
@@ -235,15 +471,15 @@ document.addEventListener('DOMContentLoaded', () => {
     videoPlayer.innerHTML = '';       // clear old <track>s
     firstSubtitleEnabled = false;
 
-    try {
-      const trackRes = await fetch(`/api/get_tracks/${encodeURIComponent(path)}`);
-      const trackData = await trackRes.json();
-      populateTrackSelectors(trackData);
-    } catch (e) {
-      console.warn('Failed to load tracks:', e);
-    }
+    currentPath = path;
+    currentAudio = null;
+    defaultAudio = null;
+    knownDuration = NaN;
+    tracksPending = false;
 
-    videoPlayer.src = `/stream/${encodeURIComponent(path)}`;
+    await loadTracks(path);
+    attachSource(path);
+    loadTrickplay(path);
     try { await videoPlayer.play(); } catch (e) { console.warn('Autoplay may be blocked:', e); }
 
     // Make sure clocks are running for this new media
@@ -251,6 +487,123 @@ document.addEventListener('DOMContentLoaded', () => {
     updateProgressOnce();
   }
 
+  // Direct file for natively playable containers (falling back to HLS if the browser rejects it),
+  // HLS for everything else. The server only encodes the segments the player requests.
+  // A non-default audio track is served as a stream-copy remux (fragmented MP4) starting at startAt.
+  function attachSource(path, startAt = 0) {
+    detachSource();
+    const ext = path.split('.').pop().toLowerCase();
+    if (NATIVE_EXTENSIONS.includes(ext)) {
+      videoPlayer.addEventListener('error', () => { if (videoPlayer.dataset.path === path) attachHls(path, startAt); }, { once: true });
+      if (currentAudio !== null) {
+        streamOffset = startAt;
+        videoPlayer.src = `/stream/${encodeURIComponent(path)}?audio=${currentAudio}&format=mp4&start=${startAt}`;
+      } else {
+        videoPlayer.src = `/stream/${encodeURIComponent(path)}`;
+        if (startAt > 0) videoPlayer.addEventListener('loadedmetadata', () => { videoPlayer.currentTime = startAt; }, { once: true });
+      }
+    } else {
+      attachHls(path, startAt);
+    }
+    videoPlayer.dataset.path = path;
+  }
+  // Browsers with native HLS play the cached /hls/ stream. The others, and every browser while the
+  // transcode cache is off (503), get a live H.264/AAC fragmented MP4 transcode starting at startAt.
+  async function attachHls(path, startAt = 0) {
+    streamOffset = 0;
+    const audioQuery = currentAudio !== null ? `?audio=${currentAudio}` : '';
+    const playlist = `/hls/${encodeURIComponent(path)}/index.m3u8${audioQuery}`;
+    let available = false;
+    if (videoPlayer.canPlayType('application/vnd.apple.mpegurl')) {
+      try { available = (await fetch(playlist, { method: 'HEAD' })).status !== 503; } catch (e) { available = true; }
+      if (videoPlayer.dataset.path !== path) return;  // Another video was picked meanwhile
+    }
+    if (!available) {
+      attachTranscoded(path, startAt);
+      return;
+    }
+    videoPlayer.src = playlist;
+    if (startAt > 0) videoPlayer.addEventListener('loadedmetadata', () => { videoPlayer.currentTime = startAt; }, { once: true });
+  }
+  function attachTranscoded(path, startAt = 0) {
+    streamOffset = startAt;
+    const audioQuery = currentAudio !== null ? `&audio=${currentAudio}` : '';
+    videoPlayer.src = `/stream/${encodeURIComponent(path)}?transcode=true&format=mp4&start=${startAt}${audioQuery}`;
+    videoPlayer.play().catch(() => {});
+  }
+  function detachSource() {
+    delete videoPlayer.dataset.path;
+    streamOffset = 0;
+  }
+  // Remuxed and transcoded MP4 streams carry no duration and can't seek by themselves.
+  function isRestartedStream() { return videoPlayer.src.includes('format=mp4'); }
+  function playheadTime() { return (Number.isFinite(videoPlayer.currentTime) ? videoPlayer.currentTime : 0) + streamOffset; }
+  function seekTo(t) {
+    // Ask the server for a new stream starting at t.
+    if (isRestartedStream()) { attachSource(currentPath, t); videoPlayer.play().catch(() => {}); }
+    else videoPlayer.currentTime = t;
+  }
+  function switchAudioTrack(trackId) {
+    const id = parseInt(trackId, 10);
+    const next = (id === defaultAudio) ? null : id;
+    if (next === currentAudio || !currentPath) return;
+    const t = playheadTime();
+    currentAudio = next;
+    attachSource(currentPath, t);
+    videoPlayer.play().catch(() => {});
+  }
+
+  // Seek previews are generated on the server the first time a file is played; until they
+  // are ready the index returns 202 and is asked for again a little later.
+  async function loadTrickplay(path, retry = false) {
+    if (!retry) { trickplayCues = []; trickplayPreview?.classList.remove('ready'); }
+    trickplayPending = false;
+    try {
+      const res = await fetch(`/trickplay/${encodeURIComponent(path)}/index.vtt`);
+      if (currentPath !== path) return;
+      // 202: generation is queued or running; the server sends a 'trickplay' event when it ends.
+      trickplayPending = res.status === 202;
+      if (!res.ok || trickplayPending) return;
+      trickplayCues = parseTrickplayVtt(await res.text());
+    } catch (e) {
+      console.warn('Failed to load seek previews:', e);
+    }
+  }
+  function parseTrickplayVtt(text) {
+    const toSeconds = (s) => s.split(':').reduce((acc, part) => acc * 60 + parseFloat(part), 0);
+    const cues = [];
+    const blocks = text.split(/\r?\n\r?\n/);
+    for (const block of blocks) {
+      const m = block.match(/([\d:.]+)\s*-->\s*([\d:.]+)\s*\n(\S+)#xywh=(\d+),(\d+),(\d+),(\d+)/);
+      if (m) cues.push({ start: toSeconds(m[1]), end: toSeconds(m[2]), url: m[3], x: +m[4], y: +m[5], w: +m[6], h: +m[7] });
+    }
+    return cues;
+  }
+  function showTrickplayAt(t, hoverX) {
+    if (!trickplayPreview) return;
+    const cue = trickplayCues.find(c => t >= c.start && t < c.end) || trickplayCues[trickplayCues.length - 1];
+    if (!cue) { trickplayPreview.classList.remove('ready'); return; }
+    trickplayPreview.style.width = `${cue.w}px`;
+    trickplayPreview.style.height = `${cue.h}px`;
+    trickplayPreview.style.backgroundImage = `url("${cue.url}")`;
+    trickplayPreview.style.backgroundPosition = `-${cue.x}px -${cue.y}px`;
+    trickplayPreview.style.left = `${hoverX}px`;
+    trickplayPreview.classList.add('ready');
+  }
+
+  // A file that hasn't been probed yet comes back 'pending'; its tracks are fetched again on its 'metadata' event.
+  async function loadTracks(path) {
+    try {
+      const trackRes = await fetch(`/api/get_tracks/${encodeURIComponent(path)}`);
+      const trackData = await trackRes.json();
+      if (path !== currentPath) return;
+      tracksPending = !!trackData.pending;
+      if (!Number.isFinite(knownDuration)) knownDuration = Number(trackData.duration) || NaN;
+      populateTrackSelectors(trackData);
+    } catch (e) {
+      console.warn('Failed to load tracks:', e);
+    }
+  }
   function populateTrackSelectors(trackData) {
     const audioSelect = document.getElementById('audio-track-select');
     const subtitleSelect = document.getElementById('subtitle-track-select');
@@ -260,6 +613,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
     if (trackData?.audio?.length) {
       trackData.audio.forEach(t => audioSelect.add(new Option(`${t.lang} - ${t.label}`, t.id)));
+      const def = trackData.audio.find(t => t.default) || trackData.audio[0];
+      defaultAudio = def.id;
+      audioSelect.value = String(def.id);
     }
     if (trackData?.subtitles?.length) {
       firstSubtitleEnabled = false;
@@ -318,8 +674,13 @@ document.addEventListener('DOMContentLoaded', () => {
     else videoOverlay.requestFullscreen?.().catch(() => {});
   }
   backToBrowseBtn.addEventListener('click', () => {
+    sampleProgress();
+    flushProgress();
+    renderGrid(true);
     videoPlayer.pause();
-    videoPlayer.src = '';
+    detachSource();
+    videoPlayer.removeAttribute('src');
+    videoPlayer.load();
     videoOverlay.classList.add('hidden');
     settingsPanel.classList.add('hidden');
     document.body.style.overflow = 'auto';
@@ -330,6 +691,7 @@ document.addEventListener('DOMContentLoaded', () => {
   // Settings
   settingsBtn.addEventListener('click', () => settingsPanel.classList.toggle('hidden'));
   closeSettingsBtn?.addEventListener('click', (e) => { e.stopPropagation(); settingsPanel.classList.add('hidden'); });
+  document.getElementById('audio-track-select').addEventListener('change', (e) => switchAudioTrack(e.target.value));
   document.getElementById('subtitle-track-select').addEventListener('change', (e) => {
     const val = e.target.value;
     for (let i = 0; i < videoPlayer.textTracks.length; i++) videoPlayer.textTracks[i].mode = 'hidden';
@@ -385,6 +747,7 @@ document.addEventListener('DOMContentLoaded', () => {
     */
     
     function getDuration() {
+      if (isRestartedStream() && Number.isFinite(knownDuration) && knownDuration > 0) return knownDuration;
       const d = videoPlayer.duration;
       if (Number.isFinite(d) && d > 0) return d;
       const s = videoPlayer.seekable;
@@ -392,6 +755,7 @@ document.addEventListener('DOMContentLoaded', () => {
       return NaN;
     }
     function clamp01(x){ return x < 0 ? 0 : x > 1 ? 1 : x; }
+    function updateProgressOnce() { updateProgressAt(lastMediaTime || NaN); }
     
     // The one true updater — takes an explicit time 't' (mediaTime preferred)
     function updateProgressAt(t) {
@@ -415,7 +779,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // --- Frame clock (primary) ---
     function frameTick(now, metadata) {
       // metadata.mediaTime is the exact playhead time of the presented frame
-      lastMediaTime = (metadata && Number.isFinite(metadata.mediaTime)) ? metadata.mediaTime : videoPlayer.currentTime;
+      lastMediaTime = ((metadata && Number.isFinite(metadata.mediaTime)) ? metadata.mediaTime : videoPlayer.currentTime) + streamOffset;
       updateProgressAt(lastMediaTime);
       if (!videoPlayer.paused && !videoPlayer.ended) {
         frameReqId = videoPlayer.requestVideoFrameCallback(frameTick);
@@ -459,7 +823,7 @@ document.addEventListener('DOMContentLoaded', () => {
     
     // Kick on metadata
     videoPlayer.addEventListener('loadedmetadata', () => {
-      lastMediaTime = Number.isFinite(videoPlayer.currentTime) ? videoPlayer.currentTime : 0;
+      lastMediaTime = playheadTime();
       updateProgressAt(lastMediaTime);
       ensureFrameClock();
       ensureRAF();
@@ -471,8 +835,8 @@ document.addEventListener('DOMContentLoaded', () => {
       if (Number.isFinite(dur) && dur > 0) {
         const rect = progressBarContainer.getBoundingClientRect();
         const clickX = e.clientX - rect.left;
-        videoPlayer.currentTime = (clickX / rect.width) * dur;
-        lastMediaTime = videoPlayer.currentTime;
+        lastMediaTime = (clickX / rect.width) * dur;
+        seekTo(lastMediaTime);
         updateProgressAt(lastMediaTime);
       }
     });
@@ -485,31 +849,9 @@ document.addEventListener('DOMContentLoaded', () => {
       const t = pct * dur;
       if (progressBarHover)   progressBarHover.style.width = `${(pct*100).toFixed(2)}%`;
       if (progressBarTooltip) { progressBarTooltip.style.left = `${hoverX}px`; progressBarTooltip.textContent = formatTime(t); }
+      showTrickplayAt(t, hoverX);
     });
 
-  // ============================================================
-  // Seek & hover preview
-  // ============================================================
-  progressBarContainer?.addEventListener('click', (e) => {
-    const dur = getDuration();
-    if (Number.isFinite(dur) && dur > 0) {
-      const rect = progressBarContainer.getBoundingClientRect();
-      const clickX = e.clientX - rect.left;
-      videoPlayer.currentTime = (clickX / rect.width) * dur;
-      updateProgressOnce();
-    }
-  });
-  progressBarContainer?.addEventListener('mousemove', (e) => {
-    const dur = getDuration();
-    if (!Number.isFinite(dur) || dur <= 0) return;
-    const rect = progressBarContainer.getBoundingClientRect();
-    const hoverX = clamp(e.clientX - rect.left, 0, rect.width);
-    const pct = (hoverX / rect.width);
-    const t = pct * dur;
-    if (progressBarHover) progressBarHover.style.width = `${(pct*100).toFixed(2)}%`;
-    if (progressBarTooltip) { progressBarTooltip.style.left = `${hoverX}px`; progressBarTooltip.textContent = formatTime(t); }
-  });
-
   // Controls autohide
   videoOverlay.addEventListener('mousemove', () => {
     videoOverlay.style.cursor = 'default';
@@ -539,6 +881,7 @@ document.addEventListener('DOMContentLoaded', () => {
   });
 
   const initialPath = new URLSearchParams(window.location.search).get('path') || '';
+  connectEvents();
   initializeNav().then(() => {
     loadContent(decodeURIComponent(initialPath));
     updateNavSelection(decodeURIComponent(initialPath));
@@ -0,0 +1,130 @@
+# subtitle_cache.py
+import os
+import json
+import subprocess
+
+import webvtt
+
+import config
+import media_manager
+from disk_cache import DiskLRUCache, KeyedLocks
+
+# Embedded subtitle codecs ffmpeg can turn into WebVTT. Bitmap formats (PGS, VobSub) cannot be converted.
+TEXT_SUBTITLE_CODECS = ('subrip', 'ass', 'ssa', 'mov_text', 'webvtt', 'text')
+
+_cache = None
+_extract_locks = KeyedLocks()  # per file version; one conversion or extraction pass at a time
+
+def init_cache():
+    """Creates the subtitle cache using the configured size limit."""
+    global _cache
+    max_bytes = int(config.settings.get("subtitle_cache_size_mb", 256)) * 1024 * 1024
+    if _cache is not None:
+        _cache.max_bytes = max_bytes
+        _cache.evict()
+        return
+    _cache = DiskLRUCache(config.SUBTITLE_CACHE_DIR, max_bytes)
+
+def get_sidecar_vtt(sub_path):
+    """Returns the path of a WebVTT version of an external subtitle file, converting SRT once per file version."""
+    if not sub_path.lower().endswith('.srt'):
+        return sub_path
+    file_key = media_manager.get_file_version_key(sub_path)
+    name = f"{file_key}/sidecar.vtt"
+    path = _cache.get(name)
+    if path:
+        return path
+
+    # Concurrent requests for the same file would write to the same temporary path.
+    with _extract_locks.hold(file_key):
+        path = _cache.get(name)
+        if path:
+            return path
+        temp_path = _cache.temp_path_for(name)
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(webvtt.from_srt(sub_path).content)
+            return _cache.add(name, temp_path)
+        finally:
+            if os.path.exists(temp_path):
+                try: os.remove(temp_path)
+                except OSError: pass
+
+def _embedded_name(file_key, subtitle_number):
+    return f"{file_key}/embedded_{subtitle_number:02d}.vtt"
+
+def _failures_name(file_key):
+    return f"{file_key}/embedded_failed.json"
+
+def _read_failures(file_key):
+    """Subtitle numbers of a file version that could not be extracted; they are not retried."""
+    path = _cache.get(_failures_name(file_key))
+    if not path:
+        return set()
+    try:
+        with open(path, 'r') as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        return set()
+
+def _write_failures(file_key, subtitle_numbers):
+    temp_path = _cache.temp_path_for(_failures_name(file_key))
+    with open(temp_path, 'w') as f:
+        json.dump(sorted(subtitle_numbers), f)
+    _cache.add(_failures_name(file_key), temp_path)
+
+def _extract_all(video_path, file_key, subtitle_tracks):
+    """
+    Extracts every text subtitle stream of a file to WebVTT in a single ffmpeg pass,
+    so a large file is read once no matter how many tracks the player loads. Streams that
+    produce nothing, or all of them if ffmpeg fails, are recorded as failed for this version.
+    """
+    failed = _read_failures(file_key)
+    outputs, temp_paths = [], {}
+    for subtitle_number, track in enumerate(subtitle_tracks):
+        name = _embedded_name(file_key, subtitle_number)
+        if track.get('codec') not in TEXT_SUBTITLE_CODECS or subtitle_number in failed or _cache.contains(name):
+            continue
+        temp_paths[subtitle_number] = _cache.temp_path_for(name)
+        outputs += ['-map', f"0:{track['index']}", '-c:s', 'webvtt', '-f', 'webvtt', '-y', temp_paths[subtitle_number]]
+    if not outputs:
+        return
+    ffmpeg_cmd = [media_manager.FFMPEG_PATH, '-hide_banner', '-loglevel', 'error', '-i', video_path, *outputs]
+    newly_failed = set(temp_paths)
+    try:
+        subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
+        for subtitle_number, temp_path in temp_paths.items():
+            if os.path.exists(temp_path):
+                _cache.add(_embedded_name(file_key, subtitle_number), temp_path)
+                newly_failed.discard(subtitle_number)
+        print(f"Subtitle cache: extracted {len(temp_paths) - len(newly_failed)} subtitle tracks from {os.path.basename(video_path)}")
+    except Exception as e:
+        print(f"Subtitle cache: extraction failed for {video_path}: {e}")
+    finally:
+        for temp_path in temp_paths.values():
+            if os.path.exists(temp_path):
+                try: os.remove(temp_path)
+                except OSError: pass
+        if newly_failed:
+            _write_failures(file_key, failed | newly_failed)
+
+def get_embedded_vtt(video_path, subtitle_number):
+    """
+    Returns the path of the cached WebVTT for the n-th subtitle stream of a file, or None
+    if that stream is a bitmap format or could not be extracted.
+    """
+    subtitle_tracks = media_manager.probe_now(video_path).get('subtitle_tracks', [])
+    if subtitle_number >= len(subtitle_tracks) or subtitle_tracks[subtitle_number].get('codec') not in TEXT_SUBTITLE_CODECS:
+        return None
+    file_key = media_manager.get_file_version_key(video_path)
+    name = _embedded_name(file_key, subtitle_number)
+    path = _cache.get(name)
+    if path:
+        return path
+
+    with _extract_locks.hold(file_key):
+        path = _cache.get(name)
+        if path or subtitle_number in _read_failures(file_key):
+            return path
+        _extract_all(video_path, file_key, subtitle_tracks)
+    return _cache.get(name)
@@ -3,8 +3,11 @@ import os
 import shutil
 import ctypes
 import sys
+import time
 import subprocess
 
+import psutil
+
 import config
 
 def setup_custom_icon():
@@ -30,6 +33,35 @@ def setup_custom_icon():
             print("Custom server icon removed.")
         return False
 
+def set_low_priority(pid):
+    """Drops a child process to the lowest scheduling priority so it only uses idle CPU."""
+    try:
+        proc = psutil.Process(pid)
+        proc.nice(psutil.IDLE_PRIORITY_CLASS if os.name == 'nt' else 19)
+        if hasattr(proc, 'ionice'):
+            proc.ionice(psutil.IOPRIO_VERYLOW if os.name == 'nt' else psutil.IOPRIO_CLASS_IDLE)
+    except (psutil.Error, OSError) as e:
+        print(f"Could not lower priority of process {pid}: {e}")
+
+def run_paused_while_streaming(process, label):
+    """Waits for a background ffmpeg process to finish, suspending it whenever a client is streaming."""
+    proc = psutil.Process(process.pid)
+    paused = False
+    while process.poll() is None:
+        with config.stream_state_lock:
+            streaming = config.active_streams > 0 or time.time() - config.last_segment_request_time < 30
+        try:
+            if streaming and not paused:
+                proc.suspend(); paused = True
+                print(f"{label}: paused while streams are active.")
+            elif not streaming and paused:
+                proc.resume(); paused = False
+                print(f"{label}: resumed.")
+        except psutil.Error:
+            pass
+        time.sleep(1)
+    return process.returncode
+
 def setup_windows_firewall():
     """Adds a firewall rule for the Python executable if running on Windows."""
     if os.name != 'nt':
@@ -0,0 +1,29 @@
+import ntpath
+import os
+import types
+
+import config
+import library_gc
+import media_manager
+
+
+def test_sweep_catalog_keeps_mixed_separator_keys(monkeypatch):
+    # A Windows media folder, and a cache key written by the web UI with forward slashes and other casing.
+    windows_os = types.SimpleNamespace(**vars(os))
+    windows_os.path = ntpath
+    monkeypatch.setattr(library_gc, 'os', windows_os)
+    monkeypatch.setattr(library_gc, '_root_available', lambda root: True)
+    monkeypatch.setitem(config.settings, 'media_folders', ['D:\\Media'])
+    inside, outside = 'd:/media/Show/S01/ep1.mkv', 'E:/Other/ep2.mkv'
+    monkeypatch.setattr(config, 'media_info_cache', {
+        'a' * 32: {'path': inside, 'vanished_at': 1},
+        'b' * 32: {'path': outside},
+    })
+    purged, removed = [], []
+    monkeypatch.setattr(media_manager, 'purge_files', lambda paths: purged.extend(paths))
+    monkeypatch.setattr(media_manager, 'remove_files_from_cache', lambda paths: removed.extend(paths))
+
+    library_gc._sweep_catalog(library_gc._Throttle())
+
+    assert purged == [outside]
+    assert removed == [inside]  # Treated as a file in the media folder, not purged as outside
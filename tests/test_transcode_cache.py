@@ -0,0 +1,36 @@
+import threading
+import time
+
+import transcode_cache
+from disk_cache import DiskLRUCache
+
+
+def test_concurrent_requests_encode_a_segment_once(monkeypatch, tmp_path):
+    monkeypatch.setattr(transcode_cache, '_cache', DiskLRUCache(str(tmp_path), 10 * 1024 * 1024))
+    encodes = []
+
+    def fake_ffmpeg(cmd, **kwargs):
+        encodes.append(cmd)
+        time.sleep(0.2)  # Long enough for every other request to queue on the segment
+        with open(cmd[-1], 'wb') as f:
+            f.write(b'segment')
+
+    monkeypatch.setattr(transcode_cache.subprocess, 'run', fake_ffmpeg)
+    start = threading.Barrier(8)
+    results = []
+
+    def request_segment(delay):
+        start.wait()
+        time.sleep(delay)
+        results.append(transcode_cache.ensure_segment('/media/video.mkv', 'a' * 32, 'hls', 3))
+
+    # Some requests queue while the first encode runs, others arrive as it finishes.
+    threads = [threading.Thread(target=request_segment, args=(i * 0.03,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(encodes) == 1
+    assert len(results) == 8 and len(set(results)) == 1 and results[0]
+    assert not transcode_cache._segment_locks.locks
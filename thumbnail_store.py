@@ -0,0 +1,162 @@
+# thumbnail_store.py
+import os
+import mmap
+import struct
+import zlib
+from threading import Lock
+
+import config
+
+# The store is two append-only files: a pack holding the JPEG bytes back to back, and an
+# index of fixed-size records (key, offset, length, crc32). Records are replayed in order on
+# load, so a later record for the same key replaces an earlier one and length 0 removes it.
+_RECORD = struct.Struct('<40sQII')
+
+# Compact (on startup and in the library GC) once this share of the pack is unreachable
+# (replaced or removed thumbnails).
+COMPACT_WASTE_RATIO = 0.25
+
+_lock = Lock()
+_index = {}            # key -> (offset, length, crc32)
+_pack_file = None
+_index_file = None
+_pack_size = 0
+_live_bytes = 0
+_mmap = None
+
+def init_store():
+    """Opens the pack and index and compacts it if worthwhile."""
+    global _pack_file, _index_file, _pack_size
+    os.makedirs(os.path.dirname(config.THUMBNAIL_PACK_FILE), exist_ok=True)
+    with _lock:
+        _close_files()
+        _pack_size = os.path.getsize(config.THUMBNAIL_PACK_FILE) if os.path.exists(config.THUMBNAIL_PACK_FILE) else 0
+        _load_index()
+        _pack_file = open(config.THUMBNAIL_PACK_FILE, 'ab')
+        _index_file = open(config.THUMBNAIL_INDEX_FILE, 'ab')
+    print(f"Thumbnail store: {len(_index)} thumbnails, {_pack_size // (1024 * 1024)} MB.")
+    if needs_compaction():
+        compact()
+
+def _load_index():
+    global _live_bytes
+    _index.clear()
+    if os.path.exists(config.THUMBNAIL_INDEX_FILE):
+        with open(config.THUMBNAIL_INDEX_FILE, 'rb') as f:
+            data = f.read()
+        # A torn record at the end (crash mid-write) is ignored.
+        for position in range(0, len(data) - _RECORD.size + 1, _RECORD.size):
+            raw_key, offset, length, crc = _RECORD.unpack_from(data, position)
+            key = raw_key.rstrip(b'\0').decode('ascii')
+            if length == 0:
+                _index.pop(key, None)
+            elif offset + length <= _pack_size:
+                _index[key] = (offset, length, crc)
+    _live_bytes = sum(length for _, length, _ in _index.values())
+
+def _close_files():
+    global _pack_file, _index_file, _mmap
+    for handle in (_mmap, _pack_file, _index_file):
+        if handle is not None:
+            handle.close()
+    _mmap = _pack_file = _index_file = None
+
+def _write_record(key, offset, length, crc):
+    _index_file.write(_RECORD.pack(key.encode('ascii'), offset, length, crc))
+    _index_file.flush()
+
+def keys():
+    with _lock:
+        return list(_index)
+
+def needs_compaction():
+    """True once more than COMPACT_WASTE_RATIO of the pack belongs to replaced or removed thumbnails."""
+    with _lock:
+        return bool(_pack_size) and (_pack_size - _live_bytes) / _pack_size > COMPACT_WASTE_RATIO
+
+def has(key):
+    """In-memory check, no disk access."""
+    return key in _index
+
+def put(key, data):
+    """Appends a thumbnail, replacing any earlier one stored under the same key."""
+    global _pack_size, _live_bytes
+    crc = zlib.crc32(data)
+    with _lock:
+        offset = _pack_size
+        _pack_file.write(data)
+        _pack_file.flush()
+        _pack_size += len(data)
+        # The blob is written before its index record, so a crash never leaves a record pointing at missing bytes.
+        _write_record(key, offset, len(data), crc)
+        previous = _index.get(key)
+        if previous:
+            _live_bytes -= previous[1]
+        _index[key] = (offset, len(data), crc)
+        _live_bytes += len(data)
+
+def remove(key):
+    global _live_bytes
+    with _lock:
+        entry = _index.pop(key, None)
+        if entry is None:
+            return False
+        _write_record(key, 0, 0, 0)
+        _live_bytes -= entry[1]
+    return True
+
+def rename(key, new_key):
+    """Makes a stored thumbnail available under a new key without copying its bytes."""
+    global _live_bytes
+    with _lock:
+        entry = _index.pop(key, None)
+        if entry is None:
+            return False
+        _write_record(new_key, *entry)
+        _write_record(key, 0, 0, 0)
+        previous = _index.get(new_key)
+        if previous:
+            _live_bytes -= previous[1]
+        _index[new_key] = entry
+    return True
+
+def get(key):
+    """Returns (jpeg bytes, etag) for a stored thumbnail, or None. Reads go through a memory map of the pack."""
+    global _mmap
+    with _lock:
+        entry = _index.get(key)
+        if entry is None:
+            return None
+        offset, length, crc = entry
+        if _mmap is None or len(_mmap) < offset + length:
+            # The pack has grown since it was mapped (or was empty); map it again.
+            if _mmap is not None:
+                _mmap.close()
+            with open(config.THUMBNAIL_PACK_FILE, 'rb') as f:
+                _mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return _mmap[offset:offset + length], f'"{crc:08x}"'
+
+def compact():
+    """Rewrites the pack with only the live thumbnails and starts a fresh index. Returns the bytes reclaimed."""
+    global _pack_file, _index_file, _pack_size, _live_bytes
+    with _lock:
+        old_size = _pack_size
+        _close_files()
+        pack_tmp, index_tmp = config.THUMBNAIL_PACK_FILE + '.tmp', config.THUMBNAIL_INDEX_FILE + '.tmp'
+        new_index = {}
+        with open(config.THUMBNAIL_PACK_FILE, 'rb') as src, open(pack_tmp, 'wb') as dst_pack, open(index_tmp, 'wb') as dst_index:
+            for key, (offset, length, crc) in _index.items():
+                src.seek(offset)
+                new_index[key] = (dst_pack.tell(), length, crc)
+                dst_pack.write(src.read(length))
+                dst_index.write(_RECORD.pack(key.encode('ascii'), *new_index[key]))
+        os.replace(pack_tmp, config.THUMBNAIL_PACK_FILE)
+        os.replace(index_tmp, config.THUMBNAIL_INDEX_FILE)
+        _index.clear()
+        _index.update(new_index)
+        _pack_size = _live_bytes = sum(length for _, length, _ in new_index.values())
+        _pack_file = open(config.THUMBNAIL_PACK_FILE, 'ab')
+        _index_file = open(config.THUMBNAIL_INDEX_FILE, 'ab')
+    reclaimed = old_size - _pack_size
+    print(f"Thumbnail store compacted: reclaimed {reclaimed // 1024} KB.")
+    return reclaimed
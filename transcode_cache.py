@@ -0,0 +1,150 @@
+# transcode_cache.py
+import os
+import math
+import subprocess
+from threading import Thread
+
+import config
+import media_manager
+from disk_cache import DiskLRUCache, KeyedLocks
+
+# Length of one cached segment. Seeks are served from the start of the segment containing the target time.
+SEGMENT_SECONDS = 10
+
+# Output encodings the segment cache can produce. Each entry is (ffmpeg codec args, container format).
+TRANSCODE_PROFILES = {
+    'mpegts': (['-c:v', 'mpeg2video', '-q:v', '4', '-c:a', 'ac3', '-b:a', '192k'], 'mpegts'),
+    # Browser-playable H.264/AAC for the web player's HLS stream. Every segment starts on a keyframe.
+    'hls': (['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p', '-force_key_frames', 'expr:eq(n,0)',
+             '-c:a', 'aac', '-b:a', '160k', '-ac', '2'], 'mpegts'),
+}
+
+_cache = None
+_segment_locks = KeyedLocks()
+
+def init_cache():
+    """Creates the segment cache using the configured size limit. A limit of 0 disables it."""
+    global _cache
+    max_bytes = int(config.settings.get("transcode_cache_size_mb", 10240)) * 1024 * 1024
+    if max_bytes <= 0:
+        _cache = None
+        print("Transcode cache disabled.")
+        return
+    if _cache is not None:
+        _cache.max_bytes = max_bytes
+        _cache.evict()
+        return
+    _cache = DiskLRUCache(config.TRANSCODE_CACHE_DIR, max_bytes)
+
+def is_enabled():
+    return _cache is not None
+
+def _segment_name(file_key, profile, index, audio_index=None):
+    audio_suffix = f"_a{audio_index}" if audio_index is not None else ""
+    return f"{file_key}/{profile}{audio_suffix}_{index:05d}.ts"
+
+def _transcode_segment(video_path, profile, index, output_path, audio_index=None):
+    """
+    Runs ffmpeg for exactly one segment. Timestamps are offset so consecutive segments play back-to-back.
+    audio_index selects an audio stream by its absolute index instead of ffmpeg's default choice.
+    """
+    codec_args, container = TRANSCODE_PROFILES[profile]
+    start = index * SEGMENT_SECONDS
+    map_args = ['-map', '0:v:0', '-map', f'0:{audio_index}'] if audio_index is not None else []
+    ffmpeg_cmd = [
+        media_manager.FFMPEG_PATH, '-hide_banner', '-loglevel', 'error',
+        '-ss', str(start), '-i', video_path, '-t', str(SEGMENT_SECONDS),
+        *map_args, *codec_args,
+        '-output_ts_offset', str(start), '-muxdelay', '0',
+        '-f', container, '-y', output_path
+    ]
+    subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
+
+def ensure_segment(video_path, file_key, profile, index, audio_index=None):
+    """
+    Returns the path of a cached segment, transcoding it first if it is missing.
+    Concurrent requests for the same segment wait for the first one instead of encoding it twice.
+    Returns None if ffmpeg produced nothing (i.e. the index is past the end of the file) or
+    the cache has been turned off in the settings.
+    """
+    cache = _cache  # init_cache can replace or drop the cache while a segment is encoding
+    if cache is None:
+        return None
+    name = _segment_name(file_key, profile, index, audio_index)
+    path = cache.get(name)
+    if path:
+        return path
+
+    with _segment_locks.hold(name):
+        path = cache.get(name)
+        if path:
+            return path
+        temp_path = cache.temp_path_for(name)
+        try:
+            _transcode_segment(video_path, profile, index, temp_path, audio_index)
+            if not os.path.exists(temp_path) or os.path.getsize(temp_path) == 0:
+                return None
+            path = cache.add(name, temp_path)
+            print(f"Transcode cache: stored segment {index} of {os.path.basename(video_path)} ({profile})")
+            return path
+        except Exception as e:
+            print(f"Transcode cache: failed to encode segment {index} of {video_path}: {e}")
+            return None
+        finally:
+            if os.path.exists(temp_path):
+                try: os.remove(temp_path)
+                except OSError: pass
+
+def _prefetch_segment(video_path, file_key, profile, index, segment_count, audio_index=None):
+    if segment_count is not None and index >= segment_count:
+        return
+    Thread(target=ensure_segment, args=(video_path, file_key, profile, index, audio_index), daemon=True).start()
+
+def prefetch_segment(video_path, profile, index, audio_index=None):
+    """Starts encoding a segment in the background so it is ready by the time the player asks for it."""
+    file_key = media_manager.get_file_version_key(video_path)
+    _prefetch_segment(video_path, file_key, profile, index, get_segment_count(video_path), audio_index)
+
+def build_hls_playlist(duration, segment_query=""):
+    """Builds a VOD playlist listing every segment of a file of the given duration."""
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{SEGMENT_SECONDS}',
+             '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-PLAYLIST-TYPE:VOD']
+    for index in range(math.ceil(duration / SEGMENT_SECONDS)):
+        length = min(SEGMENT_SECONDS, duration - index * SEGMENT_SECONDS)
+        lines.append(f'#EXTINF:{length:.3f},')
+        lines.append(f'{index}.ts{segment_query}')
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+def get_segment_count(video_path):
+    """Number of segments for a file, or None if its duration has not been probed yet."""
+    duration = media_manager.get_video_metadata(video_path).get('duration', 0)
+    return math.ceil(duration / SEGMENT_SECONDS) if duration > 0 else None
+
+def stream_segments(video_path, profile='mpegts', start_time=0.0, audio_index=None):
+    """
+    Generator yielding the transcoded stream from start_time onwards. Cached segments
+    are read from disk, missing ones are encoded on demand, and the next segment is
+    encoded in the background while the current one is being sent.
+    """
+    file_key = media_manager.get_file_version_key(video_path)
+    segment_count = get_segment_count(video_path)
+    index = int(max(start_time, 0) // SEGMENT_SECONDS)
+
+    while segment_count is None or index < segment_count:
+        path = ensure_segment(video_path, file_key, profile, index, audio_index)
+        if not path:
+            break
+        _prefetch_segment(video_path, file_key, profile, index + 1, segment_count, audio_index)
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    yield chunk
+        except OSError as e:
+            print(f"Transcode cache: could not read segment {path}: {e}")
+            break
+        index += 1
+
+def get_segment_start(start_time):
+    """Returns the actual start time of the segment a seek to start_time will be served from."""
+    return (int(max(start_time, 0) // SEGMENT_SECONDS)) * SEGMENT_SECONDS
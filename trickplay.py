@@ -0,0 +1,200 @@
+# trickplay.py
+import os
+import re
+import json
+import math
+import queue
+import subprocess
+from threading import Lock
+
+import config
+import events
+import media_manager
+import system_utils
+from disk_cache import DiskLRUCache
+
+# One preview image every INTERVAL seconds, tiled COLUMNS x ROWS per sprite sheet.
+INTERVAL = 10
+TILE_WIDTH = 160
+COLUMNS, ROWS = 10, 10
+
+TRICKPLAY_QUEUE = queue.Queue()
+
+_cache = None
+_queued_keys = set()
+_state_lock = Lock()
+
+def init_cache():
+    """Creates the sprite sheet cache using the configured size limit."""
+    global _cache
+    max_bytes = int(config.settings.get("trickplay_cache_size_mb", 1024)) * 1024 * 1024
+    if _cache is not None:
+        _cache.max_bytes = max_bytes
+        _cache.evict()
+        return
+    _cache = DiskLRUCache(config.TRICKPLAY_CACHE_DIR, max_bytes)
+
+def _tile_height(metadata):
+    """Height of one preview tile, keeping the video's aspect ratio (even, as mjpeg with yuv420 requires)."""
+    width, height = metadata.get('width', 0), metadata.get('height', 0)
+    if not width or not height:
+        return TILE_WIDTH * 9 // 16
+    return max(2, round(TILE_WIDTH * height / width / 2) * 2)
+
+def _sheet_name(file_key, sheet):
+    return f"{file_key}/sprite_{sheet:03d}.jpg"
+
+def _manifest_name(file_key):
+    return f"{file_key}/sheets.json"
+
+def _read_manifest(file_key):
+    """
+    What the last generation of a file version produced: {'sheets': n}, or {'sheets': 0,
+    'failed': True} if ffmpeg failed. None if the file was never processed (or it was evicted).
+    """
+    path = _cache.get(_manifest_name(file_key))
+    if not path:
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_manifest(file_key, manifest):
+    temp_path = _cache.temp_path_for(_manifest_name(file_key))
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f)
+    _cache.add(_manifest_name(file_key), temp_path)
+
+def _layout(metadata):
+    """Returns (number of previews, number of sheets) for a file."""
+    frame_count = math.ceil(metadata.get('duration', 0) / INTERVAL)
+    return frame_count, math.ceil(frame_count / (COLUMNS * ROWS))
+
+def _build_index(file_key, metadata, sheet_count):
+    """Builds the WebVTT index mapping each time range to a tile of one of the sprite sheets ffmpeg produced."""
+    tile_height = _tile_height(metadata)
+    duration = metadata['duration']
+    frame_count = min(_layout(metadata)[0], sheet_count * COLUMNS * ROWS)
+    lines = ['WEBVTT', '']
+    for frame in range(frame_count):
+        start, end = frame * INTERVAL, min((frame + 1) * INTERVAL, duration)
+        sheet, position = divmod(frame, COLUMNS * ROWS)
+        x, y = (position % COLUMNS) * TILE_WIDTH, (position // COLUMNS) * tile_height
+        lines.append(f"{_format_vtt_time(start)} --> {_format_vtt_time(end)}")
+        lines.append(f"/trickplay/{_sheet_name(file_key, sheet)}#xywh={x},{y},{TILE_WIDTH},{tile_height}")
+        lines.append('')
+    return '\n'.join(lines)
+
+def _format_vtt_time(seconds):
+    hours, remainder = divmod(seconds, 3600)
+    minutes, secs = divmod(remainder, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{secs:06.3f}"
+
+def get_index(video_path):
+    """
+    Returns the WebVTT index for a file if all of its sprite sheets are cached. Otherwise
+    queues the file for generation (when enabled, and unless it already failed for this
+    file version) and returns None.
+    """
+    if _cache is None:
+        return None
+    metadata = media_manager.get_video_metadata(video_path)
+    if not metadata.get('duration'):
+        return None
+    file_key = media_manager.get_file_version_key(video_path)
+    manifest = _read_manifest(file_key)
+    if manifest and manifest.get('failed'):
+        return None
+    if manifest and all(_cache.get(_sheet_name(file_key, sheet)) for sheet in range(manifest['sheets'])):
+        return _build_index(file_key, metadata, manifest['sheets'])
+    queue_file(video_path, file_key)
+    return None
+
+def generation_failed(video_path):
+    """True if previews could not be generated for the current version of a file; it is not retried."""
+    if _cache is None:
+        return False
+    manifest = _read_manifest(media_manager.get_file_version_key(video_path))
+    return bool(manifest and manifest.get('failed'))
+
+def get_sheet_path(file_key, sheet_file):
+    """Returns the on-disk path of a cached sprite sheet, or None."""
+    if _cache is None:
+        return None
+    return _cache.get(f"{file_key}/{sheet_file}")
+
+def queue_file(video_path, file_key):
+    if not config.settings.get("enable_trickplay", True):
+        return
+    with _state_lock:
+        if file_key in _queued_keys:
+            return
+        _queued_keys.add(file_key)
+    TRICKPLAY_QUEUE.put((video_path, file_key))
+
+def _generate_sheets(video_path, file_key):
+    """
+    Renders every sprite sheet of a file in a single ffmpeg pass. Only keyframes are decoded;
+    the fps filter repeats or drops them to get one preview per INTERVAL. Like pre-transcoding,
+    the pass is suspended while anything is being streamed.
+    """
+    metadata = media_manager.probe_now(video_path)
+    _, sheet_count = _layout(metadata)
+    if sheet_count == 0:
+        return
+    output_pattern = _cache.temp_path_for(_sheet_name(file_key, 0)).replace('sprite_000', 'sprite_%03d')
+    output_dir = os.path.dirname(output_pattern)
+    ffmpeg_cmd = [
+        media_manager.FFMPEG_PATH, '-hide_banner', '-loglevel', 'error',
+        '-skip_frame', 'nokey', '-i', video_path, '-map', '0:v:0', '-an', '-sn',
+        '-vf', f"fps=1/{INTERVAL},scale={TILE_WIDTH}:{_tile_height(metadata)},tile={COLUMNS}x{ROWS}",
+        '-c:v', 'mjpeg', '-q:v', '5', '-start_number', '0', '-f', 'image2', '-y', output_pattern
+    ]
+    try:
+        process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        system_utils.set_low_priority(process.pid)
+        return_code = system_utils.run_paused_while_streaming(process, "Trickplay")
+        if return_code != 0:
+            raise RuntimeError(f"ffmpeg exited with code {return_code}")
+        # The fps filter does not always produce exactly duration / INTERVAL frames, so the sheets
+        # that were actually written count, not the ones the duration suggests.
+        produced = 0
+        while os.path.exists(_cache.temp_path_for(_sheet_name(file_key, produced))):
+            _cache.add(_sheet_name(file_key, produced), _cache.temp_path_for(_sheet_name(file_key, produced)))
+            produced += 1
+        if not produced:
+            raise RuntimeError("ffmpeg wrote no sprite sheets")
+        _write_manifest(file_key, {'sheets': produced})
+        print(f"Trickplay: generated {produced} sprite sheets for {os.path.basename(video_path)}")
+    except Exception:
+        _write_manifest(file_key, {'sheets': 0, 'failed': True})
+        raise
+    finally:
+        # Sheets beyond the first gap (or of a failed run) are not kept.
+        leftovers = [name for name in os.listdir(output_dir) if re.fullmatch(r'sprite_\d{3}\.jpg\.tmp', name)]
+        for name in leftovers:
+            try: os.remove(os.path.join(output_dir, name))
+            except OSError: pass
+
+def trickplay_worker():
+    """Worker thread that processes videos from the TRICKPLAY_QUEUE, one at a time."""
+    print("Trickplay background worker started.")
+    while True:
+        try:
+            item = TRICKPLAY_QUEUE.get()
+            if item is None: break # Sentinel value to stop
+            video_path, file_key = item
+            try:
+                _generate_sheets(video_path, file_key)
+            except Exception as e:
+                print(f"Trickplay generation failed for {video_path}: {e}")
+            finally:
+                with _state_lock:
+                    _queued_keys.discard(file_key)
+                # The web player waiting for this file's previews fetches the index again.
+                events.publish('trickplay', {'path': video_path})
+            TRICKPLAY_QUEUE.task_done()
+        except Exception as e:
+            print(f"An error occurred in the trickplay worker: {e}")
@@ -1,22 +1,41 @@
 # upnp_handler.py
 import os
+import re
+import gzip
 import xml.etree.ElementTree as ET
 import html
 import base64
 import hashlib
 import time
 from urllib.parse import quote
-from threading import Thread
+from collections import OrderedDict
+from threading import Thread, Lock
 from flask import make_response
 import requests
 
 import config
 import media_manager
 import network_services
+import device_profiles
+import pretranscode
+import search_index
+import object_ids
 
 # Constants
 WMP_SERVER_STRING = 'Microsoft-Windows/10.0 UPnP/1.0 WMP/12.0'
 
+# Search criteria properties that are answered from the search index; anything else is ignored.
+SEARCH_CAPABILITIES = 'dc:title,upnp:class'
+_CONTAINS_RE = re.compile(r'(?:dc|upnp):\w+\s+contains\s+"((?:[^"\\]|\\.)*)"', re.IGNORECASE)
+_CLASS_RE = re.compile(r'upnp:class\s+(?:derivedfrom|=)\s+"([^"]*)"', re.IGNORECASE)
+
+# Recently built Browse responses. Renderers re-request the same containers constantly (every
+# time the user goes back a level), so the DIDL is rebuilt only when something changed: the
+# library or playback generation, or the container's mtime (for changes no watcher event reported).
+BROWSE_MEMO_SIZE = 64
+_browse_memo = OrderedDict()
+_browse_memo_lock = Lock()
+
 def _send_upnp_notification(sid):
     """Sends a single NOTIFY message to a subscriber in a background thread."""
     with config.upnp_state_lock:
@@ -69,6 +88,7 @@ def _send_upnp_notification(sid):
 
 def trigger_upnp_refresh():
     """Increments the update ID and notifies all subscribers."""
+    config.bump_library_generation()
     with config.upnp_state_lock:
         config.system_update_id += 1
         print(f"UPnP Event: Content changed. SystemUpdateID is now {config.system_update_id}")
@@ -86,9 +106,14 @@ def handle_upnp_control(request, service_name):
         action_name = action_node.tag.split('}')[-1] if action_node is not None else ''
         print(f"SOAP: Received action '{action_name}' for service '{service_name}'")
         client_ip = request.remote_addr
+        profile = device_profiles.get_client_profile(request)
         response_body = ""
         if action_name == 'Browse':
-            response_body = _handle_browse(action_node, client_ip)
+            response_body = _handle_browse(action_node, client_ip, profile)
+        elif action_name == 'Search':
+            response_body = _handle_search(action_node, client_ip, profile)
+        elif action_name == 'GetSearchCapabilities':
+            response_body = f'<u:GetSearchCapabilitiesResponse xmlns:u="urn:schemas-upnp-org:service:ContentDirectory:1"><SearchCaps>{SEARCH_CAPABILITIES}</SearchCaps></u:GetSearchCapabilitiesResponse>'
         elif action_name == 'X_SetBookmark':
             _handle_set_bookmark(action_node, client_ip)
             response_body = f'<u:{action_name}Response xmlns:u="{namespaces["u"]}"></u:{action_name}Response>'
@@ -102,18 +127,124 @@ def handle_upnp_control(request, service_name):
             if action_name: print(f"!!! WARNING: Received unrecognized SOAP action: '{action_name}'")
             response_body = f'<u:{action_name}Response xmlns:u="{namespaces["u"]}"></u:{action_name}Response>' if action_name else ''
         response_xml = f'<?xml version="1.0" encoding="utf-8"?><s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body>{response_body}</s:Body></s:Envelope>'
-        response = make_response(response_xml.encode('utf-8'))
+        response_data = response_xml.encode('utf-8')
+        if 'gzip' in request.headers.get('Accept-Encoding', '') and len(response_data) > 1024:
+            response = make_response(gzip.compress(response_data, 6)); response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = make_response(response_data)
         response.headers['Content-Type'] = 'text/xml; charset="utf-8"'; response.headers['Server'] = WMP_SERVER_STRING
         return response
     except Exception as e:
         print(f"!!! SOAP Error processing action '{action_name}': {e}"); return "Internal Server Error", 500
 
-def _handle_browse(action_node, client_ip):
+def _handle_browse(action_node, client_ip, profile=None):
     object_id = action_node.find('ObjectID').text
     browse_flag = action_node.find('BrowseFlag').text
+    profile_name = profile['name'] if profile else None
+    container_mtime = _object_mtime(object_id)
+    with config.generation_lock:
+        memo_key = (object_id, browse_flag, profile_name, client_ip, config.library_generation, config.playback_generation, container_mtime)
+    with _browse_memo_lock:
+        if memo_key in _browse_memo:
+            _browse_memo.move_to_end(memo_key)
+            return _browse_memo[memo_key]
+    response_body = _build_browse_response(object_id, browse_flag, client_ip, profile)
+    with _browse_memo_lock:
+        _browse_memo[memo_key] = response_body
+        while len(_browse_memo) > BROWSE_MEMO_SIZE:
+            _browse_memo.popitem(last=False)
+    return response_body
+
+def _object_mtime(object_id):
+    """The mtimes of the folder or file an object ID refers to (every media folder for the root)."""
+    if object_id == object_ids.ROOT_ID:
+        paths = config.settings.get("media_folders", [])
+    else:
+        path = _resolve_object_id(object_id)
+        paths = [path] if path else []
+    mtimes = []
+    for path in paths:
+        try: mtimes.append(os.stat(path).st_mtime_ns)
+        except OSError: mtimes.append(None)
+    return tuple(mtimes)
+
+def _search_kind(search_criteria):
+    """
+    Maps the upnp:class conditions of a search to search_index.VIDEO, FOLDER or None (both).
+    Returns False if only classes this server has none of (audio, images) are asked for.
+    """
+    classes = [c.lower() for c in _CLASS_RE.findall(search_criteria)]
+    if not classes:
+        return None
+    wants_video = any(c in ('object.item', 'object.item.videoitem') or c.startswith('object.item.videoitem') for c in classes)
+    wants_folder = any(c.startswith('object.container') for c in classes)
+    if wants_video and wants_folder: return None
+    if wants_video: return search_index.VIDEO
+    if wants_folder: return search_index.FOLDER
+    return False
+
+def _handle_search(action_node, client_ip, profile=None):
+    """
+    Answers a ContentDirectory Search from the search index. Only the words of 'contains'
+    conditions and the upnp:class conditions are used; '*' lists everything in the container.
+    """
+    def arg(name, default=''):
+        node = action_node.find(name)
+        return node.text if node is not None and node.text else default
+    container_id, search_criteria = arg('ContainerID', '0'), arg('SearchCriteria', '*')
+    starting_index = max(0, int(arg('StartingIndex', '0')))
+    requested_count = int(arg('RequestedCount', '0')) or 1000
+    within = None
+    if container_id != object_ids.ROOT_ID:
+        within = _resolve_object_id(container_id)
+        if within is None: requested_count = 0
+    kind = _search_kind(search_criteria)
+    query = ' '.join(term.replace('\\"', '"') for term in _CONTAINS_RE.findall(search_criteria))
+    total, results = (0, []) if kind is False or not requested_count else search_index.search(query, within, kind, starting_index, requested_count)
+    didl_items = ""
+    for result in results:
+        parent_id = _parent_id(result['path'])
+        if result['kind'] == search_index.FOLDER:
+            didl_items += _container_xml(object_ids.id_for(result['path']), parent_id, result['name'])
+        else:
+            video = {'path': result['path'], 'name': result['name'], 'thumb_hash': hashlib.md5(result['path'].encode()).hexdigest(),
+                     'duration': (media_manager.get_cached_metadata(result['path']) or {}).get('duration', 0)}
+            didl_items += _create_video_item_xml(video, parent_id, client_ip, profile)
+    didl_lite_string = f'<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/" xmlns:dlna="urn:schemas-dlna-org:metadata-1-0/" xmlns:sec="http://www.sec.co.kr/dlna/">{didl_items}</DIDL-Lite>'
+    with config.upnp_state_lock:
+        current_update_id = config.system_update_id
+    return f'<u:SearchResponse xmlns:u="urn:schemas-upnp-org:service:ContentDirectory:1"><Result>{html.escape(didl_lite_string)}</Result><NumberReturned>{len(results)}</NumberReturned><TotalMatches>{total}</TotalMatches><UpdateID>{current_update_id}</UpdateID></u:SearchResponse>'
+
+def _resolve_object_id(object_id):
+    """
+    The path of a folder or video object ID, or None. IDs from object_ids need no checks;
+    old-style IDs (the base64-encoded path) still work for renderers that cached them.
+    """
+    path = object_ids.path_for(object_id)
+    if path is not None or object_id.isdigit():
+        return path
+    try:
+        path = base64.b64decode(object_id, validate=True).decode()
+    except ValueError:
+        return None
+    return path if path and media_manager.is_safe_path(path) else None
+
+def _parent_id(path):
+    """Object ID of the container a folder or video is listed in."""
+    media_folders = config.settings.get("media_folders", [])
+    normalized = {os.path.normcase(os.path.normpath(folder)): folder for folder in media_folders}
+    if os.path.normcase(os.path.normpath(path)) in normalized:
+        return object_ids.ROOT_ID
+    parent_path = os.path.dirname(path)
+    return object_ids.id_for(normalized.get(os.path.normcase(os.path.normpath(parent_path)), parent_path))
+
+def _container_xml(item_id, parent_id, title):
+    return f'<container id="{item_id}" parentID="{parent_id}" restricted="1"><dc:title>{html.escape(title)}</dc:title><upnp:class>object.container.storageFolder</upnp:class></container>'
+
+def _build_browse_response(object_id, browse_flag, client_ip, profile=None):
     didl_items, item_count = "", 0
-    if browse_flag == 'BrowseDirectChildren': didl_items, item_count = _browse_direct_children(object_id, client_ip)
-    elif browse_flag == 'BrowseMetadata': didl_items, item_count = _browse_metadata(object_id, client_ip)
+    if browse_flag == 'BrowseDirectChildren': didl_items, item_count = _browse_direct_children(object_id, client_ip, profile)
+    elif browse_flag == 'BrowseMetadata': didl_items, item_count = _browse_metadata(object_id, client_ip, profile)
     didl_lite_string = f'<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/" xmlns:dlna="urn:schemas-dlna-org:metadata-1-0/" xmlns:sec="http://www.sec.co.kr/dlna/">{didl_items}</DIDL-Lite>'
     result_xml = html.escape(didl_lite_string)
     # === THE FIX: Use the live system_update_id instead of a hardcoded '1' ===
@@ -138,70 +269,175 @@ def _handle_set_bookmark(action_node, client_ip):
         if object_id_node is None or position_node is None: return
         object_id, position_str = object_id_node.text, position_node.text
         position_sec = float(position_str) / 1000.0
-        video_path = base64.b64decode(object_id).decode(); video_hash = hashlib.md5(video_path.encode()).hexdigest()
+        video_path = _resolve_object_id(object_id)
+        if video_path is None: return
+        video_hash = hashlib.md5(video_path.encode()).hexdigest()
         with config.cache_lock:
             if cache_mode == "Global": config.playback_cache[video_hash] = {"last_position": position_sec, "timestamp": time.time()}
             elif cache_mode == "Per IP": config.playback_cache.setdefault(client_ip, {})[video_hash] = {"last_position": position_sec, "timestamp": time.time()}
-        config.save_playback_cache()
+        config.save_playback_cache(); config.bump_playback_generation()
     except Exception as e: print(f"!!! Error processing X_SetBookmark: {e}")
-def _browse_direct_children(object_id, client_ip):
+def _browse_direct_children(object_id, client_ip, profile=None):
     items, count = "", 0
-    if object_id == '0':
+    if object_id == object_ids.ROOT_ID:
         for folder_path in config.settings.get("media_folders", []):
             if os.path.exists(folder_path):
                 folder_name = os.path.basename(folder_path.strip('\\/'))
-                item_id = base64.b64encode(folder_path.encode()).decode()
-                items += f'<container id="{item_id}" parentID="0" restricted="1"><dc:title>{html.escape(folder_name)}</dc:title><upnp:class>object.container.storageFolder</upnp:class></container>'
+                items += _container_xml(object_ids.id_for(folder_path), object_ids.ROOT_ID, folder_name)
                 count += 1
     else:
         try:
-            current_path = base64.b64decode(object_id).decode()
-            if not media_manager.is_safe_path(current_path): return "", 0
+            current_path = _resolve_object_id(object_id)
+            if current_path is None: return "", 0
             contents = media_manager.scan_directory(current_path)
             for folder in contents['folders']:
-                item_id = base64.b64encode(folder['path'].encode()).decode()
-                items += f'<container id="{item_id}" parentID="{object_id}" restricted="1"><dc:title>{html.escape(folder["name"])}</dc:title><upnp:class>object.container.storageFolder</upnp:class></container>'
+                items += _container_xml(object_ids.id_for(folder['path']), object_id, folder['name'])
                 count += 1
-            for video in contents['files']: items += _create_video_item_xml(video, object_id, client_ip); count += 1
+            for video in contents['files']: items += _create_video_item_xml(video, object_id, client_ip, profile); count += 1
         except Exception as e: print(f"Error browsing children of '{object_id}': {e}"); return "", 0
     return items, count
-def _browse_metadata(object_id, client_ip):
-    if object_id == '0': return '<container id="0" parentID="-1" restricted="1"><dc:title>Root</dc:title><upnp:class>object.container.storageFolder</upnp:class></container>', 1
+def _browse_metadata(object_id, client_ip, profile=None):
+    if object_id == object_ids.ROOT_ID: return _container_xml(object_ids.ROOT_ID, '-1', 'Root'), 1
     try:
-        current_path = base64.b64decode(object_id).decode()
-        if not media_manager.is_safe_path(current_path): return "", 0
+        current_path = _resolve_object_id(object_id)
+        if current_path is None: return "", 0
         if os.path.isfile(current_path):
-            parent_path = os.path.dirname(current_path); parent_id_b64 = base64.b64encode(parent_path.encode()).decode()
             metadata = media_manager.get_video_metadata(current_path); thumb_hash = hashlib.md5(current_path.encode()).hexdigest()
             video_info = {'path': current_path, 'name': os.path.splitext(os.path.basename(current_path))[0], 'thumb_hash': thumb_hash, 'duration': metadata.get('duration', 0)}
-            item = _create_video_item_xml(video_info, parent_id_b64, client_ip)
+            item = _create_video_item_xml(video_info, _parent_id(current_path), client_ip, profile)
             return item, 1
         else:
-            folder_name = os.path.basename(current_path.strip('/\\')); parent_path = os.path.dirname(current_path); parent_id_b64 = '0'
-            is_parent_a_root_folder = any(os.path.samefile(parent_path, p) for p in config.settings.get("media_folders", []))
-            if not is_parent_a_root_folder: parent_id_b64 = base64.b64encode(parent_path.encode()).decode()
-            item = f'<container id="{object_id}" parentID="{parent_id_b64}" restricted="1"><dc:title>{html.escape(folder_name)}</dc:title><upnp:class>object.container.storageFolder</upnp:class></container>'
+            folder_name = os.path.basename(current_path.strip('/\\'))
+            item = _container_xml(object_id, _parent_id(current_path), folder_name)
             return item, 1
     except Exception as e: print(f"Error getting metadata for '{object_id}': {e}"); return "", 0
-def _create_video_item_xml(video, parent_object_id, client_ip):
+
+# H.264 profiles DLNA AVC media profiles allow, and the highest level (level_idc) of the SD and HD ones.
+DLNA_AVC_PROFILES = ('baseline', 'constrained baseline', 'main', 'high')
+DLNA_AVC_MAX_LEVEL = {'SD': 30, 'HD': 41}
+
+def _dlna_avc_profile(container, audio_codec, hd, high):
+    """DLNA.ORG_PN for H.264 video; High profile streams only get the HP_ profiles."""
+    if container in ('mp4', 'mov'):
+        if audio_codec == 'aac': return 'AVC_MP4_HP_HD_AAC' if hd else (None if high else 'AVC_MP4_MP_SD_AAC_MULT5')
+        if high: return None
+        if audio_codec == 'ac3' and not hd: return 'AVC_MP4_MP_SD_AC3'
+        if audio_codec == 'mp3' and not hd: return 'AVC_MP4_MP_SD_MPEG1_L3'
+    elif container == 'mkv':
+        if audio_codec == 'aac': return 'AVC_MKV_HP_HD_AAC_MULT5' if hd or high else 'AVC_MKV_MP_HD_AAC_MULT5'
+        if audio_codec == 'ac3': return 'AVC_MKV_HP_HD_AC3' if hd or high else 'AVC_MKV_MP_HD_AC3'
+    elif container == 'mpegts':
+        if high and not hd: return None
+        if audio_codec == 'aac': return f"AVC_TS_{'HP' if high else 'MP'}_{'HD' if hd else 'SD'}_AAC_MULT5_ISO"
+        if audio_codec == 'ac3': return f"AVC_TS_{'HP' if high else 'MP'}_{'HD' if hd else 'SD'}_AC3_ISO"
+    return None
+
+def get_dlna_profile(container, video_codec, audio_codec, height, video_profile=None, video_level=None):
+    """
+    Maps a container/codec combination to its DLNA.ORG_PN media profile, or None if there is no
+    matching profile. H.264 streams whose profile or level exceeds what the DLNA profile allows
+    get no PN; a profile or level that was not probed is not held against the file.
+    """
+    hd = height > 576
+    if video_codec == 'h264':
+        if video_profile and video_profile.lower() not in DLNA_AVC_PROFILES: return None
+        pn = _dlna_avc_profile(container, audio_codec, hd, (video_profile or '').lower() == 'high')
+        if pn and video_level and video_level > 0 and video_level > DLNA_AVC_MAX_LEVEL['SD' if '_SD_' in pn else 'HD']: return None
+        return pn
+    elif video_codec == 'mpeg2video':
+        if container == 'mpegts': return 'MPEG_TS_HD_NA_ISO' if hd else ('MPEG_TS_SD_EU_ISO' if height == 576 else 'MPEG_TS_SD_NA_ISO')
+        if container == 'mpg': return 'MPEG_PS_PAL' if height == 576 else 'MPEG_PS_NTSC'
+    return None
+
+def get_delivered_format(delivery, video_path, metadata):
+    """
+    Returns (container, video_codec, audio_codec, video_profile, video_level) of what a client
+    receives for a given delivery method.
+    """
+    if delivery == device_profiles.TRANSCODE: return 'mpegts', 'mpeg2video', 'ac3', None, None
+    if delivery == device_profiles.PREPARED:
+        # H.264 is copied into the prepared MP4; anything else is encoded with libx264's default High profile.
+        if metadata.get('video_codec') in pretranscode.MP4_VIDEO_CODECS: return 'mp4', 'h264', 'aac', metadata.get('video_profile'), metadata.get('video_level')
+        return 'mp4', 'h264', 'aac', 'High', None
+    container = 'mpegts' if delivery == device_profiles.REMUX else device_profiles.container_of(video_path)
+    return container, metadata.get('video_codec'), metadata.get('audio_codec'), metadata.get('video_profile'), metadata.get('video_level')
+
+def get_dlna_pn_param(delivery, video_path, metadata):
+    """The 'DLNA.ORG_PN=...;' part of a protocolInfo/contentFeatures string, or '' when no profile applies."""
+    container, video_codec, audio_codec, video_profile, video_level = get_delivered_format(delivery, video_path, metadata)
+    pn = get_dlna_profile(container, video_codec, audio_codec, metadata.get('height', 0), video_profile, video_level)
+    return f"DLNA.ORG_PN={pn};" if pn else ""
+
+def _create_media_res_attrs(delivery, metadata, audio_channels=None):
+    """
+    Builds the resolution/bitrate/audio attributes of a <res> element from cached probe data,
+    so renderers don't have to open the file to learn them. UPnP expresses bitrate in bytes per second.
+    """
+    attrs = ""
+    if metadata.get('width') and metadata.get('height'): attrs += f' resolution="{metadata["width"]}x{metadata["height"]}"'
+    if delivery in (device_profiles.DIRECT, device_profiles.REMUX) and metadata.get('bitrate'): attrs += f' bitrate="{metadata["bitrate"] // 8}"'
+    channels = audio_channels if audio_channels is not None else metadata.get('audio_channels')
+    if delivery == device_profiles.PREPARED and metadata.get('audio_codec') not in pretranscode.MP4_AUDIO_CODECS: channels = 2
+    if channels: attrs += f' nrAudioChannels="{channels}"'
+    if delivery == device_profiles.TRANSCODE: attrs += ' sampleFrequency="48000"'
+    elif metadata.get('sample_rate'): attrs += f' sampleFrequency="{metadata["sample_rate"]}"'
+    return attrs
+
+def _create_audio_alternate_res(video_path, metadata, delivery, profile, duration_str, primary_ip, server_port):
+    """
+    Builds one extra <res> per non-default audio track so renderers can offer a language choice.
+    Tracks are stream-copied into MPEG-TS, unless the file has to be transcoded anyway.
+    """
+    audio_tracks = metadata.get('audio_tracks', [])
+    if len(audio_tracks) < 2: return ""
+    if delivery == device_profiles.TRANSCODE: mode, alt_delivery, ci = "transcode", device_profiles.TRANSCODE, 1
+    elif 'mpegts' in profile['containers']: mode, alt_delivery, ci = "remux", device_profiles.REMUX, 0
+    else: return ""
+    default_track = next((t for t in audio_tracks if t.get('default')), audio_tracks[0])
+    base_url = f"http://{primary_ip}:{server_port}/stream/{quote(video_path)}"
+    res_tags = ""
+    for track in audio_tracks:
+        if track is default_track: continue
+        track_metadata = dict(metadata, audio_codec=track.get('codec'))
+        protocol_info = f"http-get:*:video/mpeg:{get_dlna_pn_param(alt_delivery, video_path, track_metadata)}DLNA.ORG_OP=10;DLNA.ORG_CI={ci}"
+        media_attrs = _create_media_res_attrs(alt_delivery, metadata, track.get('channels', 0))
+        res_tags += f'<res protocolInfo="{protocol_info}" duration="{duration_str}"{media_attrs}>{base_url}?{mode}=true&amp;audio={track["index"]}</res>'
+    return res_tags
+
+def _create_video_item_xml(video, parent_object_id, client_ip, profile=None):
     primary_ip = network_services.get_all_local_ips()[0]; server_port = config.settings.get("server_port"); cache_mode = config.settings.get("cache_mode", "Global")
-    item_id = base64.b64encode(video['path'].encode()).decode(); stream_url = f"http://{primary_ip}:{server_port}/stream/{quote(video['path'])}"
-    file_extension = os.path.splitext(video['path'])[1].lower(); transcode_formats_str = config.settings.get("transcode_formats", ""); transcode_formats = [f.strip() for f in transcode_formats_str.split(',') if f.strip()]
-    needs_transcoding = (config.settings.get("enable_transcoding", False) and file_extension in transcode_formats)
-    if needs_transcoding:
-        mime_type = "video/mpeg"; protocol_info = f"http-get:*:{mime_type}:DLNA.ORG_OP=01;DLNA.ORG_CI=1"
-        stream_url += "?transcode=true"; size_attr = "" 
+    item_id = object_ids.id_for(video['path']); stream_url = f"http://{primary_ip}:{server_port}/stream/{quote(video['path'])}"
+    profile = profile or device_profiles.get_default_profile(); metadata = media_manager.get_video_metadata(video['path'])
+    delivery = device_profiles.choose_delivery(profile, video['path'], metadata); prepared_path = None
+    if delivery in (device_profiles.REMUX, device_profiles.TRANSCODE):
+        prepared_path = pretranscode.get_prepared_path(video['path'])
+        if prepared_path: delivery = device_profiles.choose_delivery(profile, video['path'], metadata, prepared_available=True)
+    pn_param = get_dlna_pn_param(delivery, video['path'], metadata); media_attrs = _create_media_res_attrs(delivery, metadata)
+    if delivery == device_profiles.PREPARED:
+        # A background-prepared MP4 exists, so offer it as a regular seekable file.
+        mime_type = "video/mp4"; seeking_flags = "DLNA.ORG_FLAGS=01700000000000000000000000000000"
+        protocol_info = f"http-get:*:{mime_type}:{pn_param}DLNA.ORG_OP=01;DLNA.ORG_CI=1;{seeking_flags}"
+        stream_url += "?prepared=true"; size_attr = f' size="{os.path.getsize(prepared_path)}"'
+    elif delivery == device_profiles.REMUX:
+        # Same streams in a container the device accepts; costs almost no CPU.
+        mime_type = "video/mpeg"; protocol_info = f"http-get:*:{mime_type}:{pn_param}DLNA.ORG_OP=10;DLNA.ORG_CI=0"
+        stream_url += "?remux=true"; size_attr = ""
+    elif delivery == device_profiles.TRANSCODE:
+        mime_type = "video/mpeg"; protocol_info = f"http-get:*:{mime_type}:{pn_param}DLNA.ORG_OP=10;DLNA.ORG_CI=1"
+        stream_url += "?transcode=true"; size_attr = ""
     else:
         mime_type = media_manager.get_mime_type_from_extension(video['path']); seeking_flags = "DLNA.ORG_FLAGS=01700000000000000000000000000000"
-        protocol_info = f"http-get:*:{mime_type}:DLNA.ORG_OP=01;DLNA.ORG_CI=0;{seeking_flags}"; size_attr = f' size="{os.path.getsize(video["path"])}"'
+        protocol_info = f"http-get:*:{mime_type}:{pn_param}DLNA.ORG_OP=01;DLNA.ORG_CI=0;{seeking_flags}"; size_attr = f' size="{os.path.getsize(video["path"])}"'
     duration_str = _format_upnp_duration(video.get('duration', 0)); thumbnail_tag = ""
+    alternate_res = _create_audio_alternate_res(video['path'], metadata, delivery, profile, duration_str, primary_ip, server_port)
     if config.settings.get("generate_thumbnails") and video.get('thumb_hash'):
-        thumb_url = f"http://{primary_ip}:{server_port}/static/.thumbnails/{video['thumb_hash']}.jpg"; thumbnail_tag = f'<upnp:albumArtURI>{thumb_url}</upnp:albumArtURI>'
+        thumb_base = f"http://{primary_ip}:{server_port}/thumb/{video['thumb_hash']}"
+        thumbnail_tag = f'<upnp:albumArtURI dlna:profileID="JPEG_TN">{thumb_base}_tn.jpg</upnp:albumArtURI><upnp:albumArtURI dlna:profileID="JPEG_SM">{thumb_base}.jpg</upnp:albumArtURI>'
     resume_res_attrs, dcm_info_tag = "", ""
     if cache_mode != "Off":
-        video_hash = hashlib.md5(video['path'].encode()).hexdigest(); position = 0
+        video_hash = video.get('thumb_hash') or hashlib.md5(video['path'].encode()).hexdigest(); position = 0
         with config.cache_lock:
             if cache_mode == "Global": position = config.playback_cache.get(video_hash, {}).get("last_position", 0)
             elif cache_mode == "Per IP": position = config.playback_cache.get(client_ip, {}).get(video_hash, {}).get("last_position", 0)
         if position > 1: resume_res_attrs = f' resumePosition="{_format_dlna_duration(position)}"' ; dcm_info_tag = f'<sec:dcmInfo>BM={int(position * 1000)}</sec:dcmInfo>'
-    return (f'<item id="{item_id}" parentID="{parent_object_id}" restricted="1"><dc:title>{html.escape(video["name"])}</dc:title><upnp:class>object.item.videoItem</upnp:class>{thumbnail_tag}{dcm_info_tag}<res protocolInfo="{protocol_info}"{size_attr} duration="{duration_str}"{resume_res_attrs}>{stream_url}</res></item>')
\ No newline at end of file
+    return (f'<item id="{item_id}" parentID="{parent_object_id}" restricted="1"><dc:title>{html.escape(video["name"])}</dc:title><upnp:class>object.item.videoItem</upnp:class>{thumbnail_tag}{dcm_info_tag}<res protocolInfo="{protocol_info}"{size_attr} duration="{duration_str}"{media_attrs}{resume_res_attrs}>{stream_url}</res>{alternate_res}</item>')
\ No newline at end of file
@@ -1,19 +1,28 @@
 # web_server.py
 import os
 import re
+import gzip
 import time
 import hashlib
 import mimetypes
 import subprocess
-import webvtt
+from threading import Thread
 from flask import (Flask, Response, jsonify, make_response, render_template,
-                   send_from_directory, request, g)
+                   send_from_directory, send_file, request, g)
 from waitress import serve
 
 import config
 import media_manager
+import device_profiles
+import pretranscode
+import subtitle_cache
+import trickplay
+import thumbnail_store
+import events
+import transcode_cache
 import upnp_handler
 import network_services
+import search_index
 
 app = Flask(__name__)
 
@@ -21,6 +30,31 @@ app = Flask(__name__)
 def before_request():
     g.settings = config.settings
 
+def _conditional_response(etag_parts, build_response):
+    """
+    Answers with 304 when the client already has the version identified by etag_parts,
+    without building the body. Otherwise builds the response, tags it and gzips it if the
+    client accepts that.
+    """
+    etag = '"' + hashlib.md5('|'.join(str(part) for part in etag_parts).encode()).hexdigest() + '"'
+    if etag in request.headers.get('If-None-Match', ''):
+        response = Response(status=304)
+    else:
+        response = _gzip_response(build_response())
+    response.headers['ETag'] = etag; response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def _gzip_response(response):
+    response.headers['Vary'] = 'Accept-Encoding'
+    if response.status_code != 200 or 'gzip' not in request.headers.get('Accept-Encoding', ''): return response
+    data = response.get_data()
+    if len(data) < 1024: return response
+    response.set_data(gzip.compress(data, 6)); response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+def _library_generation():
+    with config.generation_lock: return config.library_generation
+
 @app.route('/')
 def index():
     return render_template('index.html', server_name=g.settings.get("server_name"))
@@ -29,76 +63,269 @@ def index():
 def device_xml():
     primary_ip = network_services.get_all_local_ips()[0]
     custom_icon_path = os.path.join('static', 'images', config.CUSTOM_ICON_FILENAME)
-    xml_content = render_template('device.xml', server_name=g.settings.get("server_name"), server_uuid=config.SERVER_UUID, server_ip=primary_ip, server_port=g.settings.get("server_port"), custom_icon_exists=os.path.exists(custom_icon_path))
-    return Response(xml_content, mimetype='application/xml')
+    template_args = dict(server_name=g.settings.get("server_name"), server_uuid=config.SERVER_UUID, server_ip=primary_ip, server_port=g.settings.get("server_port"), custom_icon_exists=os.path.exists(custom_icon_path))
+    return _conditional_response(sorted(template_args.items()), lambda: Response(render_template('device.xml', **template_args), mimetype='application/xml'))
 
 @app.route('/stream/<path:filepath>', methods=['GET', 'HEAD'])
 def stream_file(filepath):
     if not media_manager.is_safe_path(filepath): return "Access Denied", 403
     if not os.path.exists(filepath): return "Not Found", 404
+    if request.args.get('prepared') == 'true':
+        prepared_path = pretranscode.get_prepared_path(filepath)
+        if prepared_path: return _serve_file(prepared_path, 'video/mp4', _dlna_pn_param(device_profiles.PREPARED, filepath))
+    audio_index = request.args.get('audio', type=int)
     if request.args.get('transcode') == 'true':
-        ffmpeg_cmd = [media_manager.FFMPEG_PATH, '-i', filepath, '-c:v', 'mpeg2video', '-q:v', '4', '-c:a', 'ac3', '-b:a', '192k', '-f', 'mpegts', '-']
+        if request.method == 'GET' and _starts_playback(): pretranscode.record_play(filepath)
+        if request.args.get('format') == 'mp4': return _stream_transcoded_mp4(filepath, audio_index)
+        return _stream_transcoded(filepath, audio_index)
+    if request.args.get('remux') == 'true' or audio_index is not None:
+        return _stream_remuxed(filepath, audio_index, request.args.get('format', 'mpegts'))
+    return _serve_file(filepath, mimetypes.guess_type(filepath)[0] or 'application/octet-stream', _dlna_pn_param(device_profiles.DIRECT, filepath))
+
+def _dlna_pn_param(delivery, filepath):
+    return upnp_handler.get_dlna_pn_param(delivery, filepath, media_manager.get_video_metadata(filepath))
+
+def _track_stream(chunks):
+    """Wraps a streaming body so background jobs can tell that playback is in progress."""
+    with config.stream_state_lock: config.active_streams += 1
+    try:
+        yield from chunks
+    finally:
+        with config.stream_state_lock: config.active_streams -= 1
+
+def _serve_file(filepath, mime_type, pn_param=""):
+    """Serves a file on disk with HTTP Range support. pn_param is the DLNA.ORG_PN part of contentFeatures."""
+    range_header = request.headers.get('Range', None); file_size = os.path.getsize(filepath)
+    seeking_flags = "01700000000000000000000000000000"; dlna_features = f"{pn_param}DLNA.ORG_OP=01;DLNA.ORG_CI=0;DLNA.ORG_FLAGS={seeking_flags}"
+    headers = {"Content-Type": mime_type, "Accept-Ranges": "bytes", "Server": upnp_handler.WMP_SERVER_STRING, "contentFeatures.dlna.org": dlna_features, "transferMode.dlna.org": "Streaming"}
+    if request.method == 'HEAD':
+        resp = make_response(""); resp.headers.extend(headers); resp.headers['Content-Length'] = str(file_size)
+        return resp
+    byte1, byte2, status = 0, file_size - 1, 200
+    if range_header:
+        match = re.search(r'(\d+)-(\d*)', range_header)
+        if match: groups = match.groups(); byte1 = int(groups[0]); byte2 = int(groups[1]) if groups[1] else file_size - 1
+        if byte2 >= file_size: byte2 = file_size - 1
+        status = 206
+    length = (byte2 - byte1) + 1
+    def generate_range():
+        with open(filepath, 'rb') as f:
+            f.seek(byte1); bytes_to_read = length
+            while bytes_to_read > 0:
+                chunk = f.read(min(bytes_to_read, 65536))
+                if not chunk: break
+                yield chunk; bytes_to_read -= len(chunk)
+    resp = Response(_track_stream(generate_range()), status, mimetype=mime_type, direct_passthrough=True)
+    resp.headers.extend(headers); resp.headers['Content-Length'] = str(length)
+    if status == 206: resp.headers['Content-Range'] = f'bytes {byte1}-{byte2}/{file_size}'
+    return resp
+
+def _starts_playback():
+    """True if a request reads a file from the beginning; Range and time seeks within a playback are not new plays."""
+    range_header = request.headers.get('Range')
+    if range_header and not re.match(r'bytes=0-', range_header.strip()): return False
+    return not _parse_time_seek()
+
+def _parse_time_seek(default=0.0):
+    """Reads a seek target in seconds from the DLNA TimeSeekRange header or a ?start= query parameter."""
+    time_seek = request.headers.get('TimeSeekRange.dlna.org', '')
+    match = re.search(r'npt=(\d+(?:\.\d+)?|\d+:\d{2}:\d{2}(?:\.\d+)?)-', time_seek)
+    if match:
+        value = match.group(1)
+        if ':' in value:
+            hours, minutes, seconds = value.split(':')
+            return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        return float(value)
+    try: return float(request.args.get('start', default))
+    except ValueError: return default
+
+def _stream_transcoded(filepath, audio_index=None):
+    """Serves a transcoded MPEG-TS stream, from the segment cache when it is enabled."""
+    dlna_features = f"{_dlna_pn_param(device_profiles.TRANSCODE, filepath)}DLNA.ORG_OP=10;DLNA.ORG_CI=1;DLNA.ORG_FLAGS=01700000000000000000000000000000"
+    headers = {"Server": upnp_handler.WMP_SERVER_STRING, "contentFeatures.dlna.org": dlna_features, "transferMode.dlna.org": "Streaming"}
+    if request.method == 'HEAD':
+        resp = make_response(""); resp.headers.extend(headers); resp.headers['Content-Type'] = 'video/mpeg'
+        return resp
+    if not transcode_cache.is_enabled():
+        map_args = ['-map', '0:v:0', '-map', f'0:{audio_index}'] if audio_index is not None else []
+        ffmpeg_cmd = [media_manager.FFMPEG_PATH, '-i', filepath, *map_args, '-c:v', 'mpeg2video', '-q:v', '4', '-c:a', 'ac3', '-b:a', '192k', '-f', 'mpegts', '-']
         try:
             process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return Response(iter(lambda: process.stdout.read(8192), b''), mimetype='video/mpeg')
-        except Exception as e: return f"Error starting transcoder: {e}", 500
-    else:
-        range_header = request.headers.get('Range', None); file_size = os.path.getsize(filepath); mime_type = mimetypes.guess_type(filepath)[0] or 'application/octet-stream'
-        seeking_flags = "01700000000000000000000000000000"; dlna_features = f"DLNA.ORG_PN=MPEG_PS_NTSC;DLNA.ORG_OP=01;DLNA.ORG_CI=0;DLNA.ORG_FLAGS={seeking_flags}"
-        headers = {"Content-Type": mime_type, "Accept-Ranges": "bytes", "Server": upnp_handler.WMP_SERVER_STRING, "contentFeatures.dlna.org": dlna_features, "transferMode.dlna.org": "Streaming"}
-        if request.method == 'HEAD':
-            resp = make_response(""); resp.headers.extend(headers); resp.headers['Content-Length'] = str(file_size)
-            return resp
-        if not range_header:
-            resp = Response(iter(lambda: open(filepath, "rb").read(65536), b''), mimetype=mime_type); resp.headers.extend(headers); resp.headers['Content-Length'] = str(file_size)
-            return resp
-        else:
-            byte1, byte2 = 0, None; match = re.search(r'(\d+)-(\d*)', range_header)
-            if match: groups = match.groups(); byte1 = int(groups[0]); byte2 = int(groups[1]) if groups[1] else file_size - 1
-            if byte2 >= file_size: byte2 = file_size - 1
-            length = (byte2 - byte1) + 1
-            def generate_range():
-                with open(filepath, 'rb') as f:
-                    f.seek(byte1); bytes_to_read = length
-                    while bytes_to_read > 0:
-                        chunk = f.read(min(bytes_to_read, 65536))
-                        if not chunk: break
-                        yield chunk; bytes_to_read -= len(chunk)
-            resp = Response(generate_range(), 206, mimetype=mime_type, direct_passthrough=True)
-            resp.headers.extend(headers); resp.headers['Content-Range'] = f'bytes {byte1}-{byte2}/{file_size}'; resp.headers['Content-Length'] = str(length)
+            resp = Response(_track_stream(iter(lambda: process.stdout.read(8192), b'')), mimetype='video/mpeg'); resp.headers.extend(headers)
             return resp
+        except Exception as e: return f"Error starting transcoder: {e}", 500
+    start_time = _parse_time_seek()
+    resp = Response(_track_stream(transcode_cache.stream_segments(filepath, 'mpegts', start_time, audio_index)), mimetype='video/mpeg', direct_passthrough=True)
+    resp.headers.extend(headers)
+    if 'TimeSeekRange.dlna.org' in request.headers:
+        duration = media_manager.get_video_metadata(filepath).get('duration', 0)
+        segment_start = transcode_cache.get_segment_start(start_time)
+        resp.headers['TimeSeekRange.dlna.org'] = f"npt={segment_start:.3f}-{duration:.3f}/{duration:.3f}" if duration else f"npt={segment_start:.3f}-"
+    return resp
+
+# Output containers for stream-copy remuxing: (ffmpeg muxer args, mime type). Fragmented MP4 is for the web player.
+REMUX_FORMATS = {
+    'mpegts': (['-f', 'mpegts'], 'video/mpeg'),
+    'mp4': (['-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4'], 'video/mp4'),
+}
+
+def _stream_remuxed(filepath, audio_index=None, container='mpegts'):
+    """
+    Serves the original streams stream-copied into another container, optionally with a
+    different audio track. Used for devices that can't read the source container and for
+    switching audio language without transcoding.
+    """
+    muxer_args, mime_type = REMUX_FORMATS.get(container, REMUX_FORMATS['mpegts'])
+    metadata = media_manager.get_video_metadata(filepath)
+    selected_track = next((t for t in metadata.get('audio_tracks', []) if t['index'] == audio_index), None)
+    if selected_track:
+        # contentFeatures describes the audio track actually sent, not the file's default one.
+        metadata = dict(metadata, audio_codec=selected_track.get('codec'))
+    pn_param = upnp_handler.get_dlna_pn_param(device_profiles.REMUX, filepath, metadata) if container == 'mpegts' else ""
+    dlna_features = f"{pn_param}DLNA.ORG_OP=10;DLNA.ORG_CI=0;DLNA.ORG_FLAGS=01700000000000000000000000000000"
+    headers = {"Server": upnp_handler.WMP_SERVER_STRING, "contentFeatures.dlna.org": dlna_features, "transferMode.dlna.org": "Streaming"}
+    if request.method == 'HEAD':
+        resp = make_response(""); resp.headers.extend(headers); resp.headers['Content-Type'] = mime_type
+        return resp
+    start_time = _parse_time_seek()
+    audio_map = f'0:{audio_index}' if audio_index is not None else '0:a:0?'
+    ffmpeg_cmd = [media_manager.FFMPEG_PATH, '-hide_banner', '-loglevel', 'error', '-ss', str(start_time), '-i', filepath, '-map', '0:v:0', '-map', audio_map, '-c', 'copy', *muxer_args, '-']
+    try:
+        process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except Exception as e: return f"Error starting remux: {e}", 500
+    def generate():
+        try:
+            yield from iter(lambda: process.stdout.read(65536), b'')
+        finally:
+            process.kill()
+    resp = Response(_track_stream(generate()), mimetype=mime_type, direct_passthrough=True); resp.headers.extend(headers)
+    if 'TimeSeekRange.dlna.org' in request.headers:
+        duration = metadata.get('duration', 0)
+        resp.headers['TimeSeekRange.dlna.org'] = f"npt={start_time:.3f}-{duration:.3f}/{duration:.3f}" if duration else f"npt={start_time:.3f}-"
+    return resp
+
+def _stream_transcoded_mp4(filepath, audio_index=None):
+    """
+    Live H.264/AAC transcode into fragmented MP4 from ?start= onwards, for the web player in
+    browsers without native HLS and whenever the transcode cache is off. The player seeks by
+    requesting a new stream, like the remuxed one.
+    """
+    muxer_args, mime_type = REMUX_FORMATS['mp4']
+    if request.method == 'HEAD':
+        return Response("", mimetype=mime_type)
+    codec_args, _ = transcode_cache.TRANSCODE_PROFILES['hls']
+    audio_map = f'0:{audio_index}' if audio_index is not None else '0:a:0?'
+    ffmpeg_cmd = [media_manager.FFMPEG_PATH, '-hide_banner', '-loglevel', 'error', '-ss', str(_parse_time_seek()), '-i', filepath,
+                  '-map', '0:v:0', '-map', audio_map, *codec_args, *muxer_args, '-']
+    try:
+        process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except Exception as e: return f"Error starting transcoder: {e}", 500
+    def generate():
+        try:
+            yield from iter(lambda: process.stdout.read(65536), b'')
+        finally:
+            process.kill()
+    return Response(_track_stream(generate()), mimetype=mime_type, direct_passthrough=True)
+
+@app.route('/hls/<path:filepath>/index.m3u8')
+def hls_playlist(filepath):
+    if not media_manager.is_safe_path(filepath): return "Access Denied", 403
+    if not os.path.exists(filepath): return "Not Found", 404
+    if not transcode_cache.is_enabled(): return "HLS requires the transcode cache", 503
+    duration = media_manager.get_video_metadata(filepath).get('duration', 0) or media_manager.probe_now(filepath).get('duration', 0)
+    if duration <= 0: return "Could not determine duration", 500
+    audio_index = request.args.get('audio', type=int)
+    # Get the first segment going while the player parses the playlist.
+    transcode_cache.prefetch_segment(filepath, 'hls', 0, audio_index)
+    segment_query = f"?audio={audio_index}" if audio_index is not None else ""
+    resp = Response(transcode_cache.build_hls_playlist(duration, segment_query), mimetype='application/vnd.apple.mpegurl')
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+@app.route('/hls/<path:filepath>/<int:index>.ts')
+def hls_segment(filepath, index):
+    if not media_manager.is_safe_path(filepath): return "Access Denied", 403
+    if not os.path.exists(filepath) or not transcode_cache.is_enabled(): return "Not Found", 404
+    with config.stream_state_lock: config.last_segment_request_time = time.time()
+    audio_index = request.args.get('audio', type=int)
+    segment_path = transcode_cache.ensure_segment(filepath, media_manager.get_file_version_key(filepath), 'hls', index, audio_index)
+    if not segment_path: return "Segment not available", 404
+    transcode_cache.prefetch_segment(filepath, 'hls', index + 1, audio_index)
+    return send_file(os.path.abspath(segment_path), mimetype='video/mp2t', conditional=True)
 
 @app.route('/subtitle/<path:sub_path>')
 def serve_subtitle(sub_path):
     if not media_manager.is_safe_path(sub_path): return "Access Denied", 403
     try:
-        return Response(webvtt.from_srt(sub_path).content if sub_path.lower().endswith('.srt') else send_from_directory(os.path.dirname(sub_path), os.path.basename(sub_path), mimetype='text/vtt'), mimetype='text/vtt')
+        return send_file(os.path.abspath(subtitle_cache.get_sidecar_vtt(sub_path)), mimetype='text/vtt', conditional=True)
     except Exception as e: return f"Error processing subtitle: {e}", 500
 
 @app.route('/subtitle/embedded/<path:video_path>/<int:stream_index>')
 def stream_embedded_subtitle(video_path, stream_index):
     if not media_manager.is_safe_path(video_path): return "Access Denied", 403
-    cmd = [media_manager.FFMPEG_PATH, '-i', video_path, '-map', f'0:s:{stream_index}', '-f', 'webvtt', '-']
     try:
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return Response(iter(process.stdout.readline, b''), mimetype='text/vtt')
+        vtt_path = subtitle_cache.get_embedded_vtt(video_path, stream_index)
+        if not vtt_path: return "Subtitle track cannot be converted to WebVTT", 404
+        return send_file(os.path.abspath(vtt_path), mimetype='text/vtt', conditional=True)
     except Exception as e: return f"Error extracting subtitle: {e}", 500
 
+@app.route('/trickplay/<path:filepath>/index.vtt')
+def trickplay_index(filepath):
+    if not media_manager.is_safe_path(filepath): return "Access Denied", 403
+    if not os.path.exists(filepath): return "Not Found", 404
+    index = trickplay.get_index(filepath)
+    if index is None:
+        if not g.settings.get("enable_trickplay", True) or trickplay.generation_failed(filepath): return "Not Found", 404
+        return "Previews are being generated", 202
+    response = Response(index, mimetype='text/vtt'); response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/trickplay/<file_key>/<sheet_file>')
+def trickplay_sheet(file_key, sheet_file):
+    # Sheet URLs contain the file version key, so they never change and can be cached for good.
+    if not re.fullmatch(r'[0-9a-f]{32}', file_key) or not re.fullmatch(r'sprite_\d{3}\.jpg', sheet_file): return "Not Found", 404
+    sheet_path = trickplay.get_sheet_path(file_key, sheet_file)
+    if not sheet_path: return "Not Found", 404
+    response = send_file(os.path.abspath(sheet_path), mimetype='image/jpeg', max_age=31536000, conditional=True)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/thumb/<thumb_key>.jpg')
+def serve_thumbnail(thumb_key):
+    if not re.fullmatch(r'[0-9a-f]{32}(_tn)?', thumb_key): return "Not Found", 404
+    thumbnail = thumbnail_store.get(thumb_key)
+    if not thumbnail: return "Not Found", 404
+    data, etag = thumbnail
+    if etag in request.headers.get('If-None-Match', ''):
+        response = Response(status=304)
+    else:
+        response = Response(data, mimetype='image/jpeg')
+    response.headers['ETag'] = etag; response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response
+
 @app.route('/images/<path:filename>')
 def serve_images(filename): return send_from_directory(os.path.join(app.root_path, 'static', 'images'), filename)
 
 # --- API Routes ---
 @app.route('/api/report_progress', methods=['POST'])
 def api_report_progress():
+    """
+    Accepts one update ({"path", "position"}) or a batch ({"updates": [{"path", "position"}, ...]}).
+    The body is parsed regardless of Content-Type so navigator.sendBeacon() can post it.
+    """
     cache_mode = g.settings.get("cache_mode", "Global")
     if cache_mode == "Off": return jsonify({"status": "cache_disabled"})
-    data = request.json; video_path, position = data.get('path'), data.get('position')
-    if not video_path or position is None: return jsonify({"status": "error", "message": "Missing path or position"}), 400
-    video_hash = hashlib.md5(video_path.encode()).hexdigest()
+    data = request.get_json(force=True, silent=True) or {}
+    updates = data.get('updates', [data] if 'path' in data else [])
+    updates = [u for u in updates if isinstance(u, dict) and u.get('path') and isinstance(u.get('position'), (int, float))]
+    if not updates: return jsonify({"status": "error", "message": "Missing path or position"}), 400
+    now = time.time()
     with config.cache_lock:
-        if cache_mode == "Global": config.playback_cache[video_hash] = {"last_position": position, "timestamp": time.time()}
-        elif cache_mode == "Per IP": config.playback_cache.setdefault(request.remote_addr, {})[video_hash] = {"last_position": position, "timestamp": time.time()}
-    config.save_playback_cache(); return jsonify({"status": "ok"})
+        store = config.playback_cache if cache_mode == "Global" else config.playback_cache.setdefault(request.remote_addr, {})
+        for update in updates:
+            store[hashlib.md5(update['path'].encode()).hexdigest()] = {"last_position": update['position'], "timestamp": now}
+    config.save_playback_cache(); config.bump_playback_generation()
+    return jsonify({"status": "ok", "saved": len(updates)})
 @app.route('/api/get_progress', methods=['POST'])
 def api_get_progress():
     cache_mode = g.settings.get("cache_mode", "Global")
@@ -110,25 +337,97 @@ def api_get_progress():
         if cache_mode == "Global": position = config.playback_cache.get(video_hash, {}).get("last_position", 0)
         elif cache_mode == "Per IP": position = config.playback_cache.get(request.remote_addr, {}).get(video_hash, {}).get("last_position", 0)
     return jsonify({"position": position})
+@app.route('/api/get_progress_batch', methods=['POST'])
+def api_get_progress_batch():
+    """Resume positions and durations for {"paths": [...]} or every video of {"folder": path}, in one lookup."""
+    data = request.get_json(silent=True) or {}
+    if data.get('folder'):
+        if not media_manager.is_safe_path(data['folder']): return jsonify({"error": "Access Denied"}), 403
+        paths = media_manager.list_video_paths(data['folder'])
+    else:
+        paths = [p for p in data.get('paths', []) if isinstance(p, str)][:1000]
+    cache_mode = g.settings.get("cache_mode", "Global")
+    with config.cache_lock:
+        store = {} if cache_mode == "Off" else config.playback_cache if cache_mode == "Global" else config.playback_cache.get(request.remote_addr, {})
+        positions = {p: store.get(hashlib.md5(p.encode()).hexdigest(), {}).get("last_position", 0) for p in paths}
+    items = {p: {"position": positions[p], "duration": (media_manager.get_cached_metadata(p) or {}).get('duration', 0)} for p in paths}
+    return jsonify({"items": items})
 @app.route('/api/get_tracks/<path:video_path>')
 def api_get_tracks(video_path):
     if not media_manager.is_safe_path(video_path): return jsonify({"error": "Access Denied"}), 403
-    return jsonify(media_manager.get_media_tracks(video_path))
+    tracks = media_manager.get_media_tracks(video_path)
+    tracks['duration'] = media_manager.get_video_metadata(video_path).get('duration', 0)
+    return jsonify(tracks)
+@app.route('/api/events')
+def api_events():
+    listener = events.subscribe()
+    if listener is None: return "Too many event streams", 503
+    response = Response(events.stream(listener), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'; response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/refresh_nav', methods=['POST'])
+def api_refresh_nav():
+    # Rescans in the background; connected UIs hear about changes through /api/events.
+    Thread(target=media_manager.scan_all_media_folders, daemon=True).start()
+    return jsonify({"status": "scanning"})
+
 @app.route('/api/get_structure')
-def api_get_structure(): return jsonify(media_manager.get_full_structure())
+def api_get_structure():
+    return _conditional_response(('structure', _library_generation(), *g.settings.get("media_folders", [])), lambda: jsonify(media_manager.get_full_structure()))
 @app.route('/api/browse/')
-def api_browse_root(): return jsonify({'folders': [{'name': os.path.basename(p), 'path': p} for p in g.settings.get("media_folders", [])], 'files': []})
+def api_browse_root():
+    folders = [{'name': os.path.basename(p), 'path': p} for p in g.settings.get("media_folders", [])]
+    return _conditional_response(('root', *g.settings.get("media_folders", [])), lambda: jsonify({'folders': folders, 'files': [], 'next_cursor': None, 'total': len(folders)}))
 @app.route('/api/browse/<path:subpath>')
 def api_browse_subpath(subpath):
+    """Paginated listing: ?cursor=<next_cursor of the previous page>&limit=<n>&fields=name,path,thumb_hash,duration"""
     if not media_manager.is_safe_path(subpath): return jsonify({"error": "Access Denied"}), 403
-    return jsonify(media_manager.scan_directory(subpath))
+    limit = max(1, min(request.args.get('limit', 200, type=int), 1000))
+    fields = set(request.args['fields'].split(',')) if request.args.get('fields') else None
+    try: folder_mtime = os.stat(subpath).st_mtime_ns
+    except OSError: return jsonify({"error": "Not Found"}), 404
+    etag_parts = ('browse', _library_generation(), folder_mtime, subpath, request.query_string.decode())
+    try:
+        return _conditional_response(etag_parts, lambda: jsonify(media_manager.browse_directory(subpath, request.args.get('cursor'), limit, fields)))
+    except (ValueError, TypeError): return jsonify({"error": "Invalid cursor"}), 400
+
+@app.route('/api/search')
+def api_search():
+    """Library search: ?q=<words>&offset=<n>&limit=<n>&path=<folder to search in>. Same item format as /api/browse."""
+    within = request.args.get('path') or None
+    if within and not media_manager.is_safe_path(within): return jsonify({"error": "Access Denied"}), 403
+    limit = max(1, min(request.args.get('limit', 200, type=int), 1000))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    def build():
+        total, results = search_index.search(request.args.get('q', ''), within, None, offset, limit)
+        items = {'folders': [], 'files': [], 'next_cursor': None, 'total': total}
+        for result in results:
+            if result['kind'] == search_index.FOLDER:
+                items['folders'].append({'name': result['name'], 'path': result['path']})
+            else:
+                items['files'].append({'name': result['name'], 'path': result['path'], 'thumb_hash': hashlib.md5(result['path'].encode()).hexdigest()})
+        if offset + limit < total:
+            items['next_cursor'] = str(offset + limit)
+        return jsonify(items)
+    return _conditional_response(('search', _library_generation(), request.query_string.decode()), build)
+
+@app.route('/api/demand', methods=['POST'])
+def api_demand():
+    """The web UI reports which tiles are on screen; their metadata and thumbnails are generated first."""
+    paths = (request.json or {}).get('paths', [])[:200]
+    media_manager.request_demand([p for p in paths if isinstance(p, str) and media_manager.is_safe_path(p) and os.path.isfile(p)])
+    return jsonify({"status": "ok"})
 
 # --- UPNP/DLNA Routes ---
 @app.route('/scpd/<service_name>.xml')
 def serve_scpd(service_name):
     allowed = {'ContentDirectory', 'ConnectionManager', 'X_MS_MediaReceiverRegistrar'}
     if service_name not in allowed: return "Not Found", 404
-    return send_from_directory(os.path.join(app.root_path, 'templates', 'servicedescriptions'), f"{service_name}.xml", mimetype='application/xml')
+    scpd_path = os.path.join(app.root_path, 'templates', 'servicedescriptions', f"{service_name}.xml")
+    def build():
+        with open(scpd_path, 'rb') as f: return Response(f.read(), mimetype='application/xml')
+    return _conditional_response(('scpd', service_name, os.stat(scpd_path).st_mtime_ns), build)
 
 @app.route('/upnp/control/<service_name>', methods=['POST'])
 def upnp_control(service_name): return upnp_handler.handle_upnp_control(request, service_name)
@@ -165,4 +464,5 @@ def upnp_event(service_name):
 # --- Server Runner ---
 def run_server():
     port = config.settings.get("server_port")
-    serve(app, host='0.0.0.0', port=port, threads=8)
\ No newline at end of file
+    # Extra threads on top of the request workers for the long-lived /api/events streams.
+    serve(app, host='0.0.0.0', port=port, threads=8 + events.MAX_SUBSCRIBERS)
\ No newline at end of file